@@ -0,0 +1,87 @@
+"""
+Times a cold import of dougbot.core.bot, the import run.py does before the bot can start, in fresh interpreters so
+nothing is cached in sys.modules, and lists the costliest imports from python -X importtime.
+
+Run from the repository root: python -m benchmarks.cold_import [runs] [module]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from dougbot.config import ROOT_DIR
+
+_TOP_IMPORTS = 15
+
+
+def _import_once(module):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}')
+    return elapsed, result.stderr
+
+
+def _interpreter_once():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], cwd=ROOT_DIR, check=True)
+    return time.perf_counter() - start
+
+
+def _parse_importtime(output):
+    """
+    :return: [(cumulative microseconds, self microseconds, module, importing module)] for the libraries imported by
+    the measured module or by the bot's own modules
+    """
+    imports = []
+    stack = []  # Module at each depth, to find what imported each module
+
+    # Lines read: import time: self [us] | cumulative | imported package
+    # A module is listed after everything it imports, one level less indented, so reading backwards meets it first
+    for line in reversed(output.splitlines()):
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+
+        del stack[depth:]
+        stack.append(name)
+        importer = stack[depth - 1] if depth > 0 else None
+        imports.append((int(cumulative_us), int(self_us), name, importer))
+
+    return [(cumulative, self_us, name, importer) for cumulative, self_us, name, importer in imports
+            if not name.startswith('dougbot') and importer is not None and importer.startswith('dougbot')]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    module = sys.argv[2] if len(sys.argv) > 2 else 'dougbot.core.bot'
+    env_pythonpath = os.environ.get('PYTHONPATH')
+    os.environ['PYTHONPATH'] = ROOT_DIR + (os.pathsep + env_pythonpath if env_pythonpath else '')
+
+    baseline = statistics.median(_interpreter_once() for _ in range(runs))
+
+    timings = []
+    output = None
+    for _ in range(runs):
+        elapsed, output = _import_once(module)
+        timings.append(elapsed)
+
+    print(f'interpreter startup          median {baseline * 1000:7.1f} ms')
+    print(f'import {module:<22} median {statistics.median(timings) * 1000:7.1f} ms   '
+          f'min {min(timings) * 1000:7.1f} ms   max {max(timings) * 1000:7.1f} ms   '
+          f'(import alone ~{(statistics.median(timings) - baseline) * 1000:.1f} ms)')
+
+    print('\nCostliest libraries imported by the bot (last run):')
+    for cumulative, self_us, name, importer in sorted(_parse_importtime(output), reverse=True)[:_TOP_IMPORTS]:
+        print(f'  {name:<40} {cumulative / 1000:8.1f} ms   (by {importer})')
+
+
+if __name__ == '__main__':
+    main()
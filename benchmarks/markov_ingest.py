@@ -0,0 +1,112 @@
+"""
+Times ingesting a synthetic corpus, comparing the original per-symbol str.replace tokenizer and per-trigram
+addWordToDict calls against MarkovChain.addSentences, the path the bot ingests with, at the configured order.
+At order 2 the chain built is checked against the original dictionary.
+
+The request behind this benchmark asked for a 10x speedup, which is not met. Tokenizing the corpus and counting its
+runs, before any of the chain is built, takes more than a tenth of the original time, so it is timed on its own as
+the most any change to the chain can reach.
+
+Run from the repository root: python -m benchmarks.markov_ingest [messages] [order]
+"""
+import asyncio
+import random
+import string
+import sys
+import time
+
+from dougbot import config
+from dougbot.extensions.markov.markov_chain import MarkovChain
+from dougbot.extensions.markov.markov_lib import MarkovLib
+
+_WORDS = ['the', 'doug', 'is', 'sad', 'lol', 'why', 'bot', 'what', 'game', 'tonight', 'who', 'playing', 'no', 'yes',
+          'that', 'was', 'great', 'terrible', 'i', 'you', 'we', 'they', 'it\'s', 'don\'t', 'can\'t', 'maybe']
+_ATTACHED = ['', '', '', '', ',', '.', '!', '?', '...', ')', '"']
+_TARGET = 10  # Speedup asked for over the original ingestion
+
+
+def _corpus(size, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(_WORDS) + rng.choice(_ATTACHED) for _ in range(rng.randint(2, 30)))
+            for _ in range(size)]
+
+
+async def _legacy_add_word(markov_dict, root_one, root_two, leaf_word):
+    if (root_one, root_two) not in markov_dict:
+        markov_dict[(root_one, root_two)] = [0, {leaf_word: 0}]
+    if leaf_word not in markov_dict[(root_one, root_two)][1]:
+        markov_dict[(root_one, root_two)][1][leaf_word] = 0
+    markov_dict[(root_one, root_two)][0] += 1
+    markov_dict[(root_one, root_two)][1][leaf_word] += 1
+
+
+async def _legacy_add_sentence(markov_dict, sentence):
+    for spaced in MarkovLib._SYMBOLS:
+        sentence = sentence.replace(spaced, ' {0} '.format(spaced))
+    sentence_list = sentence.split()
+
+    prev_word_2 = sentence_list[0].lower()
+    word = sentence_list[1].lower()
+    await _legacy_add_word(markov_dict, '', prev_word_2, word)
+
+    for i in range(0, len(sentence_list)):
+        if len(sentence_list) > i + 2:
+            prev_word_1 = sentence_list[i].lower()
+            prev_word_2 = sentence_list[i + 1].lower()
+            word = sentence_list[i + 2].lower()
+            await _legacy_add_word(markov_dict, prev_word_1, prev_word_2, word)
+
+    if word not in string.punctuation:
+        await _legacy_add_word(markov_dict, prev_word_2, word, '.')
+
+
+async def _legacy(corpus):
+    markov_dict = {}
+    for sentence in corpus:
+        await _legacy_add_sentence(markov_dict, sentence)
+    return markov_dict
+
+
+def _chain(corpus, order):
+    chain = MarkovChain(order)
+    chain.addSentences(corpus)
+    return chain
+
+
+def _count(corpus, order):
+    return MarkovLib.countGrams(corpus, order + 1)
+
+
+def _best_of(runs, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    order = int(sys.argv[2]) if len(sys.argv) > 2 else config.get_configuration().markov_order
+    corpus = _corpus(size)
+
+    legacy_secs, legacy_dict = _best_of(3, lambda c: asyncio.run(_legacy(c)), corpus)
+    chain_secs, chain = _best_of(3, _chain, corpus, order)
+    count_secs, _ = _best_of(3, _count, corpus, order)
+
+    if order == 2 and MarkovChain.fromDict(legacy_dict).root != chain.root:
+        print('Mismatch: the chain differs from the original dictionary', file=sys.stderr)
+        sys.exit(1)
+
+    print(f'messages: {size}, order: {order}, states: {chain.stateCount()}')
+    print(f'legacy (order 2): {legacy_secs:.3f}s ({size / legacy_secs:,.0f} msg/s)')
+    print(f'chain (order {order}):  {chain_secs:.3f}s ({size / chain_secs:,.0f} msg/s)')
+    print(f'count only:        {count_secs:.3f}s (at most {legacy_secs / count_secs:.1f}x)')
+    print(f'speedup: {legacy_secs / chain_secs:.1f}x, target {_TARGET}x '
+          f'{"met" if legacy_secs / chain_secs >= _TARGET else "not met"}')
+
+
+if __name__ == '__main__':
+    main()
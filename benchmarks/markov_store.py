@@ -0,0 +1,81 @@
+"""
+Times saving and loading a Markov chain through the chain file format against the original pickle path, and checks
+that every format round-trips the chain exactly.
+
+Run from the repository root: python -m benchmarks.markov_store [messages]
+"""
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+from dougbot.extensions.markov.markov_chain import MarkovChain
+from dougbot.extensions.markov.markov_store import MarkovStore, zstandard
+
+
+def _corpus(size, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(1, 9)))
+                  for _ in range(5000)]
+    return [' '.join(rng.choice(vocabulary) + rng.choice(['', '', '', ',', '.', '!', '?'])
+                     for _ in range(rng.randint(2, 25)))
+            for _ in range(size)]
+
+
+def _pickle_save(chain, path):
+    # The original save_pickle, minus the leaked file handle
+    with open(path, 'wb') as fd:
+        pickle.dump(chain, fd)
+
+
+def _pickle_load(path):
+    with open(path, 'rb') as fd:
+        return pickle.load(fd)
+
+
+def _best_of(runs, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chain = MarkovChain(3)
+    chain.addSentences(_corpus(size))
+    # Compression overlaps pickling only when there's a core free for it
+    print(f'messages: {size}, states: {chain.stateCount():,}, cpus: {os.cpu_count()}')
+
+    candidates = [('pickle', _pickle_save, _pickle_load)]
+    compressions = [MarkovStore.NONE, MarkovStore.ZLIB] + ([MarkovStore.ZSTD] if zstandard else [])
+    for compression in compressions:
+        candidates.append((f'chain/{compression}',
+                           lambda c, p, compression=compression: MarkovStore.write(c, p, compression),
+                           MarkovStore.read))
+        if compression != MarkovStore.NONE:
+            candidates.append((f'chain/{compression}/small',
+                               lambda c, p, compression=compression: MarkovStore.write(c, p, compression, small=True),
+                               MarkovStore.read))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, save, load in candidates:
+            path = os.path.join(directory, name.replace('/', '_'))
+            save_secs, _ = _best_of(3, save, chain, path)
+            load_secs, loaded = _best_of(3, load, path)
+
+            if loaded.order != chain.order or loaded.root != chain.root:
+                print(f'Mismatch: {name} did not round-trip the chain', file=sys.stderr)
+                sys.exit(1)
+
+            megabytes = os.path.getsize(path) / (1 << 20)
+            print(f'{name:<18} size {megabytes:7.2f} MiB   save {save_secs:6.3f}s   load {load_secs:6.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Times formatting message timestamps for log records, comparing the original per-record tz.gettz lookup and conversion
+against timeutils' resolved zone and per-second format cache, and parsing pet date stamps with and without the cache.
+
+Run from the repository root: python -m benchmarks.time_format [records]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from dateutil import tz
+
+from dougbot.common import timeutils
+
+
+def _timestamps(size, spread_secs, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [start + timedelta(seconds=rng.uniform(0, spread_secs)) for _ in range(size)]
+
+
+def _legacy_format(moments):
+    return [f"{moment.astimezone(tz.gettz('America/Chicago'))} CST" for moment in moments]
+
+
+def _cached_format(moments):
+    return [timeutils.format_local(moment) for moment in moments]
+
+
+def _legacy_parse(stamps):
+    return [datetime.strptime(stamp, timeutils.STAMP_FORMAT) for stamp in stamps]
+
+
+def _cached_parse(stamps):
+    return [timeutils.parse_stamp(stamp) for stamp in stamps]
+
+
+def _best_of(runs, func, *args):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _report(name, size, legacy_secs, cached_secs):
+    print(f'{name:<28} legacy {legacy_secs * 1e9 / size:7.0f} ns/record   '
+          f'cached {cached_secs * 1e9 / size:7.0f} ns/record   speedup {legacy_secs / cached_secs:5.1f}x')
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    # A burst of errors shares a handful of seconds; a quiet log has every record in a different second
+    for name, spread_secs in [('burst (records over 60s)', 60), ('distinct seconds', size * 1000)]:
+        moments = _timestamps(size, spread_secs)
+        timeutils.reset_zone()
+        _report(name, size, _best_of(3, _legacy_format, moments), _best_of(3, _cached_format, moments))
+
+    # The pet extension parses the same handful of stored stamps on every command
+    stamps = [timeutils.format_stamp(moment.replace(tzinfo=None)) for moment in _timestamps(8, 86400)] * (size // 8)
+    _report('pet stamps', len(stamps), _best_of(3, _legacy_parse, stamps), _best_of(3, _cached_parse, stamps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Runs external commands without blocking the event loop, streaming their output to the log in batches.
+"""
+import asyncio
+import time
+
+from dougbot.common.logger import Logger
+
+# Seconds to read what's left in the pipes after a timeout; processes the command started may keep them open after the
+# kill, so the rest is given up on rather than waited for
+_DRAIN_SECS = 5
+
+
+class ProcessResult:
+
+    def __init__(self, args, returncode, stdout, stderr, duration_secs, timed_out):
+        """
+        :param returncode: None when the process was killed for taking too long
+        """
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration_secs = duration_secs
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return f'ProcessResult(args={self.args}, returncode={self.returncode}, ' \
+               f'duration_secs={self.duration_secs:.2f}, timed_out={self.timed_out})'
+
+
+class ProcessError(Exception):
+
+    def __init__(self, result):
+        reason = f'timed out after {result.duration_secs:.0f}s' if result.timed_out \
+            else f'exited with {result.returncode}'
+        super().__init__(f"'{' '.join(result.args)}' {reason}")
+        self.result = result
+
+
+async def run(*args, cwd=None, timeout=None, log_output=True, batch_secs=5, check=False):
+    """
+    :param timeout: Seconds before the process is killed; None waits forever
+    :param log_output: Whether to send the output to the log as it is written, a record per batch_secs
+    :param check: Raise ProcessError when the process fails or times out
+    :return: ProcessResult
+    :raises OSError: When the command can't be started
+    """
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+
+    stdout, stderr = [], []
+    batch = _OutputBatch(args) if log_output else None
+    flusher = asyncio.ensure_future(_flush_every(batch, batch_secs)) if batch is not None else None
+    readers = asyncio.ensure_future(_read_output(process, stdout, stderr, batch))
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.shield(readers), timeout)
+        await process.wait()
+    except asyncio.TimeoutError:
+        timed_out = True
+        process.kill()
+        try:
+            # Waiting for the process also waits for its pipes to close
+            await asyncio.wait_for(asyncio.gather(process.wait(), readers), _DRAIN_SECS)
+        except asyncio.TimeoutError:
+            pass  # The readers are cancelled; what they read so far is kept
+    finally:
+        if process.returncode is None:  # Cancelled
+            process.kill()
+            readers.cancel()
+        if flusher is not None:
+            flusher.cancel()
+
+    if batch is not None:
+        batch.flush()
+
+    result = ProcessResult(list(args), None if timed_out else process.returncode, ''.join(stdout), ''.join(stderr),
+                           time.perf_counter() - start, timed_out)
+    if check and not result.ok:
+        raise ProcessError(result)
+    return result
+
+
+async def _read_output(process, stdout, stderr, batch):
+    await asyncio.gather(_read_lines(process.stdout, stdout, batch, ''),
+                         _read_lines(process.stderr, stderr, batch, 'stderr: '))
+
+
+async def _read_lines(stream, lines, batch, prefix):
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+
+        text = line.decode(errors='replace')
+        lines.append(text)
+        if batch is not None:
+            batch.add(prefix + text)
+
+
+async def _flush_every(batch, secs):
+    while True:
+        await asyncio.sleep(secs)
+        batch.flush()
+
+
+class _OutputBatch:
+    """
+    Collects output lines and logs them together, so a chatty command is a few log records rather than one per line
+    """
+
+    def __init__(self, args):
+        self._command = ' '.join(args)
+        self._lines = []
+
+    def add(self, line):
+        self._lines.append(line)
+
+    def flush(self):
+        if not self._lines:
+            return
+
+        Logger(__file__) \
+            .message(f"Output of '{self._command}':\n{''.join(self._lines).rstrip()}") \
+            .info()
+
+        self._lines = []
@@ -0,0 +1,17 @@
+"""
+Errors raised by the Bank cog. They live outside the extension so callers in other extensions keep catching the same
+classes after the bank is reloaded.
+"""
+
+
+class BankError(Exception):
+    pass
+
+
+class InsufficientFundsError(BankError):
+
+    def __init__(self, account_id, balance, amount):
+        super().__init__(f'Account {account_id} has {balance}, needs {amount}')
+        self.account_id = account_id
+        self.balance = balance
+        self.amount = amount
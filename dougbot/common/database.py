@@ -1,42 +1,383 @@
-from mysql.connector import connection
-from mysql.connector.types import Tuple
+"""
+Database access for cogs. get_database() is a bounded pool of connections used from the event loop: every query runs
+on the pool's own threads, so the blocking driver never stalls the bot.
+Its queries take their values as parameters, written as ? in the SQL, never formatted into the SQL string. Each
+connection keeps its recently used statements prepared.
+MySQL is used with the [Environment] login; setting [Database] sqlite_file uses a local SQLite file instead, as a
+stand-in for development and testing.
+"""
+import asyncio
+import contextlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Tuple
 
 from dougbot import config
 
+if TYPE_CHECKING:
+    from mysql.connector import connection
+
+_DATABASE = None
+_DATABASE_LOCK = threading.Lock()
+
+
+class DatabaseError(Exception):
+    pass
+
+
+def get_database():
+    global _DATABASE
+
+    if _DATABASE is None:
+        with _DATABASE_LOCK:
+            if _DATABASE is None:
+                configs = config.get_configuration()
+                if configs.database_sqlite_path:
+                    driver = _SQLiteDriver(configs.database_sqlite_path, configs.database_statement_cache_size)
+                else:
+                    driver = _MySQLDriver(configs.username, configs.password, configs.host, configs.database,
+                                          configs.database_statement_cache_size)
+                _DATABASE = Database(driver, configs.database_pool_size, configs.database_acquire_timeout_secs,
+                                     configs.database_health_check_secs)
+    return _DATABASE
+
+
+async def close_database():
+    """
+    Closes the shared pool, when anything opened it
+    """
+    global _DATABASE
+
+    with _DATABASE_LOCK:
+        database, _DATABASE = _DATABASE, None
+
+    if database is not None:
+        await database.close()
+
+
+class Database:
+
+    def __init__(self, driver, size, acquire_timeout_secs, health_check_secs):
+        """
+        :param size: Most connections open at once; callers beyond that wait for one to be released
+        :param acquire_timeout_secs: How long to wait for a connection before raising DatabaseError
+        :param health_check_secs: Connections idle for longer are checked before being handed out
+        """
+        self._driver = driver
+        self._acquire_timeout_secs = acquire_timeout_secs
+        self._health_check_secs = health_check_secs
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []  # _PooledConnection, most recently released last
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='database')
+        self._closed = False
+        self._close_callbacks = []
+
+    @property
+    def max_params(self):
+        """
+        Most parameters one statement may bind
+        """
+        return self._driver.max_params
+
+    def upsert_clause(self, key_columns, columns):
+        """
+        :return: What follows INSERT ... VALUES so rows whose key exists replace the other columns instead
+        """
+        return self._driver.upsert_clause(key_columns, [column for column in columns if column not in key_columns])
+
+    def on_close(self, callback):
+        """
+        :param callback: Coroutine function awaited when the database closes, while queries still work
+        """
+        self._close_callbacks.append(callback)
+
+    def remove_on_close(self, callback):
+        if callback in self._close_callbacks:
+            self._close_callbacks.remove(callback)
+
+    async def fetch_all(self, sql, params=()):
+        async with self._connection() as conn:
+            return await self._run(conn.fetch_all, sql, params)
+
+    async def fetch_one(self, sql, params=()):
+        """
+        :return: The first row, or None when there are no rows
+        """
+        async with self._connection() as conn:
+            return await self._run(conn.fetch_one, sql, params)
+
+    async def execute(self, sql, params=()):
+        """
+        :return: Number of rows changed
+        """
+        async with self._connection() as conn:
+            return await self._run(conn.execute, sql, params)
+
+    async def execute_many(self, sql, params_seq):
+        async with self._connection() as conn:
+            return await self._run(conn.execute_many, sql, list(params_seq))
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """
+        Holds one connection for a block of queries, committed together when the block ends and rolled back when it
+        raises:
+            async with database.transaction() as tx:
+                await tx.execute(...)
+        """
+        async with self._connection() as conn:
+            await self._run(conn.begin)
+            try:
+                yield Transaction(self, conn)
+            except BaseException:
+                await self._run(conn.rollback)
+                raise
+            await self._run(conn.commit)
+
+    async def close(self):
+        for callback in list(self._close_callbacks):  # Callbacks may remove themselves
+            await callback()
+
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._run(conn.close)
+        self._executor.shutdown(wait=False)
+
+    @contextlib.asynccontextmanager
+    async def _connection(self):
+        if self._closed:
+            raise DatabaseError('Database is closed')
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self._acquire_timeout_secs)
+        except asyncio.TimeoutError:
+            raise DatabaseError(f'No database connection free after {self._acquire_timeout_secs}s') from None
+
+        try:
+            conn = await self._acquire()
+            try:
+                yield conn
+            except BaseException:
+                # A failed query may have been a lost connection; only working connections go back in the pool
+                if not await self._is_healthy(conn):
+                    await self._run(conn.close)
+                    conn = None
+                raise
+            finally:
+                if conn is not None:
+                    conn.last_used = time.monotonic()
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    async def _acquire(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if time.monotonic() - conn.last_used < self._health_check_secs or await self._is_healthy(conn):
+                return conn
+            await self._run(conn.close)
+
+        return _PooledConnection(await self._run(self._driver.connect), self._driver)
+
+    async def _is_healthy(self, conn):
+        try:
+            await self._run(conn.ping)
+            return True
+        except Exception:
+            return False
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+
+class Transaction:
+
+    def __init__(self, database, conn):
+        self._database = database
+        self._conn = conn
+
+    async def fetch_all(self, sql, params=()):
+        return await self._database._run(self._conn.fetch_all, sql, params)
+
+    async def fetch_one(self, sql, params=()):
+        return await self._database._run(self._conn.fetch_one, sql, params)
+
+    async def execute(self, sql, params=()):
+        return await self._database._run(self._conn.execute, sql, params)
+
+    async def execute_many(self, sql, params_seq):
+        return await self._database._run(self._conn.execute_many, sql, list(params_seq))
+
+
+class _PooledConnection:
+    """
+    A driver connection and its prepared statements; used by one thread at a time
+    """
+
+    def __init__(self, raw, driver):
+        self.raw = raw
+        self.last_used = time.monotonic()
+        self._driver = driver
+        self._statements = OrderedDict()  # SQL: cursor holding it prepared, least recently used first
+
+    def fetch_all(self, sql, params):
+        cursor = self._cursor(sql)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def fetch_one(self, sql, params):
+        rows = self.fetch_all(sql, params)  # Reads every row, so none are left unread on the connection
+        return rows[0] if rows else None
+
+    def execute(self, sql, params):
+        cursor = self._cursor(sql)
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    def execute_many(self, sql, params_seq):
+        cursor = self._cursor(sql)
+        cursor.executemany(sql, params_seq)
+        return cursor.rowcount
+
+    def begin(self):
+        self._driver.begin(self.raw)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self):
+        self._driver.ping(self.raw)
+
+    def close(self):
+        for cursor in self._statements.values():
+            with contextlib.suppress(Exception):
+                cursor.close()
+        self._statements.clear()
+
+        with contextlib.suppress(Exception):
+            self.raw.close()
+
+    def _cursor(self, sql):
+        if not self._driver.prepares:
+            return self.raw.cursor()
+
+        cursor = self._statements.get(sql)
+        if cursor is not None:
+            self._statements.move_to_end(sql)
+            return cursor
+
+        cursor = self._statements[sql] = self._driver.prepared_cursor(self.raw)
+        if len(self._statements) > self._driver.statement_cache_size:
+            _, evicted = self._statements.popitem(last=False)
+            evicted.close()
+        return cursor
+
+
+class _MySQLDriver:
+    prepares = True  # A prepared cursor keeps its statement prepared while it is given the same SQL
+    max_params = 65535
+
+    def __init__(self, user, password, host, database, statement_cache_size):
+        self._login = {'user': user, 'password': password, 'host': host, 'database': database}
+        self.statement_cache_size = statement_cache_size
+
+    def connect(self):
+        from mysql.connector import connection  # Imported when first used, as the bot may only use SQLite
+
+        # Autocommit, so pooled connections never hold a stale snapshot between queries
+        return connection.MySQLConnection(autocommit=True, **self._login)
+
+    @staticmethod
+    def prepared_cursor(raw):
+        return raw.cursor(prepared=True)
+
+    @staticmethod
+    def begin(raw):
+        raw.start_transaction()
+
+    @staticmethod
+    def ping(raw):
+        raw.ping(reconnect=False)
+
+    @staticmethod
+    def upsert_clause(key_columns, value_columns):
+        updates = value_columns or key_columns[:1]  # Nothing to replace; assigning a key to itself does nothing
+        return 'ON DUPLICATE KEY UPDATE ' + ', '.join(f'{column} = VALUES({column})' for column in updates)
+
+
+class _SQLiteDriver:
+    prepares = False  # sqlite3 keeps its own cache of prepared statements per connection
+    max_params = 999  # The lowest limit of the SQLite versions Python ships with
+
+    def __init__(self, path, statement_cache_size):
+        self._path = path
+        self.statement_cache_size = statement_cache_size
+
+    def connect(self):
+        # isolation_level None is autocommit; transactions begin explicitly
+        return sqlite3.connect(self._path, isolation_level=None, check_same_thread=False,
+                               cached_statements=self.statement_cache_size)
+
+    @staticmethod
+    def begin(raw):
+        raw.execute('BEGIN')
+
+    @staticmethod
+    def ping(raw):
+        raw.execute('SELECT 1').fetchall()
+
+    @staticmethod
+    def upsert_clause(key_columns, value_columns):
+        conflict = f"ON CONFLICT ({', '.join(key_columns)}) DO "
+        if not value_columns:
+            return conflict + 'NOTHING'
+        return conflict + 'UPDATE SET ' + ', '.join(f'{column} = excluded.{column}' for column in value_columns)
+
+
+def connect() -> 'connection':
+    from mysql.connector import connection
 
-def connect() -> connection:
     configs = config.get_configuration()
     return connection.MySQLConnection(user=configs.username, password=configs.password, host=configs.host,
                                       database=configs.database)
 
 
-def connect_specific(username: str, password: str, host: str, database_name: str) -> connection:
+def connect_specific(username: str, password: str, host: str, database_name: str) -> 'connection':
+    from mysql.connector import connection
+
     return connection.MySQLConnection(user=username, password=password, host=host, database=database_name)
 
 
-def mysql_select(conn: connection, query: str) -> Tuple:
+def mysql_select(conn: 'connection', query: str, params=None) -> Tuple:
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(query, params)
     result_set = cursor.fetchall()
     return result_set
 
 
-def mysql_insert(conn: connection, statement: str) -> int:
+def mysql_insert(conn: 'connection', statement: str, params=None) -> int:
     cursor = conn.cursor()
-    cursor.execute(statement)
+    cursor.execute(statement, params)
     conn.commit()
-    return cursor.rowcount()
+    return cursor.rowcount
 
 
-def mysql_delete(conn: connection, statement: str) -> int:
+def mysql_delete(conn: 'connection', statement: str, params=None) -> int:
     cursor = conn.cursor()
-    cursor.execute(statement)
+    cursor.execute(statement, params)
     conn.commit()
-    return cursor.rowcount()
+    return cursor.rowcount
 
 
-def mysql_update(conn: connection, statement: str) -> int:
+def mysql_update(conn: 'connection', statement: str, params=None) -> int:
     cursor = conn.cursor()
-    cursor.execute(statement)
+    cursor.execute(statement, params)
     conn.commit()
-    return cursor.rowcount()
+    return cursor.rowcount
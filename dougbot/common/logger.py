@@ -1,17 +1,17 @@
+import atexit
 import logging
-import os
+import queue
 import sys
+import threading
 import traceback
+from logging.handlers import QueueListener
 
-from dateutil.tz import tz
 from nextcord import Interaction
 from nextcord.ext.commands import Context
 
 from dougbot import config
-from dougbot.config import CORE_DIR
-
-
-# TODO MAKE ASYNCABLE WHEN NEEDED
+from dougbot.common import timeutils
+from dougbot.core.log.fatallog import get_fatal_log
 
 
 class Logger:
@@ -26,19 +26,23 @@ class Logger:
     METHOD_FIELD = 'method'
     MODULE_FIELD = 'module'
 
-    _FATAL_LOG_PATH = os.path.join(CORE_DIR, 'fatal.log')
+    _FATAL_REPLAY_BATCH = 10
     _ROOT_LOGGER_NAME = ''
 
+    # Console output is written by a listener thread, so logging never waits on stderr
+    _CONSOLE_QUEUE = queue.SimpleQueue()
+    _console_listener = None
+    _console_listener_lock = threading.Lock()
+
     def __init__(self, module):
         if not isinstance(module, str) or len(module) == 0:
             raise ValueError('Invalid module name')
 
-        self._fields = []
+        self._fields = {}
         self.add_field(self.MODULE_FIELD, module)
 
         configs = config.get_configuration()
         self._log_to_console = configs.log_to_console
-        self._fatal_log_max_bytes = configs.fatal_log_size
 
     def channel(self, channel):
         return self.add_field(self.CHANNEL_FIELD, channel)
@@ -68,46 +72,23 @@ class Logger:
         if type(field) != str or len(field) == 0:
             raise ValueError(f"Invalid field name '{field}'")
 
-        if any(t for t in self._fields if t[0] == field):
+        if field in self._fields:
             raise ValueError(f"Field '{field}' already exists")
 
-        self._fields.append((field, value))
+        self._fields[field] = value
         return self
 
     def info(self, *, to_console=False):
-        self.add_field(self.LEVEL_FIELD, 'INFO')
-
-        log_message = self._build_output()
-        self.logger(self._module_field()).info(log_message)
-
-        if to_console or self._log_to_console:
-            print(log_message, file=sys.stderr)
+        self._log(logging.INFO, 'INFO', to_console or self._log_to_console)
 
     def debug(self):
-        self.add_field(self.LEVEL_FIELD, 'DEBUG')
-
-        log_message = self._build_output()
-        self.logger(self._module_field()).debug(log_message)
-
-        print(log_message, file=sys.stderr)
+        self._log(logging.DEBUG, 'DEBUG', True)
 
     def warn(self, *, to_console=False):
-        self.add_field(self.LEVEL_FIELD, 'WARN')
-
-        log_message = self._build_output()
-        self.logger(self._module_field()).warning(log_message)
-
-        if to_console or self._log_to_console:
-            print(log_message, file=sys.stderr)
+        self._log(logging.WARNING, 'WARN', to_console or self._log_to_console)
 
     def error(self, *, to_console=False):
-        self.add_field(self.LEVEL_FIELD, 'ERROR')
-
-        log_message = self._build_output()
-        self.logger(self._module_field()).error(log_message)
-
-        if to_console or self._log_to_console:
-            print(log_message, file=sys.stderr)
+        self._log(logging.ERROR, 'ERROR', to_console or self._log_to_console)
 
     def fatal(self):
         """
@@ -115,7 +96,7 @@ class Logger:
         """
         self.add_field(self.LEVEL_FIELD, 'FATAL')
 
-        log_message = self._build_output()
+        log_message = str(LogMessage(self._fields))
         print(log_message, file=sys.stderr)
         self._append_fatal_log(log_message)
 
@@ -127,56 +108,98 @@ class Logger:
     def add_handler(handler, name=_ROOT_LOGGER_NAME):
         Logger.logger(name).addHandler(handler)
 
+    @staticmethod
+    def remove_handler(handler, name=_ROOT_LOGGER_NAME):
+        Logger.logger(name).removeHandler(handler)
+
     @staticmethod
     def log_fatal_file():
-        log_data = Logger._read_fatal_log()
-        if log_data:
-            Logger.logger().error(f'Errors while bot was down:\n\n{log_data}\n\nEnd of offline errors')
+        entries, omitted = get_fatal_log().replay(config.get_configuration().fatal_replay_entries)
+        if omitted:
+            Logger.logger().error(f'{omitted} older error(s) while bot was down were not kept')
 
-    def _build_output(self):
-        output = f'{self._fields[-1][0]} = {self._fields[-1][1]}\n'  # Error level field
+        # A record per batch, so the log channel can pack them without one giant record
+        for start in range(0, len(entries), Logger._FATAL_REPLAY_BATCH):
+            batch = entries[start:start + Logger._FATAL_REPLAY_BATCH]
+            log_data = '\n\n'.join(f'{text}(x{count}, last at {time})' if count > 1 else text
+                                    for text, count, time in batch)
+            Logger.logger().error(f'Errors while bot was down ({start + 1}-{start + len(batch)} of {len(entries)}):'
+                                  f'\n\n{log_data}\n\nEnd of offline errors')
 
-        for field, value in self._fields[:-1]:
-            output += f'{field} = '
-            if field in [self.CONTEXT_FIELD, self.INTERACTION_FIELD]:
-                output += f"'{value.message.clean_content}' from {value.message.author} at {self._time_as_cst(value.message.created_at)} CST"
-            else:
-                output += str(value)
-                if field == self.EXCEPTION_FIELD:
-                    output += f"\n{''.join(traceback.format_exception(value))}"
-            output += '\n'
+    def _log(self, level, level_name, to_console):
+        self.add_field(self.LEVEL_FIELD, level_name)
 
-        return output
+        # Rendered by whichever handler formats it first, then reused
+        log_message = LogMessage(self._fields)
+        self.logger(self._fields[self.MODULE_FIELD]).log(level, log_message)
 
-    def _module_field(self):
-        return next(t[1] for t in self._fields if t[0] == self.MODULE_FIELD)
+        if to_console:
+            self._to_console(log_message)
 
     @staticmethod
-    def _time_as_cst(original_time):
-        return original_time.astimezone(tz.gettz('America/Chicago'))
+    def _to_console(log_message):
+        if Logger._console_listener is None:
+            with Logger._console_listener_lock:
+                if Logger._console_listener is None:
+                    listener = QueueListener(Logger._CONSOLE_QUEUE, logging.StreamHandler(sys.stderr))
+                    listener.start()
+                    atexit.register(listener.stop)  # Writes out whatever is still queued
+                    Logger._console_listener = listener
+
+        Logger._CONSOLE_QUEUE.put(logging.makeLogRecord({'msg': log_message}))
 
     @staticmethod
-    def _read_fatal_log():
-        log_data = None
+    def _append_fatal_log(data):
         try:
-            with open(Logger._FATAL_LOG_PATH) as fd:
-                log_data = fd.read()
-            os.remove(Logger._FATAL_LOG_PATH)
-        except OSError:
-            pass
+            get_fatal_log().append(data)
+        except OSError as e:
+            print(f'Failed to append to log file: {e}', file=sys.stderr)
 
-        return log_data
 
-    def _append_fatal_log(self, data):
-        try:
-            if os.path.getsize(self._FATAL_LOG_PATH) >= self._fatal_log_max_bytes:
-                os.remove(self._FATAL_LOG_PATH)
-        except OSError:
-            pass
+class LogMessage:
+    """
+    The fields of a Logger call, rendered only when a handler formats the record.
+    The rendered text and the exception's traceback are each built once and cached.
+    """
 
-        try:
-            os.makedirs(CORE_DIR, exist_ok=True)
-            with open(self._FATAL_LOG_PATH, 'a') as fd:
-                fd.write(data)
-        except OSError as e:
-            print(f'Failed to append to log file: {e}', file=sys.stderr)
+    def __init__(self, fields):
+        self.fields = fields
+        self._text = None
+        self._traceback = None
+
+    def __str__(self):
+        if self._text is None:
+            lines = [f'{Logger.LEVEL_FIELD} = {self.fields[Logger.LEVEL_FIELD]}']
+            for field, value in self.fields.items():
+                if field == Logger.LEVEL_FIELD:
+                    continue
+
+                line = f'{field} = {self._render(field, value)}'
+                if field == Logger.EXCEPTION_FIELD:
+                    line += f'\n{self.traceback()}'
+                lines.append(line)
+
+            self._text = '\n'.join(lines) + '\n'
+        return self._text
+
+    def as_dict(self):
+        """
+        :return: The fields with every value rendered to a string, plus the exception's traceback
+        """
+        data = {field: self._render(field, value) for field, value in self.fields.items()}
+        if Logger.EXCEPTION_FIELD in self.fields:
+            data['traceback'] = self.traceback()
+        return data
+
+    def traceback(self):
+        if self._traceback is None:
+            exception = self.fields.get(Logger.EXCEPTION_FIELD)
+            self._traceback = ''.join(traceback.format_exception(exception)) \
+                if isinstance(exception, BaseException) else ''
+        return self._traceback
+
+    @staticmethod
+    def _render(field, value):
+        if field in [Logger.CONTEXT_FIELD, Logger.INTERACTION_FIELD]:
+            return f"'{value.message.clean_content}' from {value.message.author} at {timeutils.format_local(value.message.created_at)}"
+        return str(value)
@@ -0,0 +1,79 @@
+"""
+Resolves whether members hold the admin or mod role for guarded commands.
+The role ids are read from the configuration once and each member's role ids once, so a check is a set lookup instead of
+a configuration read and a scan over the member's roles.
+"""
+from nextcord import Member
+
+from dougbot import config
+
+_ADMIN_ROLE_IDS = None
+_MOD_ROLE_IDS = None
+_MEMBER_ROLE_IDS = {}  # (guild id, member id): frozenset of role ids
+
+
+def is_admin(member):
+    return _has_any_role(member, _admin_role_ids())
+
+
+def is_mod(member):
+    """
+    Admins count as mods
+    """
+    return _has_any_role(member, _mod_role_ids())
+
+
+def invalidate_member(member):
+    """
+    Forgets a member's cached roles, for when their roles change or they leave
+    """
+    _MEMBER_ROLE_IDS.pop((member.guild.id, member.id), None)
+
+
+def invalidate_members():
+    """
+    Forgets every member's cached roles, for when a role is deleted from a guild
+    """
+    _MEMBER_ROLE_IDS.clear()
+
+
+def _has_any_role(member, role_ids):
+    if not isinstance(member, Member):  # Users in DMs have no roles
+        return False
+    return not _member_role_ids(member).isdisjoint(role_ids)
+
+
+def _member_role_ids(member):
+    key = (member.guild.id, member.id)
+    role_ids = _MEMBER_ROLE_IDS.get(key)
+    if role_ids is None:
+        role_ids = _MEMBER_ROLE_IDS[key] = frozenset(role.id for role in member.roles)
+    return role_ids
+
+
+def _admin_role_ids():
+    global _ADMIN_ROLE_IDS
+
+    if _ADMIN_ROLE_IDS is None:
+        _ADMIN_ROLE_IDS = frozenset({config.get_configuration().admin_role_id})
+    return _ADMIN_ROLE_IDS
+
+
+def _mod_role_ids():
+    global _MOD_ROLE_IDS
+
+    if _MOD_ROLE_IDS is None:
+        configuration = config.get_configuration()
+        _MOD_ROLE_IDS = frozenset({configuration.admin_role_id, configuration.mod_role_id})
+    return _MOD_ROLE_IDS
+
+
+def _on_config_change(changes):
+    global _ADMIN_ROLE_IDS, _MOD_ROLE_IDS
+
+    if 'admin_role_id' in changes or 'mod_role_id' in changes:
+        _ADMIN_ROLE_IDS = None
+        _MOD_ROLE_IDS = None
+
+
+config.subscribe(_on_config_change)
@@ -0,0 +1,97 @@
+"""
+Time zone and timestamp formatting shared by the bot, so the configured zone is resolved once and formatting repeated
+timestamps is a cache lookup.
+"""
+import functools
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from dateutil import parser
+from dateutil import tz
+
+from dougbot import config
+
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M:%S %Z'
+SHORT_DISPLAY_FORMAT = '%Y-%m-%d %H:%M %Z'
+STAMP_FORMAT = '%m/%d/%y %H:%M:%S'  # Naive local-time stamps, as stored by the pet extension
+
+_ZONE = None
+
+
+def local_zone():
+    """
+    :return: The zone from [Time] timezone, falling back to UTC when the name is unknown
+    """
+    global _ZONE
+
+    if _ZONE is None:
+        name = config.get_configuration().timezone
+        try:
+            # zoneinfo converts several times faster than dateutil's tzfile
+            _ZONE = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):  # No system tz database, as on Windows without tzdata
+            _ZONE = tz.gettz(name) or timezone.utc
+    return _ZONE
+
+
+def reset_zone():
+    """
+    Resolves the zone again the next time it is used, for when the configuration changes
+    """
+    global _ZONE
+
+    _ZONE = None
+    _format_second.cache_clear()
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def local_now():
+    """
+    :return: The current naive local time in the configured zone, comparable with parse_stamp
+    """
+    return datetime.now(local_zone()).replace(tzinfo=None)
+
+
+def format_local(moment, fmt=DISPLAY_FORMAT):
+    """
+    Formats an aware datetime in the configured zone, to the second
+    """
+    return _format_second(int(moment.timestamp()), fmt)
+
+
+def format_stamp(moment=None):
+    """
+    :param moment: Naive local datetime; the current local time when not given
+    """
+    return (moment or local_now()).strftime(STAMP_FORMAT)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_stamp(stamp):
+    return datetime.strptime(stamp, STAMP_FORMAT)
+
+
+def parse_iso(text):
+    """
+    Parses what str() or isoformat() wrote for a datetime, falling back to dateutil for anything else
+    """
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return parser.parse(text)
+
+
+@functools.lru_cache(maxsize=1024)
+def _format_second(seconds, fmt):
+    return datetime.fromtimestamp(seconds, local_zone()).strftime(fmt)
+
+
+def _on_config_change(changes):
+    if 'timezone' in changes:
+        reset_zone()
+
+
+config.subscribe(_on_config_change)
@@ -0,0 +1,174 @@
+"""
+Buffers writes to the database and sends them together, so frequent small writes cost a few multi-row statements
+instead of a round trip and commit each.
+"""
+import asyncio
+import re
+
+from dougbot.common.logger import Logger
+
+_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+_NAMED = {}  # Name: the latest WriteBehind given it
+
+
+class WriteBehind:
+    """
+    Rows are buffered per table and written by flush(): every flush_secs, as soon as a table has max_rows buffered,
+    and when the database closes. Appended rows are all inserted; upserted rows are coalesced by key, so only the last
+    write to each key is sent. A flush is one transaction, and rows from a failed flush are kept for the next one.
+    Once aclose() is called, no more rows are taken.
+    """
+
+    def __init__(self, database, max_rows=500, flush_secs=5, name=None):
+        """
+        :param name: Identifies the buffer across reloads of the code that owns it: the first flush of a new buffer
+        given a name first flushes whatever the previous buffer with the name still holds, so nothing written
+        afterwards can overtake it
+        """
+        self._database = database
+        self._max_rows = max_rows
+        self._flush_secs = flush_secs
+
+        self._appends = {}  # (table, columns): [row]
+        self._upserts = {}  # (table, key columns, columns): {key: row}
+        self._flush_lock = asyncio.Lock()
+        self._flusher = None
+        self._size_flush = None
+        self._closed = False
+
+        self._previous = None
+        if name is not None:
+            previous = _NAMED.get(name)
+            if previous is not None and previous._database is database:  # Else its database's close flushed it
+                self._previous = previous
+            _NAMED[name] = self
+
+        database.on_close(self.aclose)
+
+    def append(self, table, columns, row):
+        """
+        Buffers a row to insert
+        :param columns: Column names, in the order of the row's values
+        """
+        self._check_open()
+        rows = self._appends.setdefault(self._check(table, columns), [])
+        rows.append(tuple(row))
+        self._written(len(rows))
+
+    def upsert(self, table, key_columns, columns, row):
+        """
+        Buffers a row to insert or, when a row with the same key exists, to replace its other columns; an earlier
+        buffered row with the same key is dropped
+        :param key_columns: Columns of the table's primary or unique key, all within columns
+        """
+        self._check_open()
+        key_columns = tuple(key_columns)
+        columns = self._check(table, columns)[1]
+        if not set(key_columns) <= set(columns):
+            raise ValueError(f'Key columns {key_columns} are not all in {columns}')
+
+        row = tuple(row)
+        rows = self._upserts.setdefault((table, key_columns, columns), {})
+        rows[tuple(row[columns.index(column)] for column in key_columns)] = row
+        self._written(len(rows))
+
+    def has_pending(self):
+        return any(self._appends.values()) or any(self._upserts.values())
+
+    async def flush(self):
+        if self._previous is not None:
+            await self._previous.flush()  # Raises, and is tried again next flush, while its rows can't be written
+            self._previous = None
+
+        async with self._flush_lock:
+            appends, self._appends = self._appends, {}
+            upserts, self._upserts = self._upserts, {}
+            if not any(appends.values()) and not any(upserts.values()):
+                return
+
+            try:
+                async with self._database.transaction() as tx:
+                    for (table, columns), rows in appends.items():
+                        await self._insert(tx, table, columns, rows, '')
+                    for (table, key_columns, columns), rows in upserts.items():
+                        await self._insert(tx, table, columns, list(rows.values()),
+                                           ' ' + self._database.upsert_clause(key_columns, columns))
+            except Exception:
+                self._requeue(appends, upserts)
+                raise
+
+    async def aclose(self):
+        """
+        Stops the timed flushes and writes whatever is buffered. The database keeps the buffer to flush when it closes
+        until that write succeeds.
+        """
+        self.stop()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+
+        await self.flush()
+        self._database.remove_on_close(self.aclose)
+
+    def stop(self):
+        """
+        Refuses further rows straight away, for owners that can't await aclose() before the next write could come
+        """
+        self._closed = True
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError('WriteBehind is closed')
+
+    def _written(self, table_rows):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_every())
+
+        if table_rows >= self._max_rows and (self._size_flush is None or self._size_flush.done()):
+            self._size_flush = asyncio.ensure_future(self._flush_logged())
+
+    async def _flush_every(self):
+        while self.has_pending():
+            await asyncio.sleep(self._flush_secs)
+            await self._flush_logged()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            Logger(__file__) \
+                .message('Failed to flush buffered database writes; they are kept for the next flush') \
+                .exception(e) \
+                .error()
+
+    async def _insert(self, tx, table, columns, rows, suffix):
+        # Full statements share one SQL string, so the connection keeps them prepared
+        per_statement = max(1, min(self._max_rows, self._database.max_params // len(columns)))
+        placeholders = '(' + ', '.join('?' * len(columns)) + ')'
+
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            await tx.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+                             f"{', '.join([placeholders] * len(chunk))}{suffix}",
+                             [value for row in chunk for value in row])
+
+    def _requeue(self, appends, upserts):
+        for key, rows in appends.items():
+            self._appends[key] = rows + self._appends.get(key, [])
+
+        for key, rows in upserts.items():
+            newer = self._upserts.get(key, {})
+            rows.update(newer)  # Writes made during the failed flush win
+            self._upserts[key] = rows
+
+    @staticmethod
+    def _check(table, columns):
+        """
+        Table and column names are written into the SQL, so only plain identifiers are accepted
+        """
+        columns = tuple(columns)
+        for name in (table, *columns):
+            if not _IDENTIFIER.fullmatch(name):
+                raise ValueError(f"'{name}' is not a valid table or column name")
+        return table, columns
@@ -1,7 +1,9 @@
 import os
 import sys
+import threading
 from configparser import ConfigParser
-from types import SimpleNamespace
+
+from dougbot.common.fileutils import atomic_write
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CORE_DIR = os.path.join(ROOT_DIR, 'dougbot', 'core')
@@ -13,8 +15,184 @@ EXTENSION_RESOURCES_DIR = os.path.join(RESOURCES_MAIN_PACKAGE_DIR, 'extensions')
 _CONFIG_PATH = os.path.join(RESOURCES_DIR, 'config')
 _CONFIG_FILENAME = 'config.ini'
 _DEV_CONFIG_FILENAME = 'dev_config.ini'
+_OVERRIDES_FILENAME = 'overrides.ini'  # Edits admins made while running, when persisted
+_CUSTOM_SECTION = 'Custom'  # Configs added by admins that are not part of the schema
 
 _CONFIGURATION = None
+_SUBSCRIBERS = []
+_LOCK = threading.Lock()
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Configuration:
+    """
+    Typed configuration values, read as attributes.
+    Changes replace every value at once, so anything holding this object always sees one consistent version.
+    """
+
+    def __repr__(self):
+        return f'Configuration({vars(self)})'
+
+
+class Setting:
+
+    def __init__(self, name, section, key, converter=str, default=None, check=None, editable=True):
+        """
+        :param name: Attribute name on the configuration
+        :param converter: Turns the string from the config file into the value
+        :param default: String used when the file has no value; None makes the setting required
+        :param check: Raises ValueError for converted values that are out of range
+        :param editable: Whether admins may change the setting while the bot runs
+        """
+        self.name = name
+        self.section = section
+        self.key = key
+        self.converter = converter
+        self.default = default
+        self.check = check
+        self.editable = editable
+
+    def convert(self, raw):
+        try:
+            value = self.converter(raw)
+            if self.check is not None:
+                self.check(value)
+            return value
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"Invalid value '{raw}' for [{self.section}] {self.key}: {e}") from e
+
+
+def _str_to_bool(string: str):
+    return string is not None and string.lower() in ['1', 't', 'true']
+
+
+def _env(name):
+    return os.getenv(name) if name else None
+
+
+def _size(string):
+    return int(float(string))
+
+
+def _names(string):
+    return tuple(name.strip() for name in string.split(',') if name.strip())
+
+
+def _root_path(string):
+    return os.path.join(ROOT_DIR, string) if string else None
+
+
+def _at_least(minimum):
+    def check(value):
+        if value < minimum:
+            raise ValueError(f'must be at least {minimum}')
+
+    return check
+
+
+def _between(minimum, maximum):
+    def check(value):
+        if not minimum <= value <= maximum:
+            raise ValueError(f'must be between {minimum} and {maximum}')
+
+    return check
+
+
+def _one_of(*choices):
+    def check(value):
+        if value not in choices:
+            raise ValueError(f"must be one of {', '.join(choices)}")
+
+    return check
+
+
+_SCHEMA = [
+    # Bank
+    Setting('bank_flush_rows', 'Bank', 'flush_rows', int, '500', _at_least(1)),
+    Setting('bank_flush_secs', 'Bank', 'flush_secs', float, '10', _at_least(0)),
+    Setting('bank_starting_balance', 'Bank', 'starting_balance', int, '100', _at_least(0)),
+
+    # Commands
+    Setting('command_prefix', 'Commands', 'prefix'),
+
+    # Channels
+    Setting('debug_channel_id', 'Channels', 'debug_channel_id', int),
+    Setting('logging_channel_id', 'Channels', 'logging_channel_id', int),
+
+    # Config
+    Setting('config_persist_edits', 'Config', 'persist_edits', _str_to_bool, 'False'),
+    Setting('config_watch_secs', 'Config', 'watch_secs', int, '0', _at_least(0)),
+
+    # Database
+    Setting('database_acquire_timeout_secs', 'Database', 'acquire_timeout_secs', float, '10', _at_least(0)),
+    Setting('database_health_check_secs', 'Database', 'health_check_secs', float, '30', _at_least(0)),
+    Setting('database_pool_size', 'Database', 'pool_size', int, '5', _at_least(1)),
+    Setting('database_sqlite_path', 'Database', 'sqlite_file', _root_path, ''),
+    Setting('database_statement_cache_size', 'Database', 'statement_cache_size', int, '32', _at_least(1)),
+
+    # Environment - the config names the environment variables that hold the values
+    # Debug Env - Do this so you don't have to set environment vars: swap _env for str and edit config.ini with login info
+    Setting('username', 'Environment', 'username', _env, editable=False),
+    Setting('password', 'Environment', 'password', _env, editable=False),
+    Setting('host', 'Environment', 'host', _env, editable=False),
+    Setting('database', 'Environment', 'database', _env, editable=False),
+    Setting('token', 'Environment', 'token_name', _env, editable=False),
+
+    # Extensions
+    Setting('extensions_lazy_load', 'Extensions', 'lazy_load', _str_to_bool, 'True'),
+    Setting('extensions_eager', 'Extensions', 'eager', _names, 'admin'),
+
+    # Logging
+    Setting('log_to_console', 'Logging', 'log_to_console', _str_to_bool, 'False'),
+    Setting('fatal_log_size', 'Logging', 'fatal_log_size', _size, '0', _at_least(0)),
+    Setting('fatal_log_segments', 'Logging', 'fatal_log_segments', int, '4', _at_least(1)),
+    Setting('fatal_replay_entries', 'Logging', 'fatal_replay_entries', int, '50', _at_least(0)),
+    Setting('json_log_path', 'Logging', 'json_log_file', _root_path, ''),
+    Setting('log_rate_limit_burst', 'Logging', 'rate_limit_burst', int, '5', _at_least(0)),
+    Setting('log_rate_limit_per_minute', 'Logging', 'rate_limit_per_minute', float, '6', _at_least(0)),
+    Setting('log_rate_limit_summary_secs', 'Logging', 'rate_limit_summary_secs', int, '300', _at_least(1)),
+    Setting('log_queue_size', 'Logging', 'queue_size', int, '1000', _at_least(1)),
+    Setting('log_repeat_window_secs', 'Logging', 'repeat_window_secs', int, '60', _at_least(0)),
+    Setting('log_spill_size', 'Logging', 'spill_size', _size, '1.0e+7', _at_least(0)),
+
+    # Markov
+    Setting('markov_live_ingestion', 'Markov', 'live_ingestion', _str_to_bool, 'False'),
+    Setting('markov_live_flush_secs', 'Markov', 'live_flush_secs', int, '300', _at_least(1)),
+    Setting('markov_order', 'Markov', 'order', int, '3', _between(1, 4)),
+    Setting('markov_sparse', 'Markov', 'sparse', int, '2', _at_least(1)),
+    Setting('markov_compression', 'Markov', 'compression', str, 'zlib', _one_of('none', 'zlib', 'zstd')),
+    Setting('markov_prune_singletons', 'Markov', 'prune_singletons', int, '3', _at_least(0)),
+    Setting('markov_prune_interval_hours', 'Markov', 'prune_interval_hours', int, '0', _at_least(0)),
+
+    # Permissions
+    Setting('admin_role_id', 'Permissions', 'admin_role_id', int),
+    Setting('mod_role_id', 'Permissions', 'mod_role_id', int),
+
+    # Resilience
+    Setting('handoff_max_age_secs', 'Resilience', 'handoff_max_age_secs', int, '300', _at_least(0)),
+    Setting('run_attempt_cooldown_secs', 'Resilience', 'run_attempt_cooldown_secs', int, '5', _at_least(0)),
+
+    # Startup
+    Setting('startup_profile_path', 'Startup', 'profile_file', _root_path, ''),
+    Setting('startup_report', 'Startup', 'report', _str_to_bool, 'True'),
+    Setting('startup_report_modules', 'Startup', 'report_modules', int, '10', _at_least(0)),
+
+    # Tamagotchi
+    Setting('tamagotchi_flush_secs', 'Tamagotchi', 'flush_secs', int, '60', _at_least(1)),
+
+    # Time
+    Setting('timezone', 'Time', 'timezone', str, 'America/Chicago'),
+
+    # Update
+    Setting('update_command_timeout_secs', 'Update', 'command_timeout_secs', int, '900', _at_least(1)),
+    Setting('update_hot_reload', 'Update', 'hot_reload', _str_to_bool, 'True'),
+    Setting('update_output_batch_secs', 'Update', 'output_batch_secs', int, '5', _at_least(1)),
+]
+
+SETTINGS = {setting.name: setting for setting in _SCHEMA}
 
 
 def get_configuration():
@@ -24,55 +202,163 @@ def get_configuration():
         return _CONFIGURATION
 
     try:
-        config = os.path.join(_CONFIG_PATH, _CONFIG_FILENAME)
-        dev_config = os.path.join(_CONFIG_PATH, _DEV_CONFIG_FILENAME)
+        with _LOCK:
+            if _CONFIGURATION is None:
+                configuration = Configuration()
+                configuration.__dict__ = _load()
+                _CONFIGURATION = configuration
 
-        config_parser = ConfigParser()
-        config_parser.read([config, dev_config])
+        return _CONFIGURATION
+    except Exception as e:
+        print(f'FATAL: Bot failed to start, invalid config: {e}', file=sys.stderr)
 
-        config_namespace = SimpleNamespace()
 
-        # Commands
-        config_namespace.command_prefix = config_parser.get('Commands', 'prefix')
+def config_paths():
+    """
+    :return: The config files in the order they're read, each overriding the ones before it
+    """
+    return [os.path.join(_CONFIG_PATH, _CONFIG_FILENAME), os.path.join(_CONFIG_PATH, _DEV_CONFIG_FILENAME),
+            os.path.join(_CONFIG_PATH, _OVERRIDES_FILENAME)]
 
-        # Channels
-        config_namespace.debug_channel_id = int(config_parser.get('Channels', 'debug_channel_id'))
-        config_namespace.logging_channel_id = int(config_parser.get('Channels', 'logging_channel_id'))
 
-        # Environment
-        config_namespace.username = os.getenv(config_parser.get('Environment', 'username'))
-        config_namespace.password = os.getenv(config_parser.get('Environment', 'password'))
-        config_namespace.host = os.getenv(config_parser.get('Environment', 'host'))
-        config_namespace.database = os.getenv(config_parser.get('Environment', 'database'))
-        config_namespace.token = os.getenv(config_parser.get('Environment', 'token_name'))
+def reload_configuration():
+    """
+    Reads the config files again; nothing changes when any value is missing or invalid
+    Configs added by admins and not persisted are kept.
+    :return: {name: (old value, new value)} of every value that changed
+    :raises ConfigError: When a value in the files is missing or invalid
+    """
+    values = _load()
+    configuration = get_configuration()
 
-        # Debug Env - Do this so you don't have to set environment vars. Just edit config.ini with login info
-        # config_namespace.username = config_parser.get('Environment', 'username')
-        # config_namespace.password = config_parser.get('Environment', 'password')
-        # config_namespace.host = config_parser.get('Environment', 'host')
-        # config_namespace.database = config_parser.get('Environment', 'database')
+    with _LOCK:
+        old_values = vars(configuration)
+        for name, value in old_values.items():
+            if name not in values and name not in SETTINGS:
+                values[name] = value
 
-        # Logging
-        config_namespace.log_to_console = _str_to_bool(config_parser.get('Logging', 'log_to_console', fallback='False'))
-        config_namespace.fatal_log_size = int(float(config_parser.get('Logging', 'fatal_log_size', fallback='0')))
+        changes = _changes(old_values, values)
+        configuration.__dict__ = values
 
-        # Meta
-        config_namespace.is_dev_bot = os.path.exists(dev_config)
+    _notify(changes)
+    return changes
 
-        # Permissions
-        config_namespace.admin_role_id = int(config_parser.get('Permissions', 'admin_role_id'))
-        config_namespace.mod_role_id = int(config_parser.get('Permissions', 'mod_role_id'))
 
-        # Resilience
-        config_namespace.run_attempt_cooldown_secs = int(
-            config_parser.get('Resilience', 'run_attempt_cooldown_secs', fallback='5'))
+def set_value(name, raw):
+    """
+    Sets a config from an admin's string, converted and checked by the schema; configs outside the schema stay strings
+    :raises ConfigError: When the value is invalid or the setting can't be changed while running
+    """
+    setting = SETTINGS.get(name)
+    if setting is not None and not setting.editable:
+        raise ConfigError(f"'{name}' can only be changed in the config files")
 
-        _CONFIGURATION = config_namespace
+    value = setting.convert(raw) if setting is not None else raw
+    _replace({name: value})
 
-        return config_namespace
-    except Exception as e:
-        print(f'FATAL: Bot failed to start, invalid config: {e}', file=sys.stderr)
+    if get_configuration().config_persist_edits:
+        _persist(setting.section if setting else _CUSTOM_SECTION, setting.key if setting else name, raw)
 
 
-def _str_to_bool(string: str):
-    return string is not None and string.lower() in ['1', 't', 'true']
+def remove_value(name):
+    """
+    Removes a config added by an admin
+    :raises ConfigError: When the config is part of the schema
+    """
+    if name in SETTINGS:
+        raise ConfigError(f"'{name}' is part of the schema and can only be replaced")
+
+    _replace({name: None}, remove=True)
+
+    if get_configuration().config_persist_edits:
+        _persist(_CUSTOM_SECTION, name, None)
+
+
+def subscribe(callback):
+    """
+    :param callback: Called with {name: (old value, new value)} after configs change, on the thread that changed them
+    """
+    _SUBSCRIBERS.append(callback)
+
+
+def unsubscribe(callback):
+    if callback in _SUBSCRIBERS:
+        _SUBSCRIBERS.remove(callback)
+
+
+def _load():
+    config, dev_config, overrides = config_paths()
+
+    config_parser = ConfigParser()
+    config_parser.read([config, dev_config, overrides])
+
+    values = {}
+    for setting in _SCHEMA:
+        raw = config_parser.get(setting.section, setting.key, fallback=setting.default)
+        if raw is None:
+            raise ConfigError(f'Missing [{setting.section}] {setting.key}')
+        values[setting.name] = setting.convert(raw)
+
+    if config_parser.has_section(_CUSTOM_SECTION):
+        for name, raw in config_parser.items(_CUSTOM_SECTION):
+            values.setdefault(name, raw)
+
+    # Meta
+    values['is_dev_bot'] = os.path.exists(dev_config)
+
+    return values
+
+
+def _replace(updates, remove=False):
+    configuration = get_configuration()
+
+    with _LOCK:
+        old_values = vars(configuration)
+        values = dict(old_values)
+        for name, value in updates.items():
+            if remove:
+                values.pop(name, None)
+            else:
+                values[name] = value
+
+        changes = _changes(old_values, values)
+        configuration.__dict__ = values
+
+    _notify(changes)
+
+
+def _changes(old_values, values):
+    return {name: (old_values.get(name), values.get(name)) for name in old_values.keys() | values.keys()
+            if old_values.get(name) != values.get(name)}
+
+
+def _notify(changes):
+    if not changes:
+        return
+
+    for callback in list(_SUBSCRIBERS):
+        try:
+            callback(changes)
+        except Exception as e:
+            print(f'Config subscriber {callback} failed: {e}', file=sys.stderr)
+
+
+def _persist(section, key, raw):
+    """
+    Writes an admin's edit to overrides.ini, which overrides the other config files; None removes the key
+    Kept apart from dev_config.ini, as that file existing is what makes a bot a dev bot.
+    """
+    overrides = config_paths()[2]
+    config_parser = ConfigParser()
+    config_parser.read(overrides)
+
+    if raw is None:
+        if config_parser.has_section(section):
+            config_parser.remove_option(section, key)
+    else:
+        if not config_parser.has_section(section):
+            config_parser.add_section(section)
+        config_parser.set(section, key, raw.replace('%', '%%'))  # Read back with interpolation
+
+    with atomic_write(overrides, 'w') as fd:
+        config_parser.write(fd)
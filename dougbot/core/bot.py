@@ -1,4 +1,5 @@
 import asyncio
+import logging
 import os
 import signal
 import sys
@@ -8,20 +9,26 @@ from typing import Any
 from nextcord import ApplicationError, Intents, Interaction
 from nextcord import Status
 from nextcord.ext import commands
+from nextcord.ext.commands import Context
 
 from dougbot import config
+from dougbot.common import database, permissions
 from dougbot.common.logger import Logger
 from dougbot.common.messaging import reactions
-from dougbot.core import extloader
+from dougbot.core import extloader, profiler, statehandoff
 from dougbot.core.help import CustomHelpCommand
 from dougbot.core.log.channelhandler import ChannelHandler
+from dougbot.core.log.jsonformatter import JsonFormatter
 
 
 class DougBot(commands.Bot):
 
     def __init__(self):
         self.config = config.get_configuration()
+        profiler.mark('config')
+
         self._log_channel = None
+        self._channel_handler = None
 
         self._attempt_run = True
 
@@ -33,8 +40,15 @@ class DougBot(commands.Bot):
 
         self._create_signal_handler()
 
+        if self.config.json_log_path:  # Machine-readable copy of everything logged
+            json_handler = logging.FileHandler(self.config.json_log_path, encoding='utf-8')
+            json_handler.setFormatter(JsonFormatter())
+            Logger.add_handler(json_handler)
+
         super().__init__(self.config.command_prefix, **bot_kwargs)
-        self._extension_load_errors = extloader.load_extensions(self)
+        self.extension_loader = extloader.ExtensionLoader(self)
+        self._extension_load_errors = self.extension_loader.load_startup()
+        profiler.mark('extensions')
 
     def run(self, *args, **kwargs):
         if not self.config.token:
@@ -60,14 +74,18 @@ class DougBot(commands.Bot):
 
     async def on_connect(self):
         self._log_channel = await self.fetch_channel(self.config.logging_channel_id)
-        if self._log_channel:
-            Logger.add_handler(ChannelHandler(self._log_channel, self.loop))
+        if self._log_channel and self._channel_handler is None:  # on_connect runs again on every reconnect
+            self._channel_handler = ChannelHandler(self._log_channel, self.loop)
+            Logger.add_handler(self._channel_handler)
 
         self.help_command = CustomHelpCommand(dm_help=None, no_category='Misc')
 
+        profiler.mark('connect')
         print('Doug Online')
 
     async def on_ready(self):
+        profiler.mark('ready')
+
         # Log errors that occurred while bot was down
         if self._log_channel:
             Logger.log_fatal_file()
@@ -80,6 +98,15 @@ class DougBot(commands.Bot):
 
         self._extension_load_errors.clear()
 
+        # on_ready runs again after reconnects, once nothing is pending this does nothing
+        await self.extension_loader.load_pending()
+        profiler.mark('background extensions')
+
+        # After the extensions load, so each one has registered what it takes back
+        await statehandoff.restore()
+
+        self._report_startup()
+
     async def close(self):
         # TODO CHECK THIS WORKS
         if await self.has_connection():
@@ -88,10 +115,25 @@ class DougBot(commands.Bot):
             for vc in self.voice_clients:
                 await vc.disconnect(force=True)
 
-        # TODO FINISH LOGGING
+        await database.close_database()
+
+        if self._channel_handler is not None:
+            Logger.remove_handler(self._channel_handler)
+            await self._channel_handler.aclose()
+            self._channel_handler = None
 
         await super().close()
 
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            permissions.invalidate_member(after)
+
+    async def on_member_remove(self, member):
+        permissions.invalidate_member(member)
+
+    async def on_guild_role_delete(self, _):
+        permissions.invalidate_members()
+
     async def on_error(self, event_method, *args, **kwargs):
         _, exception, _ = sys.exc_info()
         Logger(__file__) \
@@ -119,6 +161,15 @@ class DougBot(commands.Bot):
 
         await reactions.check_log(ctx.message)
 
+    async def get_context(self, message, *, cls=Context):
+        ctx = await super().get_context(message, cls=cls)
+
+        # Commands of extensions not loaded yet load them on first use
+        if ctx.command is None and ctx.invoked_with and await self.extension_loader.load_for_command(ctx.invoked_with):
+            ctx = await super().get_context(message, cls=cls)
+
+        return ctx
+
     async def has_connection(self):
         return self.ws and not self.is_closed()
 
@@ -130,6 +181,27 @@ class DougBot(commands.Bot):
         """
         return super().get_cog(name)
 
+    def _report_startup(self):
+        report = profiler.finish()
+        if report is None:  # Reconnected
+            return
+
+        if self.config.startup_profile_path:
+            try:
+                profiler.dump(report, self.config.startup_profile_path)
+            except OSError as e:
+                Logger(__file__) \
+                    .message('Failed to write startup profile') \
+                    .exception(e) \
+                    .warn()
+
+        if self.config.startup_report:
+            # Module loggers inherit the root's WARNING; the report is asked for, so this one lets info through
+            Logger.logger(__file__).setLevel(logging.INFO)
+            Logger(__file__) \
+                .message('\n'.join(profiler.report_lines(report, self.config.startup_report_modules))) \
+                .info()
+
     def _create_signal_handler(self):
         def signal_handler(_, __):
             if self.loop.is_running():
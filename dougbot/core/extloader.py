@@ -1,40 +1,330 @@
+"""
+Finds extensions from their source, without importing them, and loads them in stages: packages named in
+[Extensions] eager before the bot connects, and the rest in the background once it is ready, or earlier when one of their
+commands is used. Each extension's top-level imports are warmed in a thread pool first, so heavy libraries load in
+parallel and off the event loop, and load_extension only has to run the extension's own module.
+"""
+import ast
+import asyncio
+import importlib
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from dougbot import config
+from dougbot.common.logger import Logger
 from dougbot.config import EXTENSIONS_DIR, ROOT_DIR
 
+_APPLICATION_COMMAND_DECORATORS = {'slash_command', 'user_command', 'message_command'}
+_PREFIX_COMMAND_DECORATORS = {'command', 'group'}
+_EXTENSIONS_PREFIX = os.path.relpath(EXTENSIONS_DIR, ROOT_DIR).replace(os.sep, '/') + '/'
 
-def load_extensions(bot):
-    if not os.path.exists(EXTENSIONS_DIR):
-        return [Exception(f"Path to extensions '{EXTENSIONS_DIR}' does not exist")]
 
-    exceptions = []
+class ExtensionEntry:
+    """
+    What the manifest knows about an extension from its source
+    """
 
-    for root, _, files in os.walk(EXTENSIONS_DIR):
-        _load_from_package(bot, root, files, exceptions)
+    def __init__(self, module, package, commands, imports, application_commands):
+        self.module = module
+        self.package = package
+        self.commands = commands
+        self.imports = imports
+        self.application_commands = application_commands
+
+
+class ExtensionTiming:
+
+    def __init__(self, module, trigger, import_secs, setup_secs, error=None):
+        """
+        :param trigger: What loaded the extension - startup, command, background, update or unload
+        :param import_secs: Time spent warming the extension's imports
+        :param setup_secs: Time spent in load_extension, running the module and its setup
+        """
+        self.module = module
+        self.trigger = trigger
+        self.import_secs = import_secs
+        self.setup_secs = setup_secs
+        self.error = error
+
+
+class ExtensionLoader:
+    THREAD_POOL: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='extloader')
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.manifest = {}  # Module path: ExtensionEntry
+        self.timings = {}  # Module path: ExtensionTiming
+        self._pending = {}  # Module path: ExtensionEntry, not loaded yet
+        self._command_modules = {}  # Lowercase command name or alias: module path
+        self._loading = {}  # Module path: asyncio.Task loading it
+
+    def load_startup(self):
+        """
+        Builds the manifest and loads the extensions that must be ready before the bot connects
+        :return: Exceptions raised while loading
+        """
+        if not os.path.exists(EXTENSIONS_DIR):
+            return [Exception(f"Path to extensions '{EXTENSIONS_DIR}' does not exist")]
+
+        self.manifest = build_manifest()
+
+        configuration = config.get_configuration()
+        eager = []
+        for entry in self.manifest.values():
+            # Application commands are registered with Discord when the bot connects, so can't wait
+            if not configuration.extensions_lazy_load or entry.application_commands \
+                    or entry.package in configuration.extensions_eager:
+                eager.append(entry)
+            else:
+                self._add_pending(entry)
+
+        warmed = [(entry, self.THREAD_POOL.submit(_warm_imports, entry)) for entry in eager]
+
+        exceptions = []
+        for entry, future in warmed:
+            timing = self._load(entry, 'startup', future.result())
+            if timing.error is not None:
+                exceptions.append(timing.error)
+
+        return exceptions
+
+    async def load_pending(self):
+        """
+        Loads every extension not loaded yet, warming all of their imports in parallel
+        """
+        await asyncio.gather(*[self._load_pending(module, 'background') for module in list(self._pending)])
+
+    async def load_for_command(self, name):
+        """
+        Loads the pending extension providing a command, for when the command is used before the background load
+        :return: Whether an extension was loaded
+        """
+        module = self._command_modules.get(name.lower())
+        if module is None:
+            return False
+
+        timing = await self._load_pending(module, 'command')
+        return timing is not None and timing.error is None
+
+    async def reload_files(self, paths):
+        """
+        Reloads the extensions whose source changed, for after an update. A changed helper module reloads every
+        extension in its package, as any of them may import it.
+        :param paths: Changed files relative to the root directory, as git lists them
+        :return: ExtensionTiming of each extension reloaded, loaded or unloaded
+        """
+        changed = {path[:-3].replace('/', '.') for path in paths
+                   if path.endswith('.py') and path.startswith(_EXTENSIONS_PREFIX)
+                   and _is_extension_package(os.path.join(ROOT_DIR, os.path.dirname(path)))}
+        if not changed:
+            return []
+
+        manifest = build_manifest()
+        affected = set()
+        for module in changed:
+            if module in manifest or module in self.manifest:
+                affected.add(module)
+                continue
+
+            # Helpers aren't reloaded by reload_extension, and helpers that import a changed helper hold the old one,
+            # so every helper of the package is imported again by the package's extensions
+            package = module.rsplit('.', 1)[0]
+            for name in [name for name in sys.modules if name.rsplit('.', 1)[0] == package]:
+                if name not in manifest and name not in self.manifest:
+                    del sys.modules[name]
+            affected.update(name for name in manifest.keys() | self.manifest.keys() if name.rsplit('.', 1)[0] == package)
+
+        self.manifest = manifest
+
+        timings = []
+        for module in sorted(affected):
+            timing = await self._reload(module, manifest.get(module))
+            if timing is not None:
+                timings.append(timing)
+        return timings
+
+    def pending(self):
+        return sorted(self._pending)
+
+    def _add_pending(self, entry):
+        self._forget_pending(entry.module)
+        self._pending[entry.module] = entry
+        for command in entry.commands:
+            self._command_modules[command] = entry.module
+
+    def _forget_pending(self, module):
+        entry = self._pending.pop(module, None)
+        for command in entry.commands if entry else []:
+            if self._command_modules.get(command) == module:
+                del self._command_modules[command]
+
+    async def _reload(self, module, entry):
+        if module in self._pending or module in self._loading:
+            if entry is None:
+                self._forget_pending(module)
+            else:
+                self._add_pending(entry)  # Loads the new source when it is loaded
+            return None
 
-    return exceptions
+        if module not in self.bot.extensions:
+            if entry is None:
+                return None
+            # New extensions load right away; lazy loading only pays off at startup
+            self._add_pending(entry)
+            return await self._load_pending(module, 'update')
 
+        error = None
+        import_secs = 0.0
+        if entry is not None:
+            import_secs = await asyncio.get_running_loop().run_in_executor(self.THREAD_POOL, _warm_imports, entry)
 
-def _load_from_package(bot, root, files, exceptions):
-    if not _is_extension_package(root):
-        return
+        start = time.perf_counter()
+        try:
+            if entry is None:  # Deleted, or no longer has a setup function
+                self.bot.unload_extension(module)
+            else:
+                self.bot.reload_extension(module)  # Keeps the old extension when the new one fails
+        except Exception as e:
+            error = e
 
-    for filename in files:
-        _load_from_module(bot, root, filename, exceptions)
+        timing = self.timings[module] = ExtensionTiming(module, 'update' if entry else 'unload', import_secs,
+                                                        time.perf_counter() - start, error)
+        return timing
 
+    async def _load_pending(self, module, trigger):
+        task = self._loading.get(module)
+        if task is None:
+            if module not in self._pending:
+                return None
+            # Shared, so a command used mid-load waits for the background load instead of loading twice
+            task = self._loading[module] = asyncio.ensure_future(self._load_async(self._pending[module], trigger))
+        return await task
 
-def _load_from_module(bot, root, filename, exceptions):
-    if not _is_extension_module(root, filename):
-        return
+    async def _load_async(self, entry, trigger):
+        try:
+            import_secs = await asyncio.get_running_loop().run_in_executor(self.THREAD_POOL, _warm_imports, entry)
+            timing = self._load(entry, trigger, import_secs)
+            if timing.error is not None:
+                Logger(__file__) \
+                    .message('Error while loading extension') \
+                    .add_field('extension', entry.module) \
+                    .exception(timing.error) \
+                    .error()
+            return timing
+        finally:
+            self._forget_pending(entry.module)
+            self._loading.pop(entry.module, None)
+
+    def _load(self, entry, trigger, import_secs):
+        error = None
+        start = time.perf_counter()
+        try:
+            self.bot.load_extension(entry.module)
+        except Exception as e:
+            error = e
+
+        timing = self.timings[entry.module] = ExtensionTiming(entry.module, trigger, import_secs,
+                                                              time.perf_counter() - start, error)
+        return timing
+
+
+def build_manifest():
+    """
+    Reads every extension module's source for its commands and imports; modules without a setup function are helpers,
+    not extensions, and are left out
+    :return: {module path: ExtensionEntry}
+    """
+    manifest = {}
+
+    for root, _, files in os.walk(EXTENSIONS_DIR):
+        if not _is_extension_package(root):
+            continue
+
+        for filename in sorted(files):
+            if not _is_extension_module(root, filename):
+                continue
+
+            entry = _read_entry(root, filename)
+            if entry is not None:
+                manifest[entry.module] = entry
+
+    return manifest
+
+
+def _read_entry(root, filename):
+    path = os.path.join(root, filename)
+    module = f'{root[len(ROOT_DIR) + 1:]}.{filename[:-3]}'.replace(os.sep, '.')
+    package = os.path.relpath(root, EXTENSIONS_DIR).replace(os.sep, '.')
 
-    module_path = f'{root[len(ROOT_DIR) + 1:]}.{filename[:-3]}'.replace(os.sep, '.')
     try:
-        bot.load_extension(module_path)
-    except Exception as e:
-        # Ignore when there is no setup function. Can't know if it's an intentional issue or not.
-        # If an extension SHOULD exist, but doesn't, this is likely the issue.
-        if "no 'setup' function" not in str(e):
-            exceptions.append(e)
+        with open(path, encoding='utf-8') as fd:
+            tree = ast.parse(fd.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        # Nothing is known about it; loading it reports the real error
+        return ExtensionEntry(module, package, set(), [], False)
+
+    if not any(isinstance(node, ast.FunctionDef) and node.name == 'setup' for node in tree.body):
+        return None
+
+    commands = set()
+    application_commands = False
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+
+        for decorator in node.decorator_list:
+            call = decorator if isinstance(decorator, ast.Call) else None
+            target = call.func if call else decorator
+            name = target.attr if isinstance(target, ast.Attribute) else getattr(target, 'id', None)
+
+            if name in _APPLICATION_COMMAND_DECORATORS:
+                application_commands = True
+            # Only top-level commands; subcommands are decorated by their group, not by commands
+            elif name in _PREFIX_COMMAND_DECORATORS and isinstance(target, ast.Attribute) \
+                    and getattr(target.value, 'id', None) == 'commands':
+                commands.update(_command_names(node, call))
+
+    imports = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name, None) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            imports.extend((node.module, alias.name) for alias in node.names)
+
+    return ExtensionEntry(module, package, commands, imports, application_commands)
+
+
+def _command_names(node, call):
+    name = node.name
+    aliases = []
+
+    for keyword in call.keywords if call else []:
+        if keyword.arg == 'name' and isinstance(keyword.value, ast.Constant):
+            name = keyword.value.value
+        elif keyword.arg == 'aliases' and isinstance(keyword.value, (ast.List, ast.Tuple)):
+            aliases = [element.value for element in keyword.value.elts if isinstance(element, ast.Constant)]
+
+    return {command.lower() for command in [name, *aliases]}
+
+
+def _warm_imports(entry):
+    """
+    Imports what an extension imports at the top level; failures are left for load_extension to raise
+    :return: Seconds spent importing
+    """
+    start = time.perf_counter()
+
+    for module, name in entry.imports:
+        try:
+            imported = importlib.import_module(module)
+            if name is not None and not hasattr(imported, name):  # from package import submodule
+                importlib.import_module(f'{module}.{name}')
+        except Exception:
+            pass
+
+    return time.perf_counter() - start
 
 
 def _is_extension_module(path, filename):
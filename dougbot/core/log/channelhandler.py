@@ -1,15 +1,36 @@
 import asyncio
+import io
+import os
+import time
+from collections import deque
 from logging import Formatter
 from logging import Handler
 
+from nextcord import File
+
+from dougbot import config
+from dougbot.common import limits
 from dougbot.common.logger import Logger
-from dougbot.common.messaging import message_utils
+from dougbot.config import CORE_DIR
+from dougbot.core.log.logspill import LogSpill
+from dougbot.core.log.ratelimitfilter import RateLimitFilter
 
 
 class ChannelHandler(Handler):
+    """
+    Logs records to a Discord channel without blocking the logging thread.
+    emit only queues the formatted record; a single consumer on the bot's loop sends queued records in order, as few
+    messages as possible at a time, awaiting each send so Discord's rate limits hold it back instead of piling up
+    requests. When the queue is full, records go to a bounded spill file until the consumer catches up.
+    Records are packed several to a message; one too long for a message is sent as a text file instead. A record
+    identical to one sent within the repeat window is only counted, and sent once the window ends as an xN summary.
+    Each error signature is rate limited, with the counts of what was suppressed sent periodically.
+    """
     _LOGGING_FORMAT = '%(message)s'
     _MARKDOWN_CHARACTERS = '*_~|>`'
     _LOG_DELIMITER = '-' * 100
+    _SPILL_PATH = os.path.join(CORE_DIR, 'channel_spill.log')
+    _ATTACHMENT_NAME = 'log.txt'
 
     def __init__(self, channel, loop):
         super().__init__()
@@ -17,27 +38,178 @@ class ChannelHandler(Handler):
         self._loop = loop
         self.setFormatter(Formatter(self._LOGGING_FORMAT))
 
+        configs = config.get_configuration()
+        self._max_queue_size = configs.log_queue_size
+        self._queue = deque()
+        self._spill = LogSpill(self._SPILL_PATH, configs.log_spill_size)
+
+        self._repeat_window_secs = configs.log_repeat_window_secs
+        self._repeats = {}  # Record text: [monotonic time it was sent, identical records since]
+
+        self._rate_limiter = RateLimitFilter(configs.log_rate_limit_burst, configs.log_rate_limit_per_minute)
+        self._summary_interval_secs = configs.log_rate_limit_summary_secs
+        self._next_summary = time.monotonic() + self._summary_interval_secs
+        self.addFilter(self._rate_limiter)
+
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._consumer = asyncio.run_coroutine_threadsafe(self._consume(), loop)
+
+        if self._spill.has_records():  # Left over from the last run
+            loop.call_soon_threadsafe(self._wake)
+
     def emit(self, record):
-        self._run_coroutine(self._channel.send(self._LOG_DELIMITER))
+        try:
+            text = self.format(record)
+        except Exception as e:
+            self.handleError(record, e)
+            return
+
+        # Once anything has spilled, later records spill too so they are still sent in order
+        if self._spill.has_records() or len(self._queue) >= self._max_queue_size:
+            self._spill.append(text)
+        else:
+            self._queue.append(text)
+
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:  # Loop closed; the record is spilled by aclose or lost with the handler
+            pass
+
+    async def aclose(self, timeout=5):
+        """
+        Sends what is queued, within the timeout, then stops the consumer; records still queued are spilled
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        self._consumer.cancel()
+        while self._queue:
+            self._spill.append(self._queue.popleft())
+        self.close()
 
-        # TODO THREADED ASYNC LOGGING SYSTEM
-        # TODO SMART SPLIT ON FIELDS AND REMOVE EMBEDS
-        for message in message_utils.split_message(self._normalize_record(record)):
+    def handleError(self, record, exception=None):
+        self._report_failure(self.format(record), exception)
+
+    async def _consume(self):
+        while True:
             try:
-                self._run_coroutine(self._channel.send(message))
+                await asyncio.wait_for(self._wakeup.wait(), self._summary_timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self._send_pending()
             except Exception as e:
-                self.handleError(record, e)
-                return
+                # This is the only consumer, so it carries on with the next records rather than stopping channel
+                # logging for good; the records it was sending are lost
+                self._report_failure('Records being sent when the log channel consumer failed', e)
 
-    def handleError(self, record, exception=None):
-        Logger(__file__) \
-            .message('ChannelHandler failed to send log') \
-            .add_field('record', self.format(record)) \
-            .exception(exception) \
-            .fatal()
+            self._idle.set()
+
+    async def _send_pending(self):
+        await self._send(self._expired_repeats() + self._rate_limit_summaries())
 
-    def _normalize_record(self, record):
-        return self._escape_markdown(self.format(record))
+        while self._queue or self._spill.has_records():
+            if self._queue:
+                records = [self._queue.popleft() for _ in range(len(self._queue))]
+            else:
+                records, dropped = await self._loop.run_in_executor(None, self._spill.drain)
+                if dropped:
+                    records.append(f'{dropped} log record(s) dropped while the log channel was backed up')
+
+            await self._send(self._collapse_repeats(records))
+
+    def _summary_timeout(self):
+        """
+        :return: Seconds until a repeat window ends or suppressed records are due to be reported, so their summaries
+        are sent even if nothing else is logged; None when there is nothing to report
+        """
+        deadlines = []
+        if self._repeats:
+            deadlines.append(min(sent for sent, _ in self._repeats.values()) + self._repeat_window_secs)
+        if self._rate_limiter.has_suppressed():
+            deadlines.append(self._next_summary)
+
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _rate_limit_summaries(self):
+        now = time.monotonic()
+        if now < self._next_summary:
+            return []
+
+        self._next_summary = now + self._summary_interval_secs
+        return self._rate_limiter.summaries()
+
+    def _collapse_repeats(self, records):
+        if self._repeat_window_secs <= 0:
+            return records
+
+        now = time.monotonic()
+        unique = []
+        for text in records:
+            repeat = self._repeats.get(text)
+            if repeat is not None and now - repeat[0] < self._repeat_window_secs:
+                repeat[1] += 1
+            else:
+                self._repeats[text] = [now, 0]
+                unique.append(text)
+        return unique
+
+    def _expired_repeats(self):
+        now = time.monotonic()
+        summaries = []
+        for text, (sent, count) in list(self._repeats.items()):
+            if now - sent >= self._repeat_window_secs:
+                del self._repeats[text]
+                if count > 0:
+                    summaries.append(f'x{count} in the last {self._repeat_window_secs}s:\n{text}')
+        return summaries
+
+    async def _send(self, records):
+        """
+        Packs records into as few messages as fit the message limit, in order
+        """
+        message = ''
+        for text in records:
+            block = f'{self._LOG_DELIMITER}\n{self._escape_markdown(text)}'
+
+            if len(block) > limits.MESSAGE_CHARACTER_LIMIT:
+                await self._deliver(message)
+                message = ''
+                await self._deliver_attachment(text)
+            elif len(message) + len(block) + 1 > limits.MESSAGE_CHARACTER_LIMIT:
+                await self._deliver(message)
+                message = block
+            else:
+                message = f'{message}\n{block}' if message else block
+
+        await self._deliver(message)
+
+    async def _deliver(self, message):
+        if not message:
+            return
+
+        try:
+            await self._channel.send(message)
+        except Exception as e:
+            self._report_failure(message, e)
+
+    async def _deliver_attachment(self, text):
+        first_line = self._escape_markdown(text.split('\n', 1)[0])[:limits.MESSAGE_CHARACTER_LIMIT // 2]
+        try:
+            await self._channel.send(f'{self._LOG_DELIMITER}\n{first_line}\nFull record attached',
+                                     file=File(io.BytesIO(text.encode('utf-8')), filename=self._ATTACHMENT_NAME))
+        except Exception as e:
+            self._report_failure(text, e)
+
+    def _wake(self):
+        self._idle.clear()
+        self._wakeup.set()
 
     def _escape_markdown(self, text):
         escaped_text = text
@@ -45,5 +217,10 @@ class ChannelHandler(Handler):
             escaped_text = escaped_text.replace(c, '\\' + c)
         return escaped_text
 
-    def _run_coroutine(self, coroutine):
-        asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+    @staticmethod
+    def _report_failure(text, exception):
+        Logger(__file__) \
+            .message('ChannelHandler failed to send log') \
+            .add_field('record', text) \
+            .exception(exception) \
+            .fatal()
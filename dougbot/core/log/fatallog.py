@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from dougbot import config
+from dougbot.config import CORE_DIR
+
+_FATAL_LOG = None
+_FATAL_LOG_LOCK = threading.Lock()
+
+
+def get_fatal_log():
+    global _FATAL_LOG
+
+    if _FATAL_LOG is None:
+        with _FATAL_LOG_LOCK:
+            if _FATAL_LOG is None:
+                configs = config.get_configuration()
+                _FATAL_LOG = FatalLog(os.path.join(CORE_DIR, 'fatal'), configs.fatal_log_size,
+                                      configs.fatal_log_segments)
+    return _FATAL_LOG
+
+
+class FatalLog:
+    """
+    Errors logged while the bot cannot reach its log channel, kept on disk until the bot is back.
+    Entries are JSON lines spread over a bounded number of segment files; the oldest segment is deleted when a new one
+    would go over the limit. Every entry is fsynced before append returns, so it survives the crash that follows.
+    An entry identical to one already stored, including from before a restart, is stored as its hash alone and
+    replayed as a repeat count.
+    """
+    _SEGMENT_NAME = re.compile(r'fatal\.(\d+)\.log')
+    _LEGACY_PATH = os.path.join(CORE_DIR, 'fatal.log')
+    _LEGACY_REPLAY_BYTES = 1 << 16
+
+    def __init__(self, directory, max_bytes, max_segments):
+        self._directory = directory
+        self._max_segments = max(1, max_segments)
+        self._segment_max_bytes = max(1, max_bytes // self._max_segments)
+        self._lock = threading.Lock()
+        self._fd = None
+        self._segment_number = 0
+        self._segment_size = 0
+        self._hashes = None  # Hashes of stored entries that hold their text, read when first needed
+
+    def append(self, text):
+        digest = hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest()
+
+        with self._lock:
+            entry = {'hash': digest, 'time': datetime.now(timezone.utc).isoformat(), 'text': text}
+            line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+
+            # Rotate first, as rotating can delete the stored text a repeat would refer to
+            fd = self._segment_for(len(line))
+            if digest in self._known_hashes():
+                del entry['text']
+                line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+
+            fd.write(line)
+            fd.flush()
+            os.fsync(fd.fileno())
+
+            self._segment_size += len(line)
+            if 'text' in entry and self._hashes is not None:
+                self._hashes.add(digest)
+
+    def replay(self, max_entries):
+        """
+        Reads and clears the log
+        :param max_entries: Most entries to return; older ones are only counted
+        :return: The most recent distinct entries, oldest first, as [text, count, time of the last occurrence], and
+        how many older distinct entries were left out
+        """
+        with self._lock:
+            recent = OrderedDict()
+            distinct = 0
+
+            legacy = self._read_legacy()
+            if legacy:
+                recent[None] = [legacy, 1, None]
+                distinct += 1
+
+            for entry in self._entries():
+                digest = entry.get('hash')
+                if digest in recent:
+                    recent[digest][1] += 1
+                    recent[digest][2] = entry.get('time')
+                    recent.move_to_end(digest)
+                elif 'text' in entry:
+                    recent[digest] = [entry['text'], 1, entry.get('time')]
+                    distinct += 1
+                else:  # Repeat of an entry already left out
+                    continue
+
+                if len(recent) > max_entries:
+                    recent.popitem(last=False)
+
+            self._clear()
+            return list(recent.values()), distinct - len(recent)
+
+    def _segment_for(self, size):
+        if self._fd is not None and self._segment_size + size <= self._segment_max_bytes:
+            return self._fd
+
+        if self._fd is None:
+            # Keep appending to the newest segment after a restart, if it has room
+            numbers = self._segment_numbers()
+            if numbers:
+                self._segment_number = numbers[-1]
+                self._segment_size = os.path.getsize(self._segment_path(self._segment_number))
+            if numbers and self._segment_size + size <= self._segment_max_bytes:
+                self._fd = open(self._segment_path(self._segment_number), 'ab')
+                return self._fd
+        else:
+            self._fd.close()
+
+        os.makedirs(self._directory, exist_ok=True)
+        self._segment_number += 1
+        self._segment_size = 0
+        self._fd = open(self._segment_path(self._segment_number), 'ab')
+        self._remove_old_segments()
+        return self._fd
+
+    def _remove_old_segments(self):
+        numbers = self._segment_numbers()
+        if len(numbers) <= self._max_segments:
+            return
+
+        for number in numbers[:-self._max_segments]:
+            try:
+                os.remove(self._segment_path(number))
+            except OSError:
+                pass
+        self._hashes = None  # Texts in the removed segments can no longer be repeated by hash
+
+    def _known_hashes(self):
+        if self._hashes is None:
+            self._hashes = {entry['hash'] for entry in self._entries() if 'text' in entry}
+        return self._hashes
+
+    def _entries(self):
+        for number in self._segment_numbers():
+            try:
+                with open(self._segment_path(number), 'rb') as fd:
+                    for line in fd:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:  # Torn write from a crash
+                            continue
+            except OSError:
+                continue
+
+    def _clear(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+        for number in self._segment_numbers():
+            try:
+                os.remove(self._segment_path(number))
+            except OSError:
+                pass
+
+        self._segment_number = 0
+        self._segment_size = 0
+        self._hashes = set()
+
+    def _read_legacy(self):
+        """
+        :return: The end of the single fatal.log written by earlier versions, if one is left over
+        """
+        try:
+            with open(self._LEGACY_PATH, 'rb') as fd:
+                fd.seek(max(0, os.path.getsize(self._LEGACY_PATH) - self._LEGACY_REPLAY_BYTES))
+                data = fd.read().decode('utf-8', errors='replace')
+            os.remove(self._LEGACY_PATH)
+            return data
+        except OSError:
+            return None
+
+    def _segment_numbers(self):
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return []
+
+        return sorted(int(match.group(1)) for match in map(self._SEGMENT_NAME.fullmatch, names) if match)
+
+    def _segment_path(self, number):
+        return os.path.join(self._directory, f'fatal.{number:06d}.log')
@@ -0,0 +1,24 @@
+import json
+from logging import Formatter
+
+from dougbot.common.logger import LogMessage
+
+
+class JsonFormatter(Formatter):
+    """
+    Formats each record as one line of JSON, with a Logger call's fields as keys
+    """
+
+    def format(self, record):
+        if isinstance(record.msg, LogMessage):
+            data = record.msg.as_dict()
+        else:
+            data = {'message': record.getMessage()}
+
+        data['time'] = self.formatTime(record)
+        data['logger'] = record.name
+        data.setdefault('level', record.levelname)
+        if record.exc_info:
+            data['traceback'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, ensure_ascii=False, default=str)
@@ -0,0 +1,69 @@
+import os
+import threading
+
+
+class LogSpill:
+    """
+    Bounded file holding log records the channel handler could not queue, replayed in order once it catches up.
+    Records left over when the bot stops are replayed on the next start.
+    """
+    _SEPARATOR = '\x1e'  # ASCII record separator
+
+    def __init__(self, path, max_bytes):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._dropped = 0
+
+        try:
+            self._size = os.path.getsize(path)
+        except OSError:
+            self._size = 0
+
+    def has_records(self):
+        return self._size > 0 or self._dropped > 0
+
+    def append(self, text):
+        """
+        :return: False when the record was dropped because the spill is full or unwritable
+        """
+        data = (text.replace(self._SEPARATOR, ' ') + self._SEPARATOR).encode('utf-8')
+
+        with self._lock:
+            if self._size + len(data) > self._max_bytes:
+                self._dropped += 1
+                return False
+
+            try:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                with open(self._path, 'ab') as fd:
+                    fd.write(data)
+            except OSError:
+                self._dropped += 1
+                return False
+
+            self._size += len(data)
+            return True
+
+    def drain(self):
+        """
+        Empties the spill
+        :return: The spilled records, oldest first, and how many records were dropped since the last drain
+        """
+        with self._lock:
+            try:
+                with open(self._path, 'rb') as fd:
+                    data = fd.read()
+            except OSError:
+                data = b''
+
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+            self._size = 0
+            dropped, self._dropped = self._dropped, 0
+
+        records = [record for record in data.decode('utf-8', errors='replace').split(self._SEPARATOR) if record]
+        return records, dropped
@@ -0,0 +1,98 @@
+import threading
+import time
+from logging import Filter
+
+from dougbot.common.logger import Logger, LogMessage
+
+
+class RateLimitFilter(Filter):
+    """
+    A token bucket per error signature - exception type, module and method - so an error firing in a loop can't use up
+    the bot's Discord API budget. Each signature may log a burst of records, then refills at a steady rate; records
+    over the limit are dropped and counted, and the counts are reported by summaries().
+    Records not logged through Logger are never limited.
+    """
+
+    def __init__(self, burst, per_minute):
+        super().__init__()
+        self._burst = burst
+        self._rate = per_minute / 60
+        self._buckets = {}  # Signature: [tokens, monotonic time of the last refill, records suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self._burst <= 0:
+            return True
+
+        signature = self.signature(record)
+        if signature is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(signature)
+            if bucket is None:
+                bucket = self._buckets[signature] = [self._burst, now, 0]
+            else:
+                bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True
+
+            bucket[2] += 1
+            return False
+
+    def has_suppressed(self):
+        with self._lock:
+            return any(bucket[2] for bucket in self._buckets.values())
+
+    def summaries(self):
+        """
+        Reports and resets the suppressed counts, and forgets signatures whose buckets have refilled
+        :return: A line per signature that had records suppressed since the last call
+        """
+        now = time.monotonic()
+        lines = []
+
+        with self._lock:
+            for signature, bucket in list(self._buckets.items()):
+                tokens, refilled, suppressed = bucket
+                if suppressed:
+                    exception_type, module, method = signature
+                    lines.append(f'Suppressed {suppressed} record(s) of {exception_type or "no exception"} '
+                                 f'from {module} ({method})')
+                    bucket[2] = 0
+                elif tokens + (now - refilled) * self._rate >= self._burst:
+                    del self._buckets[signature]
+
+        return lines
+
+    @staticmethod
+    def signature(record):
+        if not isinstance(record.msg, LogMessage):
+            return None
+
+        fields = record.msg.fields
+        exception = fields.get(Logger.EXCEPTION_FIELD)
+        # Command errors arrive wrapped, so the error the command raised tells them apart
+        exception = getattr(exception, 'original', exception)
+        # Every command error is logged from the same handler, so they're told apart by the command instead; other
+        # records without a method by their message
+        method = fields.get(Logger.METHOD_FIELD) or RateLimitFilter._command_name(fields) \
+            or fields.get(Logger.MESSAGE_FIELD)
+        return (type(exception).__qualname__ if exception is not None else None,
+                fields.get(Logger.MODULE_FIELD),
+                str(method))
+
+    @staticmethod
+    def _command_name(fields):
+        ctx = fields.get(Logger.CONTEXT_FIELD)
+        command = getattr(ctx, 'command', None)
+        if command is None:
+            interaction = fields.get(Logger.INTERACTION_FIELD)
+            command = getattr(interaction, 'application_command', None)
+
+        name = getattr(command, 'qualified_name', None)
+        return f'command {name}' if name else None
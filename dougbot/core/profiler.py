@@ -0,0 +1,173 @@
+"""
+Times the bot's startup: when each phase finished, measured from when run.py imported this module, and what every module
+import cost. Only the standard library is imported here, so run.py can import it before anything it should measure.
+"""
+import importlib.abc
+import json
+import os
+import sys
+import threading
+import time
+
+RESTART_REQUESTED_ENV = 'DOUGBOT_RESTART_REQUESTED_AT'  # Wall time the previous process re-executed itself
+
+_START = time.perf_counter()
+_WALL_START = time.time()
+
+_PHASES = []  # (phase, seconds since start)
+_IMPORTS = {}  # Module: [seconds in its own body, seconds including its imports, importing module]
+_LOCK = threading.Lock()
+_FINDER = None
+_REPORT = None
+
+
+class _TimedLoader:
+    """
+    Wraps a module's loader while it is executed; the module gets its own loader back afterwards
+    """
+
+    _STACK = threading.local()  # Modules being executed on each thread, innermost last, with time spent in imports
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._stack()
+        parent = stack[-1][0] if stack else None
+        stack.append([module.__name__, 0.0])
+
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - start
+            _, children = stack.pop()
+            if stack:
+                stack[-1][1] += cumulative
+
+            module.__loader__ = self._loader
+            if getattr(module, '__spec__', None) is not None:
+                module.__spec__.loader = self._loader
+
+            with _LOCK:
+                _IMPORTS[module.__name__] = [cumulative - children, cumulative, parent]
+
+    def _stack(self):
+        stack = getattr(self._STACK, 'modules', None)
+        if stack is None:
+            stack = self._STACK.modules = []
+        return stack
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = _TimedLoader(spec.loader)
+            return spec
+
+        return None
+
+
+def start():
+    """
+    Starts timing module imports; call before importing what should be measured
+    """
+    global _FINDER
+
+    if _FINDER is None and _REPORT is None:
+        _FINDER = _TimingFinder()
+        sys.meta_path.insert(0, _FINDER)
+
+
+def mark(phase):
+    """
+    Records that a phase of startup finished; later marks of the same phase, as on reconnects, are ignored
+    """
+    with _LOCK:
+        if _REPORT is None and all(name != phase for name, _ in _PHASES):
+            _PHASES.append((phase, time.perf_counter() - _START))
+
+
+def finish():
+    """
+    Stops timing imports and builds the report
+    :return: The report as a dict, or None when startup already finished
+    """
+    global _FINDER, _REPORT
+
+    with _LOCK:
+        if _REPORT is not None:
+            return None
+
+        if _FINDER is not None:
+            sys.meta_path.remove(_FINDER)
+            _FINDER = None
+
+        phases = []
+        previous = 0.0
+        for phase, end in _PHASES:
+            phases.append({'phase': phase, 'secs': end - previous, 'at_secs': end})
+            previous = end
+
+        restart_requested_at = os.environ.pop(RESTART_REQUESTED_ENV, None)
+        _REPORT = {
+            'started_at': _WALL_START,
+            'total_secs': previous,
+            # Downtime before this process started, when it replaced one that restarted itself
+            'restart_gap_secs': _WALL_START - float(restart_requested_at) if restart_requested_at else None,
+            'phases': phases,
+            'imports': {module: {'self_secs': self_secs, 'cumulative_secs': cumulative, 'imported_by': parent}
+                        for module, (self_secs, cumulative, parent) in _IMPORTS.items()},
+        }
+        _IMPORTS.clear()
+
+    return _REPORT
+
+
+def report_lines(report, top_modules):
+    """
+    :param top_modules: How many of the costliest libraries imported by the bot's own modules to list
+    """
+    lines = [f"Started in {report['total_secs']:.2f}s"]
+    if report['restart_gap_secs'] is not None:
+        lines[0] += f" ({report['restart_gap_secs']:.2f}s before that since the restart was requested)"
+
+    lines.extend(f"{phase['phase']}: {phase['secs']:.2f}s" for phase in report['phases'])
+
+    imports = report['imports']
+    if imports and top_modules > 0:
+        # A library's cost includes everything it imports, so only libraries imported by the bot itself are listed
+        libraries = sorted(((module, cost) for module, cost in imports.items()
+                            if not _is_own(module) and (cost['imported_by'] is None or _is_own(cost['imported_by']))),
+                           key=lambda item: item[1]['cumulative_secs'], reverse=True)
+        own_secs = sum(cost['self_secs'] for module, cost in imports.items() if _is_own(module))
+
+        lines.append(f"Imports: {len(imports)} modules, bot's own modules {own_secs:.2f}s")
+        lines.extend(f"  {module}: {cost['cumulative_secs']:.3f}s (by {cost['imported_by'] or 'run.py'})"
+                     for module, cost in libraries[:top_modules])
+
+    return lines
+
+
+def dump(report, path):
+    with open(path, 'w', encoding='utf-8') as fd:
+        json.dump(report, fd, indent=2)
+
+
+def _is_own(module):
+    return module == 'dougbot' or module.startswith('dougbot.')
@@ -0,0 +1,102 @@
+"""
+Carries in-memory state across a restart. Cogs register a name with a function returning JSON-serializable state and a
+function taking it back; the states are written to a file just before the bot re-executes itself, and handed back
+once the new process is ready and its extensions are loaded.
+"""
+import inspect
+import json
+import os
+import time
+
+from dougbot import config
+from dougbot.common.fileutils import atomic_write
+from dougbot.common.logger import Logger
+from dougbot.config import CORE_DIR
+
+_PATH = os.path.join(CORE_DIR, 'handoff.json')
+
+_PROVIDERS = {}  # Name: (save, restore)
+
+
+def register(name, save, restore):
+    """
+    :param save: Returns the state to carry over, or None when there is none
+    :param restore: Takes the saved state back; may be a coroutine function
+    """
+    _PROVIDERS[name] = (save, restore)
+
+
+def unregister(name):
+    _PROVIDERS.pop(name, None)
+
+
+def save():
+    """
+    Writes every registered state; a state that fails to save is logged and left out
+    :return: Names of the states written
+    """
+    states = {}
+    for name, (save_state, _) in list(_PROVIDERS.items()):
+        try:
+            state = save_state()
+            if state is not None:
+                states[name] = state
+        except Exception as e:
+            _log_failure('Failed to save state before restart', name, e)
+
+    with atomic_write(_PATH, 'w', encoding='utf-8') as fd:
+        json.dump({'saved_at': time.time(), 'states': states}, fd)
+
+    return list(states)
+
+
+async def restore():
+    """
+    Hands saved states back to whatever registered them since, once; states too old or with nothing registered to
+    take them are dropped
+    :return: Names of the states restored
+    """
+    try:
+        with open(_PATH, encoding='utf-8') as fd:
+            handoff = json.load(fd)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        _log_failure('Failed to read saved state', None, e)
+        handoff = None
+    finally:
+        _remove()
+
+    if handoff is None or time.time() - handoff.get('saved_at', 0) > config.get_configuration().handoff_max_age_secs:
+        return []  # Left by a restart that failed, so the state may be long out of date
+
+    restored = []
+    for name, state in handoff.get('states', {}).items():
+        provider = _PROVIDERS.get(name)
+        if provider is None:
+            continue
+
+        try:
+            result = provider[1](state)
+            if inspect.isawaitable(result):
+                await result
+            restored.append(name)
+        except Exception as e:
+            _log_failure('Failed to restore state after restart', name, e)
+
+    return restored
+
+
+def _remove():
+    try:
+        os.remove(_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def _log_failure(message, name, exception):
+    Logger(__file__) \
+        .message(message) \
+        .add_field('state', name) \
+        .exception(exception) \
+        .error()
@@ -1,36 +1,57 @@
+import os
 
-from nextcord.ext import commands
+from nextcord.ext import commands, tasks
 from nextcord.ext.commands import Context
 
 from dougbot import config
+from dougbot.common.logger import Logger
 from dougbot.common.messaging import reactions
 from dougbot.core.bot import DougBot
 from dougbot.extensions.common.annotation.admincheck import admin_command
 
 
 class ConfigAdmin(commands.Cog):
-    _PRIVATE_CONFIGS = {'token'}
+    _PRIVATE_CONFIGS = {'token', 'username', 'password', 'host', 'database'}
     _NO_DELETE_CONFIGS = {'command_prefix', 'admin_role_id', 'mod_role_id', 'debug_channel_id', 'logging_channel_id'}
 
     def __init__(self, bot: DougBot):
         self.bot = bot
+        self._config_mtimes = self._read_mtimes()
+
+        self._schedule_watch()
+        config.subscribe(self._on_config_change)
+
+    def cog_unload(self):
+        config.unsubscribe(self._on_config_change)
+        self._watch_config.cancel()
+
+    def _on_config_change(self, changes):
+        if 'config_watch_secs' in changes:
+            self._schedule_watch()
+
+    # Starts, stops or retimes the config file watcher to match the config
+    def _schedule_watch(self):
+        watch_secs = config.get_configuration().config_watch_secs
+        if watch_secs > 0:
+            self._watch_config.change_interval(seconds=watch_secs)
+            if not self._watch_config.is_running():
+                self._watch_config.start()
+        elif self._watch_config.is_running():
+            self._watch_config.cancel()
 
     @commands.group(aliases=['configs'], case_insensitive=True)
     @admin_command()
     async def config(self, ctx: Context):
-        # TODO SAVE TO CONFIG FILE?
-        #  CONFIGS IN DB TOO?
+        # TODO CONFIGS IN DB TOO?
         pass
 
     @config.command()
     @admin_command()
     async def add(self, ctx: Context, name: str, *, value: str):
-        configs = vars(config.get_configuration())
-        if name in configs:
+        if name in vars(config.get_configuration()):
             await reactions.confusion(ctx.message, f"'{name}' is already in configs")
             return
-        configs[name] = value
-        await reactions.confirmation(ctx.message)
+        await self._set(ctx, name, value)
 
     @config.command()
     @admin_command()
@@ -38,6 +59,19 @@ class ConfigAdmin(commands.Cog):
         configs = {k: v for k, v in vars(config.get_configuration()).items() if k not in self._PRIVATE_CONFIGS}
         await ctx.author.send(f'{configs}')
 
+    @config.command()
+    @admin_command()
+    async def reload(self, ctx: Context):
+        try:
+            changes = config.reload_configuration()
+        except config.ConfigError as e:
+            await reactions.confusion(ctx.message, str(e))
+            return
+
+        self._config_mtimes = self._read_mtimes()
+        changed = ', '.join(sorted(name for name in changes if name not in self._PRIVATE_CONFIGS))
+        await ctx.send(f'Reloaded configs; changed: {changed}' if changed else 'Reloaded configs; nothing changed')
+
     @config.command()
     @admin_command()
     async def remove(self, ctx: Context, name: str):
@@ -45,9 +79,11 @@ class ConfigAdmin(commands.Cog):
             await reactions.confusion(ctx.message, f"'{name}' can't be deleted")
             return
 
-        configs = vars(config.get_configuration())
-        if name in configs:
-            del configs[name]
+        try:
+            config.remove_value(name)
+        except config.ConfigError as e:
+            await reactions.confusion(ctx.message, str(e))
+            return
         await reactions.confirmation(ctx.message)
 
     @config.command()
@@ -56,9 +92,50 @@ class ConfigAdmin(commands.Cog):
         if name in self._PRIVATE_CONFIGS:
             await reactions.confusion(ctx.message, f"'{name}' is a private config")
             return
-        vars(config.get_configuration())[name] = value
+        await self._set(ctx, name, value)
+
+    async def _set(self, ctx, name, value):
+        try:
+            config.set_value(name, value)
+        except (config.ConfigError, OSError) as e:  # OSError when persisting the edit failed
+            await reactions.confusion(ctx.message, str(e))
+            return
+
+        self._config_mtimes = self._read_mtimes()  # Persisting rewrote overrides.ini
         await reactions.confirmation(ctx.message)
 
+    @tasks.loop(seconds=10)
+    async def _watch_config(self):
+        mtimes = self._read_mtimes()
+        if mtimes == self._config_mtimes:
+            return
+        self._config_mtimes = mtimes
+
+        try:
+            changes = config.reload_configuration()
+        except config.ConfigError as e:
+            Logger(__file__) \
+                .message('Config files changed but were not reloaded') \
+                .exception(e) \
+                .error()
+            return
+
+        if changes:
+            Logger(__file__) \
+                .message('Reloaded configs after the config files changed') \
+                .add_field('changed', ', '.join(sorted(name for name in changes if name not in self._PRIVATE_CONFIGS))) \
+                .info()
+
+    @staticmethod
+    def _read_mtimes():
+        mtimes = []
+        for path in config.config_paths():
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
 
 def setup(bot: DougBot):
     bot.add_cog(ConfigAdmin(bot))
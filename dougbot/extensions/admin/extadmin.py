@@ -4,16 +4,29 @@ from nextcord.ext import commands
 from nextcord.ext.commands import Context
 
 from dougbot.common.messaging import reactions
+from dougbot.common.messaging.message_utils import split_message
+from dougbot.core import statehandoff
 from dougbot.core.bot import DougBot
 from dougbot.extensions.common.annotation.admincheck import admin_command, mod_command
 
 
 class ExtensionAdmin(commands.Cog):
     _READONLY_EXTENSIONS = {'Debug', 'ExtensionAdmin', 'Resources', 'Update'}
+    _MODULE_PREFIX = 'dougbot.extensions.'
 
     def __init__(self, bot: DougBot):
         self.bot = bot
         self._disabled_cogs = {}
+        statehandoff.register('ExtensionAdmin.disabled', lambda: sorted(self._disabled_cogs), self._restore_disabled)
+
+    def cog_unload(self):
+        statehandoff.unregister('ExtensionAdmin.disabled')
+
+    def _restore_disabled(self, names):
+        for name in names:
+            cog = self.bot.remove_cog(name) if name not in self._READONLY_EXTENSIONS else None
+            if cog:
+                self._disabled_cogs[name] = cog
 
     @commands.group(aliases=['extensions'], case_insensitive=True)
     @admin_command()
@@ -34,6 +47,10 @@ class ExtensionAdmin(commands.Cog):
         if len(disabled_cogs):
             cog_list += '\n\n**Disabled Extensions:**\n' + '\n'.join(disabled_cogs)
 
+        pending_modules = self.bot.extension_loader.pending()
+        if len(pending_modules):
+            cog_list += '\n\n**Not Loaded Yet:**\n' + '\n'.join(pending_modules)
+
         await ctx.send(cog_list)
 
     @extension.command()
@@ -42,6 +59,20 @@ class ExtensionAdmin(commands.Cog):
         is_disabled = name in self._disabled_cogs
         await ctx.send(f"{name} is {'disabled' if is_disabled else 'enabled'}")
 
+    @extension.command()
+    @mod_command()
+    async def timings(self, ctx: Context):
+        timings = sorted(self.bot.extension_loader.timings.values(),
+                         key=lambda t: t.import_secs + t.setup_secs, reverse=True)
+        if not timings:
+            await ctx.send('No extensions loaded yet')
+            return
+
+        lines = [f'{t.module[len(self._MODULE_PREFIX):]}: import {t.import_secs * 1000:.0f} ms, '
+                 f'setup {t.setup_secs * 1000:.0f} ms ({t.trigger}{", failed" if t.error else ""})' for t in timings]
+        for message in split_message('\n'.join(lines)):
+            await ctx.send(message)
+
     @extension.command()
     @admin_command()
     async def enable(self, ctx, name: str):
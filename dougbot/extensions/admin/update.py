@@ -1,18 +1,27 @@
 import os
-import subprocess
+import shutil
 import sys
+import time
 
 from nextcord import Status
 from nextcord.ext import commands
 
+from dougbot import config
+from dougbot.common import asyncprocess, database
 from dougbot.common.logger import Logger
 from dougbot.common.messaging import reactions
 from dougbot.config import ROOT_DIR
+from dougbot.core import profiler, statehandoff
 from dougbot.core.bot import DougBot
 from dougbot.extensions.common.annotation.admincheck import admin_command
 
 
 class Update(commands.Cog):
+    # Changed files outside these need the whole bot restarted; extensions' shared helpers are imported by many
+    _HOT_RELOAD_PREFIX = 'dougbot/extensions/'
+    _NO_HOT_RELOAD_PREFIXES = ('dougbot/extensions/common/',)
+    _RESTART_FILES = {'run.py', 'setup.py'}
+    _PYTHON_NAMES = ('python', 'python3')
 
     def __init__(self, bot: DougBot):
         self.bot = bot
@@ -35,52 +44,124 @@ class Update(commands.Cog):
     @commands.command()
     @admin_command()
     async def update_libs(self, ctx):
-        python_names = ['python', 'python3']
-        first_exception = None
-        error_count = 0
-
-        for python_name in python_names:
-            try:
-                await self._update(ctx, [python_name, os.path.join(ROOT_DIR, 'setup.py')])
-                break
-            except Exception as e:
-                if first_exception is None:
-                    first_exception = e
-                error_count += 1
-
-        if error_count >= len(python_names):
-            await reactions.confusion(ctx.message)
-            raise first_exception
-
-        await self._restart_bot(ctx)
-
-    async def _update(self, ctx, *cmds):
-        cwd = os.getcwd()
-        os.chdir(ROOT_DIR)
-
+        # Each looked up before running anything, as a missing git or python both fail with the same FileNotFoundError
+        python = next(filter(None, map(shutil.which, self._PYTHON_NAMES)), None)
+        if python is None:
+            await reactions.confusion(ctx.message, f"No python found; tried {', '.join(self._PYTHON_NAMES)}")
+            return
+        if shutil.which('git') is None:
+            await reactions.confusion(ctx.message, 'git not found')
+            return
+
+        await self._update(ctx, [python, os.path.join(ROOT_DIR, 'setup.py')], restart=True)
+
+    async def _update(self, ctx, *cmds, restart=False):
+        """
+        :param restart: Restart even when only extensions changed
+        """
         try:
             await self.bot.change_presence(status=Status.offline)
+            old_head = await self._git_head()
             await self._process_commands(*cmds)
-            await self._restart_bot(ctx)
+            changed = await self._changed_files(old_head)
+
+            if restart or not config.get_configuration().update_hot_reload or self._needs_restart(changed):
+                await self._restart_bot(ctx)
+            else:
+                await self._hot_reload(ctx, changed)
+                await self.bot.change_presence(status=Status.online)
         except Exception:
             await self.bot.change_presence(status=Status.online)
             raise
-        finally:
-            os.chdir(cwd)
 
     async def _restart_bot(self, ctx):
         await ctx.message.delete(delay=3)
         await self.bot.change_presence(status=Status.offline)
+        os.environ[profiler.RESTART_REQUESTED_ENV] = str(time.time())  # The next process reports the downtime
+        statehandoff.save()
+        try:
+            await database.close_database()  # Writes out anything buffered for the database
+        except Exception as e:
+            Logger(__file__) \
+                .message('Failed to close the database before restart') \
+                .exception(e) \
+                .error()
         os.execl(sys.executable, sys.executable, *sys.argv)
 
         Logger(__file__)\
             .message('Failed to restart bot')\
             .fatal()
 
+    async def _hot_reload(self, ctx, changed):
+        config_files = {os.path.relpath(path, ROOT_DIR).replace(os.sep, '/') for path in config.config_paths()}
+        if config_files.intersection(changed):
+            try:
+                config.reload_configuration()
+            except config.ConfigError as e:
+                Logger(__file__) \
+                    .message('Updated config files were not reloaded') \
+                    .exception(e) \
+                    .error()
+
+        timings = await self.bot.extension_loader.reload_files(changed)
+
+        failed = [timing for timing in timings if timing.error is not None]
+        for timing in failed:
+            Logger(__file__) \
+                .message('Failed to reload extension after update; the old version is still running') \
+                .extension(timing.module) \
+                .exception(timing.error) \
+                .error()
+
+        if failed:
+            await reactions.confusion(ctx.message, f"Failed to reload {', '.join(t.module for t in failed)}")
+        else:
+            reloaded = ', '.join(timing.module for timing in timings)
+            await reactions.confirmation(ctx.message, f'Reloaded {reloaded}' if reloaded else 'No extensions changed')
+
+    def _needs_restart(self, changed):
+        if changed is None:  # Unknown what changed
+            return True
+
+        for path in changed:
+            if path in self._RESTART_FILES:
+                return True
+            if path.endswith('.py') and path.startswith('dougbot/') and \
+                    (not path.startswith(self._HOT_RELOAD_PREFIX) or path.startswith(self._NO_HOT_RELOAD_PREFIXES)
+                     or path.count('/') < 3):  # Modules directly in dougbot/extensions, outside any extension
+                return True
+        return False
+
+    @staticmethod
+    async def _git_head():
+        result = await asyncprocess.run('git', 'rev-parse', 'HEAD', cwd=ROOT_DIR, timeout=60, log_output=False)
+        return result.stdout.strip() if result.ok else None
+
+    @staticmethod
+    async def _changed_files(old_head):
+        """
+        :return: Paths changed since old_head, relative to the root with / separators, or None when unknown
+        """
+        if old_head is None:
+            return None
+
+        result = await asyncprocess.run('git', 'diff', '--name-only', old_head, 'HEAD', cwd=ROOT_DIR, timeout=60,
+                                        log_output=False)
+        return result.stdout.split() if result.ok else None
+
     @staticmethod
     async def _process_commands(*cmds):
+        """
+        Runs each command in turn, with its output sent to the log channel as it runs
+        :raises asyncprocess.ProcessError: When a command fails or times out; later commands are not run
+        """
+        configs = config.get_configuration()
         for command in cmds:
-            subprocess.call(command)
+            result = await asyncprocess.run(*command, cwd=ROOT_DIR, timeout=configs.update_command_timeout_secs,
+                                            batch_secs=configs.update_output_batch_secs, check=True)
+            Logger(__file__) \
+                .message(f"'{' '.join(command)}' finished in {result.duration_secs:.1f}s") \
+                .info()
 
 
 def setup(bot):
@@ -1,13 +1,170 @@
+import asyncio
+import time
+import uuid
+import weakref
+
+from nextcord import Member
 from nextcord.ext import commands
+from nextcord.ext.commands import Context
 
+from dougbot import config
+from dougbot.common.bankerrors import BankError, InsufficientFundsError
+from dougbot.common.database import get_database
+from dougbot.common.messaging import reactions
+from dougbot.common.writebehind import WriteBehind
 from dougbot.core.bot import DougBot
 
 
 class Bank(commands.Cog):
+    """
+    Balances by account id (a Discord user id), kept in memory so reads and changes never wait on the database.
+    Every change is appended to a journal, and the changed balances are snapshotted; both are written to the database
+    in batches, together in one transaction.
+    Calling the bank from a different extension:
+        bank = self.bot.get_cog('Bank')
+        await bank.withdraw(ctx.author.id, 10, 'slots bet')
+    """
+    _CREATE_ACCOUNTS = 'CREATE TABLE IF NOT EXISTS bank_accounts (' \
+                       'account_id BIGINT PRIMARY KEY, ' \
+                       'balance BIGINT NOT NULL)'
+    _CREATE_JOURNAL = 'CREATE TABLE IF NOT EXISTS bank_journal (' \
+                      'txn_id CHAR(32) NOT NULL, ' \
+                      'account_id BIGINT NOT NULL, ' \
+                      'amount BIGINT NOT NULL, ' \
+                      'balance BIGINT NOT NULL, ' \
+                      'reason VARCHAR(100) NOT NULL, ' \
+                      'created_at DOUBLE NOT NULL)'
+    _JOURNAL_COLUMNS = ('txn_id', 'account_id', 'amount', 'balance', 'reason', 'created_at')
 
     def __init__(self, bot: DougBot):
         self.bot = bot
-        # Calling the bank from a different extension: bank = self.bot.get_cog('Bank')
+
+        configs = config.get_configuration()
+        self._database = get_database()
+        # Named, so after a reload the writes the unloaded bank still had buffered go out before this one's
+        self._writes = WriteBehind(self._database, configs.bank_flush_rows, configs.bank_flush_secs, name='bank')
+
+        self._balances = None  # Account id: balance, loaded on first use
+        self._load_lock = asyncio.Lock()
+        self._account_locks = weakref.WeakValueDictionary()  # Only accounts being changed or waited on
+
+    def cog_unload(self):
+        # Refused from now, so a command still running on this instance can't buffer a balance the next bank has
+        # already moved on from
+        self._writes.stop()
+        asyncio.ensure_future(self._writes.aclose())
+
+    async def balance(self, account_id):
+        await self._load()
+        return self._balances.get(account_id, config.get_configuration().bank_starting_balance)
+
+    async def deposit(self, account_id, amount, reason):
+        """
+        :return: The new balance
+        """
+        self._check_amount(amount)
+        await self._load()
+        async with self._account_lock(account_id):
+            return self._change(uuid.uuid4().hex, account_id, amount, reason)
+
+    async def withdraw(self, account_id, amount, reason):
+        """
+        :return: The new balance
+        :raises InsufficientFundsError: When the balance is less than amount; nothing is taken
+        """
+        self._check_amount(amount)
+        await self._load()
+        async with self._account_lock(account_id):
+            self._check_funds(account_id, amount)
+            return self._change(uuid.uuid4().hex, account_id, -amount, reason)
+
+    async def transfer(self, from_account_id, to_account_id, amount, reason):
+        """
+        Moves amount between accounts, both or neither changing; the journal entries share a transaction id
+        :return: The new balances of from_account_id and to_account_id
+        :raises InsufficientFundsError: When from_account_id has less than amount
+        """
+        self._check_amount(amount)
+        if from_account_id == to_account_id:
+            raise BankError('Cannot transfer to the same account')
+
+        await self._load()
+        # Always locked in the same order, so two opposite transfers can't each hold the lock the other waits on
+        first, second = sorted((from_account_id, to_account_id))
+        async with self._account_lock(first), self._account_lock(second):
+            self._check_funds(from_account_id, amount)
+            txn_id = uuid.uuid4().hex
+            return self._change(txn_id, from_account_id, -amount, reason), \
+                self._change(txn_id, to_account_id, amount, reason)
+
+    async def flush(self):
+        """
+        Writes the journal and balances changed since the last flush now, rather than at the next interval
+        """
+        await self._writes.flush()
+
+    @commands.command(name='balance')
+    async def balance_command(self, ctx: Context, member: Member = None):
+        member = member or ctx.author
+        await ctx.send(f'{member.display_name} has {await self.balance(member.id)}')
+
+    @commands.command()
+    async def give(self, ctx: Context, member: Member, amount: int):
+        if member.bot or amount <= 0:
+            await reactions.confusion(ctx.message)
+            return
+
+        try:
+            await self.transfer(ctx.author.id, member.id, amount, f'give from {ctx.author.id}')
+        except InsufficientFundsError as e:
+            await reactions.confusion(ctx.message, f'You only have {e.balance}')
+            return
+
+        await reactions.confirmation(ctx.message)
+
+    async def _load(self):
+        if self._balances is not None:
+            return
+
+        async with self._load_lock:
+            if self._balances is not None:
+                return
+
+            try:
+                await self._writes.flush()  # Balances an unloaded bank was still writing, so none are read stale
+                await self._database.execute(Bank._CREATE_ACCOUNTS)
+                await self._database.execute(Bank._CREATE_JOURNAL)
+                rows = await self._database.fetch_all('SELECT account_id, balance FROM bank_accounts')
+            except Exception as e:
+                raise BankError('Failed to load balances') from e
+
+            self._balances = {account_id: balance for account_id, balance in rows}
+
+    def _account_lock(self, account_id):
+        lock = self._account_locks.get(account_id)
+        if lock is None:
+            lock = self._account_locks[account_id] = asyncio.Lock()
+        return lock
+
+    def _change(self, txn_id, account_id, amount, reason):
+        balance = self._balances.get(account_id, config.get_configuration().bank_starting_balance) + amount
+
+        # Buffered before the balance changes, as the buffer refuses rows once the bank is unloaded
+        self._writes.append('bank_journal', Bank._JOURNAL_COLUMNS,
+                            (txn_id, account_id, amount, balance, reason[:100], time.time()))
+        self._writes.upsert('bank_accounts', ('account_id',), ('account_id', 'balance'), (account_id, balance))
+        self._balances[account_id] = balance
+        return balance
+
+    def _check_funds(self, account_id, amount):
+        balance = self._balances.get(account_id, config.get_configuration().bank_starting_balance)
+        if balance < amount:
+            raise InsufficientFundsError(account_id, balance, amount)
+
+    @staticmethod
+    def _check_amount(amount):
+        if not isinstance(amount, int) or amount <= 0:
+            raise BankError(f'Amount must be a positive whole number, not {amount!r}')
 
 
 def setup(bot):
@@ -0,0 +1,263 @@
+import random
+import string
+
+from dougbot.extensions.markov.markov_lib import MarkovLib
+
+
+# Compact chain store holding every order from 1 up to the chain's order in one trie
+# The trie is keyed on the context read backwards: a node for a context of n words is the child of the node for its
+# last n - 1 words, so all orders share the same prefix nodes instead of each order repeating its own tuple keys.
+# The root holds the counts with no context at all.
+##Node Template: [total, {leafWord: leafCount}, {previousWord: node}]   #['wood' after 'the': [7, {'wood': 5}, {...}]]
+class MarkovChain:
+    # Static variables
+    MIN_ORDER = 1
+    MAX_ORDER = 4
+    SPARSE = 2  # States seen fewer times than this back off to a lower order
+    _TOTAL = 0  # Occurances of words after the context
+    _WORDS = 1  # Occurances of each word after the context
+    _PREVIOUS = 2  # Longer contexts ending in this one, by the word before it
+    _START = ""  # Context before the first word of a sentence
+    _SPARSE_FLOOR = 2  # Sparse states never back off below this order; unseen states back off as far as needed
+    _VARIANT_PUNCTUATION = string.punctuation + '\u2018\u2019\u201C\u201D\u2026\u2013\u2014\u00AB\u00BB\u00BF\u00A1'
+
+    ##order         - Most words of context a state can have
+    def __init__(self, order=2):
+        if not MarkovChain.MIN_ORDER <= order <= MarkovChain.MAX_ORDER:
+            raise ValueError(f'Markov order must be between {MarkovChain.MIN_ORDER} and {MarkovChain.MAX_ORDER}')
+
+        self.order = order
+        self.root = MarkovChain._node()
+
+    # Builds a chain from the original bigram dictionary format
+    ##markovDict    - dict{(rootOne, rootTwo):[rootCount, dict{leafWord:leafCount}]}
+    @staticmethod
+    def fromDict(markovDict, order=2):
+        chain = MarkovChain(order)
+        for (rootOne, rootTwo), (total, leaves) in markovDict.items():
+            # Every sentence adds exactly one state starting with the empty root, so its total is how many
+            # sentences started with rootTwo
+            if rootOne == MarkovChain._START:
+                chain._add((MarkovChain._START,), rootTwo, total)
+            for leafWord, count in leaves.items():
+                chain._add((rootOne, rootTwo), leafWord, count)
+        return chain
+
+    # Adds many sentences to the chain
+    # Runs are grouped by context, then each level of contexts is folded into the next shorter one, so every node
+    # the batch touches is found and counted once rather than once per distinct run passing through it.
+    ##sentences     - Iterable of sentences to be added to the chain
+    def addSentences(self, sentences):
+        longest = {}  # (outermost word, ..., last word): {leafWord: leafCount}
+        for gram, count in MarkovLib.countGrams(sentences, self.order + 1).items():
+            leafWord = gram[-1]
+            if leafWord == MarkovLib._BREAK:  # End of a sentence
+                if gram[-2] == MarkovLib._BREAK or gram[-2] in string.punctuation:
+                    continue
+                leafWord = "."
+
+            leaves = longest.get(gram[:-1])
+            if leaves is None:
+                leaves = longest[gram[:-1]] = {}
+            leaves[leafWord] = leaves.get(leafWord, 0) + count
+
+        levels = [longest]  # Contexts of order words down to none
+        for _ in range(self.order):
+            shorter = {}
+            for context, leaves in levels[-1].items():
+                merged = shorter.get(context[1:])
+                if merged is None:
+                    shorter[context[1:]] = dict(leaves)
+                else:
+                    for leafWord, count in leaves.items():
+                        merged[leafWord] = merged.get(leafWord, 0) + count
+            levels.append(shorter)
+
+        noContext = levels.pop()
+        if noContext:
+            MarkovChain._countAll(self.root, noContext[()])
+
+        nodes = {(): self.root}
+        for contexts in reversed(levels):
+            longerNodes = {}
+            for context, leaves in contexts.items():
+                # A context reaching back past the start of its sentence is counted by its shorter contexts only
+                if MarkovLib._BREAK in context[1:]:
+                    continue
+
+                word = MarkovChain._START if context[0] == MarkovLib._BREAK else context[0]
+                previous = nodes[context[1:]][MarkovChain._PREVIOUS]
+                node = previous.get(word)
+                if node is None:
+                    node = previous[word] = MarkovChain._node()
+                MarkovChain._countAll(node, leaves)
+                longerNodes[context] = node
+            nodes = longerNodes
+
+    # Picks the word to follow the history, backing off to shorter contexts when the longest is unseen or sparse
+    ##history       - Words generated so far, starting with the empty start word
+    ##weighted      - Bool Whether a weighted probability based on occurance should be used
+    ##sparse        - States seen fewer times than this back off to a lower order
+    def nextWord(self, history, weighted=True, sparse=SPARSE):
+        leaves = self.transitions(history, sparse) or self.root[MarkovChain._WORDS]
+        if not leaves:
+            return None
+        if weighted:  # Control
+            return random.choices(list(leaves.keys()), weights=list(leaves.values()))[0]
+        return random.choice(list(leaves.keys()))  # Chaos
+
+    # The {leafWord: leafCount} of the state generation would use after the history, empty when no context matches
+    def transitions(self, history, sparse=SPARSE):
+        states = self._states(history)
+        if len(states) == 0:
+            return {}
+
+        floor = min(MarkovChain._SPARSE_FLOOR, len(states))
+        for depth in range(len(states), floor, -1):
+            if states[depth - 1][MarkovChain._TOTAL] >= sparse:
+                return states[depth - 1][MarkovChain._WORDS]
+        return states[floor - 1][MarkovChain._WORDS]
+
+    # Picks the word to follow the history from several chains, without merging them
+    # Each step picks one of the chains that has a state for the history, by weight, then samples from only that
+    # chain's transitions. That samples a mixture of each chain's own distribution, not the union of their counts, so
+    # a chain that has seen far more messages still gets only its weight's share of the words.
+    ##chains        - MarkovChains to mix
+    ##weights       - Relative weight of each chain
+    @staticmethod
+    def mixedNextWord(chains, weights, history, weighted=True, sparse=SPARSE):
+        tables = []
+        tableWeights = []
+        for chain, weight in zip(chains, weights):
+            leaves = chain.transitions(history, sparse)
+            if leaves:
+                tables.append(leaves)
+                tableWeights.append(weight)
+
+        if len(tables) == 0:  # No chain knows the context, so fall back to words with no context at all
+            for chain, weight in zip(chains, weights):
+                if chain.root[MarkovChain._WORDS]:
+                    tables.append(chain.root[MarkovChain._WORDS])
+                    tableWeights.append(weight)
+            if len(tables) == 0:
+                return None
+
+        leaves = tables[0] if len(tables) == 1 else random.choices(tables, weights=tableWeights)[0]
+        if weighted:  # Control
+            return random.choices(list(leaves.keys()), weights=list(leaves.values()))[0]
+        return random.choice(list(leaves.keys()))  # Chaos
+
+    # Merges case and punctuation variants of words, then drops singleton transitions beyond a threshold
+    # Merged words are casefolded with punctuation stripped from either end, so 'Hello', 'hello' and 'hello:' become
+    # one word; words that are only punctuation are kept as they are.
+    ##singletons    - Most transitions seen only once that each state keeps
+    def compact(self, singletons):
+        canonical = {}
+        self.root = MarkovChain._rebuild(self.root, canonical, singletons)
+
+    # Number of states (contexts) in the chain, across every order
+    def stateCount(self):
+        count = 0
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            count += 1
+            nodes.extend(node[MarkovChain._PREVIOUS].values())
+        return count
+
+    # The nodes matching the end of the history, from one word of context up to the chain's order
+    def _states(self, history):
+        states = []
+        node = self.root
+        for word in reversed(history[-self.order:]):
+            node = node[MarkovChain._PREVIOUS].get(word)
+            if node is None:
+                break
+            states.append(node)
+            if word == MarkovChain._START:
+                break
+        return states
+
+    def _add(self, context, leafWord, count):
+        node = self.root
+        MarkovChain._count(node, leafWord, count)
+
+        for depth, word in enumerate(reversed(context)):
+            if depth >= self.order:
+                break
+
+            previous = node[MarkovChain._PREVIOUS]
+            node = previous.get(word)
+            if node is None:
+                node = previous[word] = MarkovChain._node()
+            MarkovChain._count(node, leafWord, count)
+
+            if word == MarkovChain._START:  # Nothing comes before the start of a sentence
+                break
+
+    @staticmethod
+    def _rebuild(node, canonical, singletons):
+        leaves = {}
+        for leafWord, count in node[MarkovChain._WORDS].items():
+            leafWord = MarkovChain._canonicalWord(leafWord, canonical)
+            leaves[leafWord] = leaves.get(leafWord, 0) + count
+
+        kept = {}
+        singletonCount = 0
+        for leafWord, count in leaves.items():
+            if count == 1:
+                singletonCount += 1
+                if singletonCount > singletons:
+                    continue
+            kept[leafWord] = count
+
+        merged = {}
+        for word, child in node[MarkovChain._PREVIOUS].items():
+            word = MarkovChain._canonicalWord(word, canonical)
+            merged[word] = MarkovChain._mergeNodes(merged[word], child) if word in merged else child
+
+        previous = {}
+        for word, child in merged.items():
+            child = MarkovChain._rebuild(child, canonical, singletons)
+            if child[MarkovChain._TOTAL] > 0:
+                previous[word] = child
+
+        return [sum(kept.values()), kept, previous]
+
+    @staticmethod
+    def _mergeNodes(first, second):
+        merged = MarkovChain._node()
+        for node in (first, second):
+            merged[MarkovChain._TOTAL] += node[MarkovChain._TOTAL]
+            leaves = merged[MarkovChain._WORDS]
+            for leafWord, count in node[MarkovChain._WORDS].items():
+                leaves[leafWord] = leaves.get(leafWord, 0) + count
+            for word, child in node[MarkovChain._PREVIOUS].items():
+                previous = merged[MarkovChain._PREVIOUS]
+                previous[word] = MarkovChain._mergeNodes(previous[word], child) if word in previous else child
+        return merged
+
+    @staticmethod
+    def _canonicalWord(word, canonical):
+        canonicalWord = canonical.get(word)
+        if canonicalWord is None:
+            folded = word.casefold()
+            canonicalWord = canonical[word] = folded.strip(MarkovChain._VARIANT_PUNCTUATION) or folded
+        return canonicalWord
+
+    @staticmethod
+    def _count(node, leafWord, count):
+        node[MarkovChain._TOTAL] += count
+        leaves = node[MarkovChain._WORDS]
+        leaves[leafWord] = leaves.get(leafWord, 0) + count
+
+    @staticmethod
+    def _countAll(node, leaves):
+        node[MarkovChain._TOTAL] += sum(leaves.values())
+        words = node[MarkovChain._WORDS]
+        for leafWord, count in leaves.items():
+            words[leafWord] = words.get(leafWord, 0) + count
+
+    @staticmethod
+    def _node():
+        return [0, {}, {}]
@@ -0,0 +1,161 @@
+import asyncio
+import os
+
+from dougbot import config
+from dougbot.common import timeutils
+from dougbot.extensions.markov import markov_worker
+from dougbot.extensions.markov.markov_lib import MarkovLib
+
+
+# Reads a channel's history once and fans each message out to per-author chain builders
+class MarkovCollector:
+    # Static variables
+    _ALL_USERS = "all users"  # Has a space, so it's never a username
+    _LIVE_RANGES = "live ingested"  # Has a space, so it's never a text channel's name
+
+    ##chainsDir      - Directory holding the chain and timestamp files
+    ##channelName    - Name of the channel being collected from
+    ##chainsExt      - Extension of chain files
+    ##timestampExt   - Extension of timestamp files
+    ##allUsers       - Bool Whether every (non-bot) author gets a chain, rather than only tracked users
+    ##order          - Order of chains created for authors without one
+    ##index          - MarkovIndex to record saved chains in
+    ##pool           - Executor the chains are built in, off the event loop
+    def __init__(self, chainsDir, channelName, chainsExt, timestampExt, allUsers=False, order=2, index=None, pool=None):
+        self._chainsDir = chainsDir
+        self._channelName = channelName
+        self._chainsExt = chainsExt
+        self._timestampExt = timestampExt
+        self._allUsers = allUsers
+        self._order = order
+        self._index = index
+        self._pool = pool
+        self._builders = {}  # str(author): _AuthorChain
+        self._lastMessage = None
+
+    # Starts collecting the messages of a user
+    async def track(self, user):
+        key = str(user)
+        if key not in self._builders:
+            self._builders[key] = await self._loadBuilder(key)
+        return self._builders[key]
+
+    # The earliest point in history that still has messages to collect for anyone tracked
+    async def startTimestamp(self):
+        if self._allUsers:
+            timeStamps, _ = await MarkovLib.load_json(self._path(MarkovCollector._ALL_USERS, self._timestampExt))
+            lastTimestamp = timeStamps.get(self._channelName)
+            return timeutils.parse_iso(lastTimestamp) if lastTimestamp else None
+
+        startTimestamps = [builder.lastTimestamp for builder in self._builders.values()]
+        if len(startTimestamps) == 0 or None in startTimestamps:
+            return None
+        return min(startTimestamps)
+
+    # Records in an author's timestamps that every message they sent in the channel from start to end was added live
+    ##timeStamps     - The author's timestamp dictionary
+    ##extend         - Bool Whether the channel's last range runs on to start, so it is extended rather than a new range
+    ##                 added; only true when live ingestion saw everything in between
+    @staticmethod
+    def addLiveRange(timeStamps, channelName, start, end, extend):
+        ranges = timeStamps.setdefault(MarkovCollector._LIVE_RANGES, {}).setdefault(channelName, [])
+        if extend and ranges:
+            ranges[-1][1] = str(end)
+        else:
+            ranges.append([str(start), str(end)])
+
+    # Hands the message to its author's chain, if it qualifies
+    ##message        - Message read from the channel history
+    ##qualifies      - Bool Whether the content passed the cog's filters
+    async def add(self, message, qualifies):
+        self._lastMessage = message
+
+        if not qualifies:
+            return
+
+        key = str(message.author)
+        builder = self._builders.get(key)
+        if builder is None:
+            if not self._allUsers or message.author.bot:
+                return
+            builder = await self.track(message.author)
+
+        # Already collected by an earlier, per-user collect further along in the channel
+        if builder.lastTimestamp is not None and message.created_at <= builder.lastTimestamp:
+            return
+        # Already added by live ingestion
+        if any(start <= message.created_at <= end for start, end in builder.liveRanges):
+            return
+
+        builder.sentences.append(message.clean_content)
+        builder.collected += 1
+
+    # Writes every chain that changed and moves each author's timestamp to the last message read
+    async def save(self):
+        if self._lastMessage is None:  # No messages were read in
+            return
+
+        lastTimestamp = str(self._lastMessage.created_at)
+
+        for key, builder in self._builders.items():
+            builder.timeStamps[self._channelName] = lastTimestamp
+            self._dropCoveredLiveRanges(builder)
+            await MarkovLib.save_json(builder.timeStamps, self._path(key, self._timestampExt))
+            if builder.collected != 0:  # Dont Bother updating if no new messages
+                states = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, markov_worker.ingest, self._path(key, self._chainsExt), builder.sentences,
+                    self._order, config.get_configuration().markov_compression)
+                if self._index is not None:
+                    await self._index.update(key, states)
+
+        if self._allUsers:
+            allPath = self._path(MarkovCollector._ALL_USERS, self._timestampExt)
+            timeStamps, _ = await MarkovLib.load_json(allPath)
+            timeStamps[self._channelName] = lastTimestamp
+            await MarkovLib.save_json(timeStamps, allPath)
+
+    # (author, collected, existingDict) for every author that was tracked
+    def results(self):
+        return [(key, builder.collected, builder.existingDict) for key, builder in self._builders.items()]
+
+    async def _loadBuilder(self, key):
+        builder = _AuthorChain()
+        builder.existingDict = os.path.exists(self._path(key, self._chainsExt))
+
+        # If Dictionary exists then load the timestamp dictionary
+        if builder.existingDict:
+            builder.timeStamps, _ = await MarkovLib.load_json(self._path(key, self._timestampExt))
+            lastTimestamp = builder.timeStamps.get(self._channelName)
+            if lastTimestamp:
+                builder.lastTimestamp = timeutils.parse_iso(lastTimestamp)
+
+            liveRanges = builder.timeStamps.get(MarkovCollector._LIVE_RANGES, {}).get(self._channelName, [])
+            builder.liveRanges = [(timeutils.parse_iso(start), timeutils.parse_iso(end)) for start, end in liveRanges]
+
+        return builder
+
+    # Live ranges that end before where collecting reached are covered by the channel's timestamp alone
+    def _dropCoveredLiveRanges(self, builder):
+        channels = builder.timeStamps.get(MarkovCollector._LIVE_RANGES, {})
+        if self._channelName not in channels:
+            return
+
+        collectedTo = self._lastMessage.created_at
+        channels[self._channelName] = [[start, end] for start, end in channels[self._channelName]
+                                       if timeutils.parse_iso(end) > collectedTo]
+        if not channels[self._channelName]:
+            del channels[self._channelName]
+
+    def _path(self, key, ext):
+        return os.path.join(self._chainsDir, key + ext)
+
+
+class _AuthorChain:
+
+    def __init__(self):
+        self.sentences = []  # Collected this pass, added to the chain in bulk on save
+        self.timeStamps = {}
+        self.lastTimestamp = None
+        self.liveRanges = []  # (start, end) of this channel's messages already added live
+        self.collected = 0
+        self.existingDict = False
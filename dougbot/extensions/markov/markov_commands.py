@@ -1,15 +1,24 @@
+import asyncio
+import multiprocessing
 import os
-from datetime import datetime
-from dateutil import parser
+from concurrent.futures import ProcessPoolExecutor
 
 from nextcord import Embed
 from nextcord import TextChannel
 from nextcord import User
-from nextcord.ext import commands
+from nextcord.ext import commands, tasks
 
+from dougbot import config
+from dougbot.common import timeutils
+from dougbot.common.logger import Logger
+from dougbot.common.messaging.message_utils import split_message
 from dougbot.config import EXTENSION_RESOURCES_DIR
+from dougbot.core import statehandoff
 from dougbot.core.bot import DougBot
 from dougbot.extensions.common.annotation.admincheck import admin_command
+from dougbot.extensions.markov import markov_worker
+from dougbot.extensions.markov.markov_collector import MarkovCollector
+from dougbot.extensions.markov.markov_index import MarkovIndex
 from dougbot.extensions.markov.markov_lib import *
 
 
@@ -28,102 +37,341 @@ class Markov(commands.Cog):
     def __init__(self, bot: DougBot):
         self.bot = bot
         self._chains_dir = os.path.join(EXTENSION_RESOURCES_DIR, 'markov', 'chains')
+        self._index = MarkovIndex(self._chains_dir, Markov._CHAINSEXT)
 
-    @commands.command()
-    async def markov(self, ctx, userOne: User, userTwo: User = None):
-        length = 0
-        attempts = 0
-        existingDict = False
-        phrase = ""
-        text_channel = ctx.channel  # chat channel
-
-        markovDict, existingDict = await MarkovLib.load_pickle(os.path.join(self._chains_dir, str(userOne) + Markov._CHAINSEXT))
-        if existingDict:
-            while (phrase == '' or length < 5) and attempts < 10:  # Generate new phrase if last one sucked
-                try:
-                    phrase, length = await MarkovLib.generateChain(markovDict, True)
-                except KeyError:  # On error just make a new phrase (I'll fix this later maybe)
-                    continue
+        # Serializes everything that rewrites chain files: collecting and flushing live messages
+        self._chains_lock = asyncio.Lock()
+
+        # Live ingestion: str(author) -> [(channel name, created at, clean content)]
+        self._pending = {}
+        # (author, channel name) whose last live range was recorded while live ingestion has been running since
+        self._live_ranges_open = set()
+
+        # Chain building, pruning and generation are pure CPU work; spawned workers share nothing with the bot's
+        # process. Started on first use and shut down with the cog, so a reload doesn't leave workers behind.
+        self._process_pool = None
+
+        self._schedule_loops()
+        config.subscribe(self._on_config_change)
+        statehandoff.register('Markov.pending', self._save_pending, self._restore_pending)
+
+    def cog_unload(self):
+        statehandoff.unregister('Markov.pending')
+        config.unsubscribe(self._on_config_change)
+        self._live_flush.cancel()
+        self._scheduled_prune.cancel()
+        asyncio.ensure_future(self._shutdown_pool())
+
+    def _pool(self):
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return self._process_pool
+
+    async def _shutdown_pool(self):
+        # The live flush writes out what was pending once it's cancelled, in the pool, so the loops finish first
+        await asyncio.gather(*[task for task in (self._live_flush.get_task(), self._scheduled_prune.get_task())
+                               if task is not None], return_exceptions=True)
+        # Kept rather than cleared, so anything still running after the unload fails instead of starting a new pool
+        self._pool().shutdown(wait=False, cancel_futures=True)
+
+    def _on_config_change(self, changes):
+        if changes.keys() & {'markov_live_ingestion', 'markov_live_flush_secs', 'markov_prune_interval_hours'}:
+            self._schedule_loops()
+
+    # Starts, stops or retimes the live flush and scheduled prune to match the config
+    def _schedule_loops(self):
+        configs = config.get_configuration()
+
+        self._live_flush.change_interval(seconds=configs.markov_live_flush_secs)
+        if configs.markov_live_ingestion and not self._live_flush.is_running():
+            self._live_flush.start()
+        elif not configs.markov_live_ingestion and self._live_flush.is_running():
+            self._live_flush.cancel()  # after_loop still writes out what was pending
+
+        if configs.markov_prune_interval_hours > 0:
+            self._scheduled_prune.change_interval(hours=configs.markov_prune_interval_hours)
+            if not self._scheduled_prune.is_running():
+                self._scheduled_prune.start()
+        elif self._scheduled_prune.is_running():
+            self._scheduled_prune.cancel()
+
+    @commands.command(help='Generates a phrase from the chains of one or more users, mixed equally')
+    async def markov(self, ctx, users: commands.Greedy[User]):
+        if len(users) == 0:
+            await ctx.send("Use \"d!markov <@user> [<@user>...]\"")
+            return
+
+        chainPaths = []
+        for user in users:
+            chainPath = os.path.join(self._chains_dir, str(user) + Markov._CHAINSEXT)
+            if not os.path.exists(chainPath):
+                await ctx.send("No existing Markov dictionary for " + str(user) + ".\nUse \"d!collect <@" + str(user.id) + ">\"")
+                return
+            chainPaths.append(chainPath)
+
+        names = " + ".join(str(user) for user in users)
+        # Generate new phrase if last one sucked: up to 10 attempts at 5 words or more
+        phrase = await self.bot.loop.run_in_executor(self._pool(), markov_worker.generate, chainPaths, True,
+                                                     config.get_configuration().markov_sparse, 5, 10)
 
-            if attempts >= 10:
-                await ctx.send("Exceeded number of attempts for " + str(userOne))
-            else:
-                embed = Embed(title=':speaking_head: Markov :person_shrugging:', color=0x228B22)
-                embed.add_field(name=str(userOne), value=phrase.capitalize())
-                await ctx.send(embed=embed)
+        if phrase is None:
+            await ctx.send("Exceeded number of attempts for " + names)
         else:
-            await ctx.send("No existing Markov dictionary for " + str(userOne) + ".\nUse \"d!collect <@" + str(userOne.id) + ">\"")
+            embed = Embed(title=':speaking_head: Markov :person_shrugging:', color=0x228B22)
+            embed.add_field(name=names, value=phrase.capitalize())
+            await ctx.send(embed=embed)
 
-    @commands.command()
-    async def collect(self, ctx, user: User, text_channel: TextChannel = None):
-        message = None
-        timeStamps = {}
-        lastTimestamp = None
-        collected = 0
-        existingDict = False
-        dictExistanceString = ""
+    @commands.command(help='Collects messages for one or more users, reading the channel history once')
+    async def collect(self, ctx, users: commands.Greedy[User], text_channel: TextChannel = None):
+        if len(users) == 0:
+            await ctx.send("Use \"d!collect <@user> [<@user>...] [#channel]\" or \"d!collect_all [#channel]\"")
+            return
 
         if text_channel is None:  # If no text channel specified then use the one called from
             text_channel = ctx.channel  # chat channel
 
-        collectMsg = await ctx.send("Collecting messages from <@" + str(user.id) + ">")
-        thinkingReact = await collectMsg.add_reaction(Markov._THINKING_EMOJI)
+        collector = MarkovCollector(self._chains_dir, text_channel.name, Markov._CHAINSEXT, Markov._TIMESTAMPEXT,
+                                    order=config.get_configuration().markov_order, index=self._index,
+                                    pool=self._pool())
+        for user in users:
+            await collector.track(user)
+
+        mentions = ", ".join("<@" + str(user.id) + ">" for user in users)
+        await self._collect(ctx, collector, text_channel, "Collecting messages from " + mentions)
+
+    @commands.command(help='Collects messages for every user in the channel, reading the channel history once')
+    @admin_command()
+    async def collect_all(self, ctx, text_channel: TextChannel = None):
+        if text_channel is None:
+            text_channel = ctx.channel
+
+        collector = MarkovCollector(self._chains_dir, text_channel.name, Markov._CHAINSEXT, Markov._TIMESTAMPEXT,
+                                    allUsers=True, order=config.get_configuration().markov_order,
+                                    index=self._index, pool=self._pool())
+        await self._collect(ctx, collector, text_channel, "Collecting messages from everyone in " + str(text_channel.name))
+
+    async def _collect(self, ctx, collector, text_channel, collectText):
+        collectMsg = await ctx.send(collectText)
+        await collectMsg.add_reaction(Markov._THINKING_EMOJI)
 
         try:
-            markovDict, existingDict = await MarkovLib.load_pickle(os.path.join(self._chains_dir, str(user) + Markov._CHAINSEXT))
-
-            # If Dictionary exists then load the timestamp dictionary
-            if existingDict:
-                timeStamps, _ = await MarkovLib.load_json(os.path.join(self._chains_dir, str(user) + Markov._TIMESTAMPEXT))
-                lastTimestamp = timeStamps.get(text_channel.name)
-                if lastTimestamp:
-                    lastTimestamp =  parser.parse(timeStamps[text_channel.name])
-
-            async for message in text_channel.history(limit=None, after=lastTimestamp, oldest_first=True):
-                if (message.author == user  # From the user specified
-                        and not any(symbol in message.content for symbol in Markov._BANNED)  # Does not contain symbols from banned list
-                        and len(message.content.split()) > 1  # Is long enough to produce a chain
-                ):
-                    await MarkovLib.addSentenceToDict(markovDict, message.clean_content)
-                    collected += 1
-
-            if message is not None:  # Throws error on case where no messages are read in
-                timeStamps[text_channel.name] = str(message.created_at)
-                await MarkovLib.save_json(timeStamps, os.path.join(self._chains_dir, str(user) + Markov._TIMESTAMPEXT))
-            if collected != 0:  # Dont Bother updating if no new messages
-                await MarkovLib.save_pickle(markovDict, os.path.join(self._chains_dir, str(user) + Markov._CHAINSEXT))
+            async with self._chains_lock:
+                lastTimestamp = await collector.startTimestamp()
+
+                async for message in text_channel.history(limit=None, after=lastTimestamp, oldest_first=True):
+                    await collector.add(message, Markov._qualifies(message))
+
+                await collector.save()
 
             # Output
-            if existingDict:
-                dictExistanceString = "**Updated:** "
-            else:
-                dictExistanceString = "**New:** "
-            await ctx.send(dictExistanceString + "Collected " + str(collected) + " message(s) from <@" + str(user.id) + "> from " + str(text_channel.name) + ".")
+            summary = []
+            for author, collected, existingDict in collector.results():
+                if existingDict:
+                    dictExistanceString = "**Updated:** "
+                else:
+                    dictExistanceString = "**New:** "
+                summary.append(dictExistanceString + "Collected " + str(collected) + " message(s) from " + author + " from " + str(text_channel.name) + ".")
+
+            if len(summary) == 0:
+                summary.append("No messages collected from " + str(text_channel.name) + ".")
+
+            for message in split_message("\n".join(summary)):
+                await ctx.send(message)
             await collectMsg.delete()
         except ValueError as e:
             await collectMsg.remove_reaction(Markov._THINKING_EMOJI, collectMsg.author)
             await collectMsg.add_reaction(Markov._INTERROBANG)
             raise e
 
-    @commands.command(help='Lists all the chains currently gathered')
+    # Adds new messages to the author's existing chain as they arrive; users opt in by collecting a chain first
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if (not self._live_flush.is_running()
+                or message.author.bot
+                or not isinstance(message.channel, TextChannel)
+                or not Markov._qualifies(message)):
+            return
+
+        key = str(message.author)
+        if key not in self._pending and not os.path.exists(os.path.join(self._chains_dir, key + Markov._CHAINSEXT)):
+            return
+
+        self._pending.setdefault(key, []).append((message.channel.name, message.created_at, message.clean_content))
+
+    @tasks.loop(seconds=300)
+    async def _live_flush(self):
+        await self._flush_pending()
+
+    @_live_flush.after_loop
+    async def _after_live_flush(self):
+        # Write out whatever arrived since the last interval when the cog is unloaded
+        await self._flush_pending()
+        # Messages sent before live ingestion runs again won't be seen, so later ranges can't join these
+        self._live_ranges_open.clear()
+
+    async def _flush_pending(self, pending=None, extend_ranges=True):
+        async with self._chains_lock:
+            if pending is None:
+                pending, self._pending = self._pending, {}
+
+            for key, messages in pending.items():
+                try:
+                    await self._flush_author(key, messages, extend_ranges)
+                except Exception as e:
+                    Logger(__file__) \
+                        .message('Failed to flush live Markov messages') \
+                        .add_field('author', key) \
+                        .exception(e) \
+                        .error()
+
+    async def _flush_author(self, key, messages, extend_ranges):
+        chainPath = os.path.join(self._chains_dir, key + Markov._CHAINSEXT)
+        timestampPath = os.path.join(self._chains_dir, key + Markov._TIMESTAMPEXT)
+
+        configs = config.get_configuration()
+        states = await self.bot.loop.run_in_executor(self._pool(), markov_worker.ingest, chainPath,
+                                                     [content for _, _, content in messages], configs.markov_order,
+                                                     configs.markov_compression, False)
+        if states is None:  # Chain was cleaned while messages were pending
+            return
+
+        # Keeps collect from adding the same messages again. The channel's own timestamp is left to collect: moving
+        # it here would make a later collect skip older history it never read.
+        timeStamps, _ = await MarkovLib.load_json(timestampPath)
+        ranges = {}
+        for channelName, createdAt, _ in messages:
+            start, end = ranges.get(channelName, (createdAt, createdAt))
+            ranges[channelName] = (min(start, createdAt), max(end, createdAt))
+
+        for channelName, (start, end) in ranges.items():
+            MarkovCollector.addLiveRange(timeStamps, channelName, start, end,
+                                         extend_ranges and (key, channelName) in self._live_ranges_open)
+            if extend_ranges:
+                self._live_ranges_open.add((key, channelName))
+
+        await MarkovLib.save_json(timeStamps, timestampPath)
+        await self._index.update(key, states)
+
+    # Live messages not flushed yet, carried over a restart
+    def _save_pending(self):
+        return {key: [(channelName, str(createdAt), content) for channelName, createdAt, content in messages]
+                for key, messages in self._pending.items()}
+
+    async def _restore_pending(self, pending):
+        # Flushed apart from this run's messages, as messages sent while the bot was down were never seen
+        await self._flush_pending({key: [(channelName, timeutils.parse_iso(createdAt), content)
+                                         for channelName, createdAt, content in messages]
+                                   for key, messages in pending.items()}, extend_ranges=False)
+
+    @staticmethod
+    def _qualifies(message):
+        return (not any(symbol in message.content for symbol in Markov._BANNED)  # Does not contain symbols from banned list
+                and len(message.content.split()) > 1)  # Is long enough to produce a chain
+
+    @commands.command(help='Lists all the chains currently gathered, with their size, states and last collection')
     async def chains(self, ctx):
-        files = []
-        onlyNames = []
-        for (_, _, filenames) in os.walk(self._chains_dir):
-            files.extend(filenames)
-            break
-        for file in files:
-            if Markov._CHAINSEXT in file:
-                onlyNames.append(os.path.splitext(file)[0])
-        await ctx.send('\n'.join(onlyNames))
+        entries = await self._index.entries()
+        if len(entries) == 0:
+            await ctx.send("No chains have been collected.")
+            return
+
+        lines = []
+        for key, entry in sorted(entries.items()):
+            states = "?" if entry['states'] is None else f"{entry['states']:,}"
+            collected = timeutils.format_local(timeutils.parse_iso(entry['collected']), timeutils.SHORT_DISPLAY_FORMAT) \
+                if entry['collected'] else "never"
+            lines.append(f"{key} - {Markov._size(entry['bytes'])}, {states} states, collected {collected}")
+
+        for message in split_message('\n'.join(lines)):
+            await ctx.send(message)
+
+    @commands.command(help='Prunes rare transitions from a user\'s chain and merges case and punctuation variants')
+    @admin_command()
+    async def prune_chain(self, ctx, user: User):
+        async with self._chains_lock:
+            result = await self._prune(str(user))
+
+        if result is None:
+            await ctx.send("No chains exist for " + str(user) + ".")
+        else:
+            await ctx.send(Markov._prune_summary(str(user), *result))
+
+    @commands.command(help='Prunes rare transitions from every chain and merges case and punctuation variants')
+    @admin_command()
+    async def prune_chains(self, ctx):
+        lines = []
+        async with self._chains_lock:
+            for key in list(await self._index.entries()):
+                result = await self._prune(key)
+                if result is not None:
+                    lines.append(Markov._prune_summary(key, *result))
+
+        if len(lines) == 0:
+            lines.append("No chains have been collected.")
+
+        for message in split_message('\n'.join(lines)):
+            await ctx.send(message)
+
+    @tasks.loop(hours=24)
+    async def _scheduled_prune(self):
+        async with self._chains_lock:
+            for key in list(await self._index.entries()):
+                try:
+                    result = await self._prune(key)
+                except Exception as e:
+                    Logger(__file__) \
+                        .message('Failed to prune Markov chain') \
+                        .add_field('author', key) \
+                        .exception(e) \
+                        .error()
+                    continue
+
+                if result is not None:
+                    Logger(__file__) \
+                        .message('Pruned Markov chain') \
+                        .add_field('author', key) \
+                        .add_field('bytes', f'{result[0]} -> {result[2]}') \
+                        .add_field('states', f'{result[1]} -> {result[3]}') \
+                        .info()
+
+    @_scheduled_prune.before_loop
+    async def _before_scheduled_prune(self):
+        await self.bot.wait_until_ready()
+
+    # Compacts the user's chain in place; the caller holds the chains lock
+    # Returns (bytes before, states before, bytes after, states after), or None when the user has no chain
+    async def _prune(self, key):
+        configs = config.get_configuration()
+        result = await self.bot.loop.run_in_executor(self._pool(), markov_worker.prune,
+                                                     os.path.join(self._chains_dir, key + Markov._CHAINSEXT),
+                                                     configs.markov_prune_singletons, configs.markov_compression)
+        if result is None:
+            await self._index.remove(key)
+        else:
+            await self._index.update(key, result[3], collected=False)
+        return result
+
+    @staticmethod
+    def _prune_summary(key, bytesBefore, statesBefore, bytesAfter, statesAfter):
+        return (f"**{key}:** {Markov._size(bytesBefore)} -> {Markov._size(bytesAfter)}, "
+                f"{statesBefore:,} -> {statesAfter:,} states")
+
+    @staticmethod
+    def _size(byteCount):
+        for unit in ['B', 'KiB', 'MiB']:
+            if byteCount < 1024 or unit == 'MiB':
+                return f"{byteCount:.0f} {unit}" if unit == 'B' else f"{byteCount:.1f} {unit}"
+            byteCount /= 1024
 
     # Deletes the chain file for given user
     @commands.command()
     @admin_command()
     async def clean_chain(self, ctx, user: User):
+        self._pending.pop(str(user), None)
         try:
             os.remove(os.path.join(self._chains_dir, str(user) + Markov._CHAINSEXT))
             os.remove(os.path.join(self._chains_dir, str(user) + Markov._TIMESTAMPEXT))
+            await self._index.remove(str(user))
 
             await ctx.send("Cleared Markov data for <@" + str(user.id) + ">")
         except FileNotFoundError:
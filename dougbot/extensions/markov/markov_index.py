@@ -0,0 +1,60 @@
+import os
+from datetime import datetime, timezone
+
+from dougbot.common import timeutils
+from dougbot.extensions.markov.markov_lib import MarkovLib
+
+
+# Size, state count and last collected time of every chain, kept beside the chains so listing them needs no walk
+##Index Template: {user: {"bytes": int, "states": int, "collected": isoTimestamp}}
+class MarkovIndex:
+    # Static variables
+    _FILENAME = "chains.index"
+
+    ##chainsDir      - Directory holding the chain files
+    ##chainsExt      - Extension of chain files
+    def __init__(self, chainsDir, chainsExt):
+        self._chainsDir = chainsDir
+        self._chainsExt = chainsExt
+        self._path = os.path.join(chainsDir, MarkovIndex._FILENAME)
+        self._entries = None
+
+    async def entries(self):
+        if self._entries is None:
+            self._entries, existingIndex = await MarkovLib.load_json(self._path)
+            if not existingIndex:
+                self._entries = self._fromDirectory()
+                await MarkovLib.save_json(self._entries, self._path)
+        return self._entries
+
+    # Records a chain that was just saved
+    ##key            - User the chain belongs to
+    ##states         - Number of states in the saved chain
+    ##collected      - Bool Whether new messages were added, rather than the chain only being compacted
+    async def update(self, key, states, collected=True):
+        entries = await self.entries()
+        entry = entries.setdefault(key, {"bytes": 0, "states": None, "collected": None})
+        entry["bytes"] = os.path.getsize(os.path.join(self._chainsDir, key + self._chainsExt))
+        entry["states"] = states
+        if collected:
+            entry["collected"] = timeutils.utc_now().isoformat()
+        await MarkovLib.save_json(entries, self._path)
+
+    async def remove(self, key):
+        entries = await self.entries()
+        if entries.pop(key, None) is not None:
+            await MarkovLib.save_json(entries, self._path)
+
+    # Index for chains saved before there was one; state counts are filled in the next time each chain is saved
+    def _fromDirectory(self):
+        entries = {}
+        if not os.path.isdir(self._chainsDir):
+            return entries
+
+        with os.scandir(self._chainsDir) as files:
+            for file in files:
+                if file.name.endswith(self._chainsExt):
+                    stat = file.stat()
+                    collected = datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()
+                    entries[file.name[:-len(self._chainsExt)]] = {"bytes": stat.st_size, "states": None, "collected": collected}
+        return entries
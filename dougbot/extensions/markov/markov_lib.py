@@ -1,19 +1,22 @@
 import json
-import pickle
-import random
+import re
 import string
+import sys
+from collections import Counter
 from json.decoder import JSONDecodeError
 
+from dougbot.common.fileutils import atomic_write
+
 
 # Generates Markov chains from discord chat
-##Dictionary Template: defaultdict(lambda:[0, defaultdict(int)])   #{'the': (7, {'wood': 5})}
-##Dictionary Template: dict{rootWord:[rootCount, dict{leafWord:leafCount}]}   #{'the': (7, {'wood': 5})}
 class MarkovLib:
     # Static variables
-    _TOTAL = 0  # Occurances of words after the root word
-    _WORDS = 1  # Occurances of current word after root word
     _ENDPUNCTUATION = ['.', '!', '?', '\n']
     _SYMBOLS = ['.', '-', ',', '!', '?', '(', '_', ')', '[', ']', '{', '}', '+', '=', '*', '/', '\\', '#', '$', '%', '^', '&', ';', '\'', '"', '`', '~']
+    _MAXLENGTH = 100  # Most words in a generated phrase
+    _BREAK = '\x00'  # Separates sentences when tokenizing many at once
+    # A sentence break, a symbol on its own, or a run of anything that is none of those nor whitespace
+    _TOKENIZER = re.compile('\x00|[{0}]|[^\\s\x00{0}]+'.format(re.escape(''.join(_SYMBOLS))))
 
     @staticmethod
     async def load_json(path):
@@ -26,213 +29,50 @@ class MarkovLib:
 
     @staticmethod
     async def save_json(jsonObj, path):
-        with open(path, 'w+') as f:
+        with atomic_write(path, 'w') as f:
             json.dump(jsonObj, f)
 
+    # Counts every run of words across many sentences in a single tokenizer pass
+    ##sentences     - Iterable of sentences to count
+    ##size          - Number of words in a run
+    # Returns a Counter of runs, with _BREAK before, between and after sentences
     @staticmethod
-    async def load_pickle(path):
-        try:
-            with open(path, 'rb') as f:
-                pickleObj = pickle.load(f)
-                return pickleObj, True
-        except (IOError, pickle.PickleError):
-            return {}, False
-
-    @staticmethod
-    async def save_pickle(pickleObj, path):
-        pickle.dump(pickleObj, open(path, "wb"))
-
-    # Adds a new word to the dictionary
-    ##markovDict    - Dictionary to populate
-    ##rootWord      - The initial word
-    ##leafWord      - The word that comes after the rootWord
-    @staticmethod
-    async def addWordToDict(markovDict, rootOne, rootTwo, leafWord):
-        if (rootOne, rootTwo) not in markovDict:
-            markovDict[(rootOne, rootTwo)] = [0, {leafWord: 0}]
-        if leafWord not in markovDict[(rootOne, rootTwo)][MarkovLib._WORDS]:
-            markovDict[(rootOne, rootTwo)][MarkovLib._WORDS][leafWord] = 0
-        markovDict[(rootOne, rootTwo)][MarkovLib._TOTAL] += 1
-        markovDict[(rootOne, rootTwo)][MarkovLib._WORDS][leafWord] += 1
-
-    # Adds a sentence to the dictionary
-    ##markovDict    - Dictionary to populate
-    ##sentence      - Sentence to be added to dictionary
-    @staticmethod
-    async def addSentenceToDict(markovDict, sentence):
-        prevWord1 = ""
-        prevWord2 = ""
-
-        # Following line removes punctuation but it might be better to not remove it
-        # sentence = sentence.translate(str.maketrans(string.punctuation, ' '*len(string.punctuation)))
-
-        # Seperates all symbols and words
-        # sentenceList = re.findall(r"[\w']+|[.,!?;]", sentence)
-
-        for spaced in MarkovLib._SYMBOLS:
-            sentence = sentence.replace(spaced, ' {0} '.format(spaced))
-        sentenceList = sentence.split()
-
-        prevWord2 = sentenceList[0].lower()
-        word = sentenceList[1].lower()
-
-        await MarkovLib.addWordToDict(markovDict, prevWord1, prevWord2, word)
-
-        for i in range(0, len(sentenceList)):
-            if len(sentenceList) > i + 2:
-                prevWord1 = sentenceList[i].lower()
-                prevWord2 = sentenceList[i + 1].lower()
-                word = sentenceList[i + 2].lower()
-
-                await MarkovLib.addWordToDict(markovDict, prevWord1, prevWord2, word)
-
-        if (word not in string.punctuation):
-            await MarkovLib.addWordToDict(markovDict, prevWord2, word, ".")
-
-    # Populates the dictionary from a file of strings
-    ##markovDict     - Dictionary to populate
-    ##fileName       - string The path to file containing strings
-    @staticmethod
-    async def readFile(markovDict, fileName):
-        with open(fileName, "r", encoding='utf-8') as file:
-            lines = file.readlines()
-            for line in lines:
-                await MarkovLib.addSentenceToDict(markovDict, line)
-        return
-
-    # Generates a phrase(chain) from the dictionary
-    ##markovDict    - Dictionary containing the words and counts
+    def countGrams(sentences, size):
+        # Tokenize the whole batch at once with a break token between sentences, so the per-sentence work happens in C
+        text = MarkovLib._BREAK.join(sentence.replace(MarkovLib._BREAK, ' ') for sentence in sentences)
+        tokens = list(map(sys.intern, MarkovLib._TOKENIZER.findall(f'{MarkovLib._BREAK * (size - 1)}{text.lower()}{MarkovLib._BREAK}')))
+        return Counter(zip(*(tokens[i:] for i in range(size))))
+
+    # Generates a phrase(chain) from one chain, or by mixing several
+    ##chains        - MarkovChain, or list of MarkovChains, containing the words and counts
     ##weighted      - Bool Whether a weighted probability based on occurance should be used
+    ##sparse        - States seen fewer times than this back off to a lower order
+    ##weights       - Relative weight of each chain when mixing; equal when not given
     @staticmethod
-    async def generateChain(markovDict, weighted):
+    def generate(chains, weighted, sparse=None, weights=None):
+        if not isinstance(chains, list):
+            chains = [chains]
+        if weights is None:
+            weights = [1] * len(chains)
+        if sparse is None:
+            sparse = chains[0].SPARSE
+
         phrase = ""
         curWord = ""
-        length = 1
-
-        startTuples = [key for key in list(markovDict.keys()) if key[0] == '']
-        curTuple = random.choice(startTuples)
-        phrase += curTuple[1]
-
-        if weighted:  # Control
-            while curWord not in MarkovLib._ENDPUNCTUATION and curTuple[1] != '' and length < 100:
-                curWord = random.choices(list(markovDict[curTuple][1].keys()), weights=list(markovDict[curTuple][MarkovLib._WORDS].values()))[0]
-                if (curWord not in string.punctuation and length > 0):
-                    phrase += " "
-                phrase += curWord
-                length += 1
-                curTuple = (curTuple[1], curWord)
-
-        else:  # Chaos
-            while curWord not in MarkovLib._ENDPUNCTUATION:
-                curWord = random.choice(list(markovDict[curTuple][1].keys()))
-                if (curWord not in string.punctuation and length > 0):
-                    phrase += " "
-                phrase += curWord
-                length += 1
-                curTuple = (curTuple[1], curWord)
+        length = 0
+        history = [""]
+
+        while curWord not in MarkovLib._ENDPUNCTUATION and length < MarkovLib._MAXLENGTH:
+            if len(chains) == 1:
+                curWord = chains[0].nextWord(history, weighted, sparse)
+            else:
+                curWord = chains[0].mixedNextWord(chains, weights, history, weighted, sparse)
+            if curWord is None:  # Empty chain
+                break
+            if (curWord not in string.punctuation and length > 0):
+                phrase += " "
+            phrase += curWord
+            length += 1
+            history.append(curWord)
 
         return phrase, length
-
-    ##Adds a new word to the dictionary
-    ###markovDict    - Dictionary to populate
-    ###rootWord      - The initial word
-    ###leafWord      - The word that comes after the rootWord
-# @staticmethod
-# def addWordToDictOld(markovDict, rootWord, leafWord):
-#    if rootWord not in markovDict:
-#        markovDict[rootWord] = [0, {leafWord: 0}]
-#    if leafWord not in markovDict[rootWord][Markov._WORDS]:
-#        markovDict[rootWord][Markov._WORDS][leafWord] = 0
-#    markovDict[rootWord][Markov._TOTAL] += 1
-#    markovDict[rootWord][Markov._WORDS][leafWord] += 1
-#
-# @staticmethod
-# def addSentenceToDictOld(markovDict, sentence):
-#    prevWord = ""
-#
-#    #Following line removes punctuation but it might be better to not remove it
-#    #sentence = sentence.translate(str.maketrans(string.punctuation, ' '*len(string.punctuation)))
-#
-#    #Seperates all symbols and words
-#    #sentenceList = re.findall(r"[\w']+|[.,!?;]", sentence)
-#
-#    for spaced in Markov._SYMBOLS:
-#        sentence = sentence.replace(spaced, ' {0} '.format(spaced))
-#
-#    for word in sentence.split():
-#        word = word.lower()
-#        Markov.addWordToDict(markovDict, prevWord, word)
-#        prevWord = word
-#        if word in Markov._ENDPUNCTUATION:
-#            prevWord = "."
-#
-#    if(prevWord not in string.punctuation):
-#        Markov.addWordToDict(markovDict, prevWord, ".")
-#
-#
-#
-##Generates a phrase(chain) from the dictionary
-###markovDict    - Dictionary containing the words and counts
-###weighted      - Bool Whether a weighted probability based on occurance should be used
-# @staticmethod
-# def generateChainOld(markovDict, weighted):
-#    phrase = ""
-#    curWord = ""
-#    length = 0
-#
-#    if weighted: #Control
-#        while curWord not in Markov._ENDPUNCTUATION:
-#            curWord = random.choices(list(markovDict[curWord][Markov._WORDS].keys()), weights=list(markovDict[curWord][Markov._WORDS].values()))[0]
-#            if(curWord not in string.punctuation and length > 0):
-#                phrase += " "
-#            phrase += curWord
-#            length += 1
-#
-#    else: #Chaos
-#        while curWord not in Markov._ENDPUNCTUATION:
-#            curWord = random.choice(list(markovDict[curWord][Markov._WORDS]))
-#            if(curWord not in string.punctuation and length > 0):
-#                phrase += " "
-#            phrase += curWord
-#            length += 1
-#
-#    return phrase, length
-
-# Prints out the dictionary sorted alphabettically along with the count of each word in detail
-##markovDict     - Dictionary containing the words and counts
-# @staticmethod
-# def printDict(markovDict):
-#    for rootWord in sorted(markovDict):
-#        if rootWord == "":
-#            print("~STARTING~" + " - " + str(markovDict[rootWord][Markov._TOTAL]))
-#        else:
-#            print(rootWord + " - " + str(markovDict[rootWord][Markov._TOTAL]))
-#
-#        for leafWord in sorted(markovDict[rootWord][Markov._WORDS]):
-#            if leafWord == "":
-#                print("~ENDING~" + " - " + str(markovDict[rootWord][Markov._WORDS][leafWord]))
-#            else:
-#                print("\t" + leafWord + " - " + str(markovDict[rootWord][Markov._WORDS][leafWord]))
-#
-#        print(" ")
-#    return
-
-# @staticmethod
-# def testBasics(markovDict):
-#    #test file reading
-#    Markov.readFile(markovDict, "testFile2.txt")
-#    Markov.printDict(markovDict)
-#
-#    #Test Json I/O
-#    Markov.save_json(markovDict)
-#    markovDict.clear()
-#    markovDict = Markov.load_json("TestMarkovChainData.txt")
-#    Markov.printDict(markovDict)
-#
-#    #Test chain generation weighted vs unweighted
-#    print("Control\n---------------")
-#    for i in range(10):
-#        print(Markov.generateChain(markovDict, True))
-#    print("\n\nChaos\n---------------")
-#    for i in range(10):
-#        print(Markov.generateChain(markovDict, False))
@@ -0,0 +1,243 @@
+import contextlib
+import gc
+import io
+import itertools
+import json
+import pickle
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from dougbot.common.fileutils import atomic_write
+from dougbot.extensions.markov.markov_chain import MarkovChain
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Reads and writes MarkovChains in a versioned, checksummed chain file
+##File Template:
+##  Header:  magic b'DMKV', version u8, compression u8, order u8, reserved u8, payload length u64, payload crc32 u32
+##  Payload: (compressed) frames of frame length u32 and a pickle of plain lists, dicts, strings and ints; the first is
+##           [rootTotal, {leafWord: leafCount}], every other frame is one of the root's children as
+##           [previousWord, node], so a chain can be loaded a branch at a time. Nothing but containers is unpickled.
+##           Version 1 payloads, still read, were the same values as JSON lines.
+class MarkovStore:
+    # Static variables
+    NONE = 'none'
+    ZLIB = 'zlib'
+    ZSTD = 'zstd'
+    _MAGIC = b'DMKV'
+    _VERSION = 2
+    _JSON_VERSION = 1
+    _HEADER = struct.Struct('<4sBBBBQI')
+    _FRAME = struct.Struct('<I')
+    _COMPRESSIONS = [NONE, ZLIB, ZSTD]  # Position is the id written to the header
+    _CHUNK_SIZE = 1 << 16
+    _BLOCK_SIZE = 1 << 18  # Frames handed to the compressing thread at a time
+    _FAST_LEVELS = {ZLIB: 1, ZSTD: 1}  # Chains rewritten after every batch of messages
+    _SMALL_LEVELS = {ZLIB: 6, ZSTD: 3}  # Chains compacted to save space
+
+    ##compression   - One of NONE, ZLIB or ZSTD; ZSTD falls back to ZLIB when zstandard isn't installed
+    ##small         - Bool Whether to compress harder for a smaller file; otherwise saving is fast but the file is
+    ##                roughly a fifth larger
+    @staticmethod
+    def write(chain, path, compression, small=False):
+        if compression not in MarkovStore._COMPRESSIONS:
+            raise ValueError(f"Unknown chain compression '{compression}'")
+        if compression == MarkovStore.ZSTD and zstandard is None:
+            compression = MarkovStore.ZLIB
+
+        compressor = MarkovStore._compressor(compression, small)
+        crc = 0
+        length = 0
+
+        def writeBlock(block):
+            nonlocal crc, length
+            crc = zlib.crc32(block, crc)
+            length += len(block)
+            file.write(compressor.compress(block) if compressor else block)
+
+        with atomic_write(path, 'wb') as file, ThreadPoolExecutor(max_workers=1) as writer:
+            # Length and checksum are only known at the end, so the header is written again once they are
+            file.write(MarkovStore._header(compression, chain.order, 0, 0))
+
+            # zlib, zstandard and file writes let go of the GIL, so a block is compressed and written while the next
+            # is pickled; only one block waits at a time
+            written = None
+            for block in MarkovStore._blocks(chain):
+                if written is not None:
+                    written.result()
+                written = writer.submit(writeBlock, block)
+            if written is not None:
+                written.result()
+
+            if compressor:
+                file.write(compressor.flush())
+
+            file.seek(0)
+            file.write(MarkovStore._header(compression, chain.order, length, crc))
+
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as file:
+            header = file.read(MarkovStore._HEADER.size)
+            if not header.startswith(MarkovStore._MAGIC):
+                file.seek(0)
+                return MarkovStore._readLegacy(file)
+
+            if len(header) < MarkovStore._HEADER.size:
+                raise ValueError(f'Truncated chain file {path}')
+
+            _, version, compressionId, order, _, length, crc = MarkovStore._HEADER.unpack(header)
+            if version not in (MarkovStore._VERSION, MarkovStore._JSON_VERSION):
+                raise ValueError(f'Unsupported chain file version {version} in {path}')
+            if compressionId >= len(MarkovStore._COMPRESSIONS):
+                raise ValueError(f'Unknown chain compression {compressionId} in {path}')
+
+            decompressor = MarkovStore._decompressor(MarkovStore._COMPRESSIONS[compressionId], path)
+            chain = MarkovChain(order)
+            split = MarkovStore._splitFrames if version == MarkovStore._VERSION else MarkovStore._splitLines
+            readCrc = 0
+            readLength = 0
+            count = 0
+            pending = b''
+
+            try:
+                # Decompress a chunk at a time, building the chain from every complete frame as it arrives
+                # Only acyclic lists and dicts are built, so collecting garbage while making them is wasted time
+                with MarkovStore._collectorPaused():
+                    while chunk := file.read(MarkovStore._CHUNK_SIZE):
+                        data = decompressor.decompress(chunk) if decompressor else chunk
+                        readCrc = zlib.crc32(data, readCrc)
+                        readLength += len(data)
+
+                        values, pending = split(pending + data)
+                        for value in values:
+                            MarkovStore._addValue(chain, value, count)
+                            count += 1
+            except Exception as e:  # Damaged data can fail to unpickle, or unpickle to the wrong shape, in many ways
+                raise ValueError(f'Corrupt chain file {path}: {e}') from e
+
+            if pending or readLength != length or readCrc != crc:
+                raise ValueError(f'Corrupt chain file {path}')
+
+            return chain
+
+    # The frames of the chain, joined into blocks of about _BLOCK_SIZE
+    @staticmethod
+    def _blocks(chain):
+        root = chain.root
+        buffer, pickler = MarkovStore._blockPickler()
+        for value in itertools.chain([[root[MarkovChain._TOTAL], root[MarkovChain._WORDS]]],
+                                     root[MarkovChain._PREVIOUS].items()):
+            start = buffer.tell()
+            buffer.write(MarkovStore._FRAME.pack(0))
+            pickler.dump(value)
+            end = buffer.tell()
+            buffer.getbuffer()[start:start + MarkovStore._FRAME.size] = \
+                MarkovStore._FRAME.pack(end - start - MarkovStore._FRAME.size)
+
+            if end >= MarkovStore._BLOCK_SIZE:
+                yield buffer.getvalue()
+                buffer, pickler = MarkovStore._blockPickler()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    @staticmethod
+    def _blockPickler():
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+        # Fast mode skips the memo, a good part of pickling's time; it's safe as a chain holds no cycles and nothing
+        # shared that needs pickling once
+        pickler.fast = True
+        return buffer, pickler
+
+    # Returns the values of the complete frames in data, and the bytes of an incomplete last frame
+    @staticmethod
+    def _splitFrames(data):
+        values = []
+        offset = 0
+        while offset + MarkovStore._FRAME.size <= len(data):
+            end = offset + MarkovStore._FRAME.size + MarkovStore._FRAME.unpack_from(data, offset)[0]
+            if end > len(data):
+                break
+            values.append(_PlainUnpickler(io.BytesIO(data[offset + MarkovStore._FRAME.size:end])).load())
+            offset = end
+        return values, data[offset:]
+
+    @staticmethod
+    def _splitLines(data):
+        lines = data.split(b'\n')
+        pending = lines.pop()
+        return [json.loads(line) for line in lines], pending
+
+    @staticmethod
+    def _addValue(chain, value, count):
+        if count == 0:
+            chain.root[MarkovChain._TOTAL], chain.root[MarkovChain._WORDS] = value
+        else:
+            word, node = value
+            chain.root[MarkovChain._PREVIOUS][word] = node
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _collectorPaused():
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            yield
+        finally:
+            if enabled:
+                gc.enable()
+
+    @staticmethod
+    def _header(compression, order, length, crc):
+        return MarkovStore._HEADER.pack(MarkovStore._MAGIC, MarkovStore._VERSION,
+                                        MarkovStore._COMPRESSIONS.index(compression), order, 0, length, crc)
+
+    @staticmethod
+    def _compressor(compression, small):
+        level = (MarkovStore._SMALL_LEVELS if small else MarkovStore._FAST_LEVELS).get(compression)
+        if compression == MarkovStore.ZLIB:
+            return zlib.compressobj(level)
+        if compression == MarkovStore.ZSTD:
+            return zstandard.ZstdCompressor(level=level).compressobj()
+        return None
+
+    @staticmethod
+    def _decompressor(compression, path):
+        if compression == MarkovStore.ZLIB:
+            return zlib.decompressobj()
+        if compression == MarkovStore.ZSTD:
+            if zstandard is None:
+                raise ValueError(f'zstandard is needed to read {path}')
+            return zstandard.ZstdDecompressor().decompressobj()
+        return None
+
+    # Chains saved before this format were pickles of dictionaries or MarkovChains; anything else is refused
+    @staticmethod
+    def _readLegacy(file):
+        chain = _LegacyUnpickler(file).load()
+        if isinstance(chain, dict):
+            return MarkovChain.fromDict(chain)
+        if isinstance(chain, MarkovChain):
+            return chain
+        raise ValueError('Legacy chain file holds neither a dictionary nor a MarkovChain')
+
+
+class _PlainUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load '{module}.{name}' from a chain file")
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        if (module, name) == (MarkovChain.__module__, MarkovChain.__name__):
+            return MarkovChain
+        raise pickle.UnpicklingError(f"Refusing to load '{module}.{name}' from a chain file")
@@ -0,0 +1,67 @@
+import os
+
+from dougbot.extensions.markov.markov_chain import MarkovChain
+from dougbot.extensions.markov.markov_lib import MarkovLib
+from dougbot.extensions.markov.markov_store import MarkovStore
+
+
+# CPU-heavy chain work, run in worker processes so it never blocks the event loop
+# Workers import this module alone, so it and what it imports must stay free of nextcord and the bot's config.
+# Every function takes only paths and plain values and reads and writes the chain files itself, so nothing large is
+# pickled between processes. Callers serialize writes to the same chain with the cog's chains lock.
+
+
+# Adds sentences to a chain file
+##chainPath     - Path to the chain file
+##sentences     - List of sentences to add
+##order         - Order of the chain to create when there is none
+##compression   - Compression to save the chain with
+##create        - Bool Whether a chain is created when there is none, rather than the sentences being dropped
+# Returns the chain's state count, or None when there was no chain and create is False
+def ingest(chainPath, sentences, order, compression, create=True):
+    markovChain, existingDict = _load(chainPath, order)
+    if not existingDict and not create:
+        return None
+
+    markovChain.addSentences(sentences)
+    MarkovStore.write(markovChain, chainPath, compression)
+    return markovChain.stateCount()
+
+
+# Compacts a chain file in place, compressed harder than the saves between prunes
+##singletons    - Most transitions seen only once that each state keeps
+# Returns (bytes before, states before, bytes after, states after), or None when there is no chain
+def prune(chainPath, singletons, compression):
+    markovChain, existingDict = _load(chainPath)
+    if not existingDict:
+        return None
+
+    bytesBefore = os.path.getsize(chainPath)
+    statesBefore = markovChain.stateCount()
+
+    markovChain.compact(singletons)
+    MarkovStore.write(markovChain, chainPath, compression, small=True)
+
+    return bytesBefore, statesBefore, os.path.getsize(chainPath), markovChain.stateCount()
+
+
+# Generates a phrase from one or more chain files mixed equally, retrying phrases that are too short
+##chainPaths    - Paths to the chain files; all of them must exist
+##minLength     - Fewest words an accepted phrase has
+##attempts      - Most phrases to generate before giving up
+# Returns the phrase, or None when every attempt was too short
+def generate(chainPaths, weighted, sparse, minLength, attempts):
+    markovChains = [MarkovStore.read(chainPath) for chainPath in chainPaths]
+
+    for _ in range(attempts):
+        phrase, length = MarkovLib.generate(markovChains, weighted, sparse)
+        if phrase != '' and length >= minLength:
+            return phrase
+    return None
+
+
+def _load(chainPath, order=2):
+    try:
+        return MarkovStore.read(chainPath), True
+    except FileNotFoundError:
+        return MarkovChain(order), False
@@ -7,6 +7,8 @@ import random
 from nextcord import Embed
 from nextcord.ext import commands, tasks
 
+from dougbot.common.bankerrors import InsufficientFundsError
+from dougbot.common.messaging import reactions
 from dougbot.core.bot import DougBot
 
 
@@ -270,8 +272,21 @@ class MinigameCommands(commands.Cog):
     ############################################################################################################################################################
 
     #########################################################SLOTS##############################################################################################
+    SLOTS_PAYOUT = 20  # Times the bet paid for three of a kind; 1 in 49 spins wins
+
     @commands.command()
-    async def slots(self, ctx):
+    async def slots(self, ctx, bet: int = 0):
+        bank = self.bot.get_cog('Bank')
+        if bet < 0 or (bet and bank is None):
+            await reactions.confusion(ctx.message)
+            return
+        if bet:
+            try:
+                await bank.withdraw(ctx.author.id, bet, 'slots bet')
+            except InsufficientFundsError as e:
+                await reactions.confusion(ctx.message, 'You only have ' + str(e.balance))
+                return
+
         emojilist = ['<:sipsScared:819393684549533716>', '<:passMan:256140704806338560>', '<:fireball:267121761173110784>', '<:gabeN:255489512543748097>', '<:doug:337020649753018368>', '<:ripley:532377971009257492> ', '<:alex:338163624063533056>']
         slotboard = []
         slotembed = Embed(title='SadDoug Slots', color=0xa2afb8)
@@ -293,7 +308,11 @@ class MinigameCommands(commands.Cog):
                                 8] + ':stop_button:', inline=False)
         await message.edit(embed=slotembed)
         if slotboard[3] is slotboard[4] is slotboard[5]:
-            await message.edit(content='Winner')
+            if bet:
+                await bank.deposit(ctx.author.id, bet * MinigameCommands.SLOTS_PAYOUT, 'slots win')
+                await message.edit(content='Winner: ' + str(bet * MinigameCommands.SLOTS_PAYOUT))
+            else:
+                await message.edit(content='Winner')
         else:
             await message.edit(content='Try again')
     ############################################################################################################################################################
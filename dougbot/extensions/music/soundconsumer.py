@@ -33,6 +33,7 @@ class SoundConsumer:
         self._skip = False
         self._voice = None
         self._volume = volume
+        self._playing = None  # (track, plays left including the current one)
         self._queue = Queue()  # Thread-safe queue
         self._done_playing_lock = Semaphore(0)
 
@@ -48,10 +49,11 @@ class SoundConsumer:
                 self._clear_queue()
                 continue
 
-            for _ in range(track.repeat):
+            for played in range(track.repeat):
                 if self._stop or self._skip:
                     break
 
+                self._playing = (track, track.repeat - played)
                 self._voice = track.voice
 
                 source = self._make_audio_source(track, self._volume)
@@ -68,6 +70,7 @@ class SoundConsumer:
                         .exception(e) \
                         .error()
 
+            self._playing = None
             self._queue.task_done()
             self._skip = False
 
@@ -80,6 +83,16 @@ class SoundConsumer:
             if self._notify_lock is not None:
                 self._notify_lock.release()
 
+    def queued(self):
+        """
+        :return: [(track, plays left)] for the track playing and every track waiting, in play order
+        """
+        with self._queue.mutex:
+            waiting = [(track, track.repeat) for track in self._queue.queue]
+
+        playing = self._playing
+        return ([playing] if playing is not None else []) + waiting
+
     def set_volume(self, volume):
         self._volume = volume
 
@@ -12,6 +12,7 @@ from dougbot.common import voiceutils
 from dougbot.common.logger import Logger
 from dougbot.common.messaging import reactions
 from dougbot.config import EXTENSION_RESOURCES_DIR
+from dougbot.core import statehandoff
 from dougbot.core.bot import DougBot
 from dougbot.extensions.common import webutils
 from dougbot.extensions.common.annotation.miccheck import voice_command
@@ -50,6 +51,11 @@ class SoundPlayer(commands.Cog):
 
         self._sound_consumer_thread.start()
 
+        statehandoff.register('SoundPlayer.queue', self._save_queue, self._restore_queue)
+
+    def cog_unload(self):
+        statehandoff.unregister('SoundPlayer.queue')
+
     @commands.command()
     @commands.guild_only()
     @voice_command()
@@ -151,6 +157,25 @@ class SoundPlayer(commands.Cog):
         async with self._order_lock:
             await self.loop.run_in_executor(self.THREAD_POOL, fileutils.delete_directories, self.CACHE_DIR)
 
+    # The tracks left to play, carried over a restart; the playing track starts over
+    def _save_queue(self):
+        tracks = [{'channel_id': track.voice.channel.id, 'src': track.src, 'is_link': track.is_link, 'repeat': plays_left}
+                  for track, plays_left in self._sound_consumer.queued()]
+        return {'volume': self._volume, 'tracks': tracks} if tracks else None
+
+    async def _restore_queue(self, state):
+        self._volume = state['volume']
+        self._sound_consumer.set_volume(self._volume)
+
+        async with self._order_lock:
+            for saved in state['tracks']:
+                channel = self.bot.get_channel(saved['channel_id'])
+                if channel is None or not os.path.exists(saved['src']):  # Channel deleted or download cleaned up
+                    continue
+
+                voice = await voiceutils.join_voice_channel(channel, self.bot)
+                self._sound_consumer.enqueue(Track(None, voice, saved['src'], saved['is_link'], saved['repeat']))
+
     async def _enqueue_audio(self, ctx, voice, source, times):
         track = await self._create_track(ctx, voice, source, times)
         if track is None:
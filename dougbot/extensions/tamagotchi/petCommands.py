@@ -1,10 +1,15 @@
 from nextcord import Embed
 from nextcord import User
-from nextcord.ext import commands
+from nextcord.ext import commands, tasks
 
+from dougbot import config
+from dougbot.common import timeutils
+from dougbot.common.logger import Logger
+from dougbot.core import statehandoff
 from dougbot.core.bot import DougBot
 from dougbot.extensions.tamagotchi.petEventHandlerLib import *
 from dougbot.extensions.tamagotchi.petHandlerLib import *
+from dougbot.extensions.tamagotchi.petStore import PetStore
 
 
 class PetCommands(commands.Cog):
@@ -32,17 +37,54 @@ class PetCommands(commands.Cog):
 
     def __init__(self, bot: DougBot):
         self.bot = bot
+        self._store = PetStore()
+
+        # Changes made since the last flush are carried across a restart rather than written on the way out
+        statehandoff.register('PetCommands.pet', self._store.unsaved, self._store.restore)
+        self._flush_pet.change_interval(seconds=config.get_configuration().tamagotchi_flush_secs)
+        self._flush_pet.start()
+        config.subscribe(self._on_config_change)
+
+    def cog_unload(self):
+        statehandoff.unregister('PetCommands.pet')
+        config.unsubscribe(self._on_config_change)
+        self._flush_pet.cancel()
+        try:
+            self._store.flush_now()
+        except OSError as e:
+            PetCommands._log_save_failure(e)
+
+    def _on_config_change(self, changes):
+        if 'tamagotchi_flush_secs' in changes:
+            self._flush_pet.change_interval(seconds=config.get_configuration().tamagotchi_flush_secs)
+
+    @tasks.loop(seconds=60)
+    async def _flush_pet(self):
+        try:
+            await self._store.flush()
+        except OSError as e:
+            PetCommands._log_save_failure(e)
+
+    @staticmethod
+    def _log_save_failure(exception):
+        Logger(__file__) \
+            .message('Failed to save the pet') \
+            .exception(exception) \
+            .error()
 
     @commands.command()
     async def checkpet(self, ctx):
-        pet = PetHandler.getcurrentpet()
-        if not PetHandler.isdead(pet):
-            pet = PetHandler.checkpet(pet)
-            if PetHandler.isdead(pet):
-                pet = PetHandler.death(pet, "Somebody didn't take good care of this one. Ask Papa Doug nicely and he might get you a new one.")
-                PetHandler.puttorest(pet)
+        async with self._store.modify() as pet:
+            alive = not PetHandler.isdead(pet)
+            if alive:
+                pet = PetHandler.checkpet(pet)
+                died = PetHandler.isdead(pet)
+                if died:
+                    pet = PetHandler.death(pet, "Somebody didn't take good care of this one. Ask Papa Doug nicely and he might get you a new one.")
+                    PetHandler.puttorest(pet)
+        if alive:
+            if died:
                 await ctx.send('rip ' + pet['name'] + '. ' + pet['deathreason'])
-            PetHandler.savedata(pet)
             embed = PetCommands.buildembed(pet, True, None)
             await ctx.send(embed=embed)
         else:
@@ -52,18 +94,17 @@ class PetCommands(commands.Cog):
     async def feedpet(self, ctx):
         user = ctx.message.author
         ableto = True
-        pet = PetHandler.getcurrentpet()
-        currentdate = datetime.datetime.now()
-        foodlastdate = datetime.datetime.strptime(pet['lastfeed'], '%m/%d/%y %H:%M:%S')
-        fooddelta = currentdate - foodlastdate
-        foodhourspassed = math.floor((fooddelta.days * 24) + (fooddelta.seconds / 3600))
-        if foodhourspassed > 1:
-            pet = PetHandler.feed(pet, 20)
-        else:
-            ableto = False
-        pet = PetHandler.checkpet(pet)
-        pet = PetHandler.favorability(pet, user.id, 1)
-        PetHandler.savedata(pet)
+        async with self._store.modify() as pet:
+            currentdate = timeutils.local_now()
+            foodlastdate = timeutils.parse_stamp(pet['lastfeed'])
+            fooddelta = currentdate - foodlastdate
+            foodhourspassed = math.floor((fooddelta.days * 24) + (fooddelta.seconds / 3600))
+            if foodhourspassed > 1:
+                pet = PetHandler.feed(pet, 20)
+            else:
+                ableto = False
+            pet = PetHandler.checkpet(pet)
+            pet = PetHandler.favorability(pet, user.id, 1)
         embed = PetCommands.buildembed(pet, ableto, 'feed')
         await ctx.send(embed=embed)
 
@@ -71,18 +112,17 @@ class PetCommands(commands.Cog):
     async def waterpet(self, ctx):
         user = ctx.message.author
         ableto = True
-        pet = PetHandler.getcurrentpet()
-        currentdate = datetime.datetime.now()
-        waterlastdate = datetime.datetime.strptime(pet['lastwatered'], '%m/%d/%y %H:%M:%S')
-        waterdelta = currentdate - waterlastdate
-        waterhourspassed = math.floor((waterdelta.days * 24) + (waterdelta.seconds / 3600))
-        if waterhourspassed > 1:
-            pet = PetHandler.water(pet, 20)
-        else:
-            ableto = False
-        pet = PetHandler.checkpet(pet)
-        pet = PetHandler.favorability(pet, user.id, 1)
-        PetHandler.savedata(pet)
+        async with self._store.modify() as pet:
+            currentdate = timeutils.local_now()
+            waterlastdate = timeutils.parse_stamp(pet['lastwatered'])
+            waterdelta = currentdate - waterlastdate
+            waterhourspassed = math.floor((waterdelta.days * 24) + (waterdelta.seconds / 3600))
+            if waterhourspassed > 1:
+                pet = PetHandler.water(pet, 20)
+            else:
+                ableto = False
+            pet = PetHandler.checkpet(pet)
+            pet = PetHandler.favorability(pet, user.id, 1)
         embed = PetCommands.buildembed(pet, ableto, 'water')
         await ctx.send(embed=embed)
 
@@ -90,18 +130,17 @@ class PetCommands(commands.Cog):
     async def cleanpet(self, ctx):
         user = ctx.message.author
         ableto = True
-        pet = PetHandler.getcurrentpet()
-        currentdate = datetime.datetime.now()
-        cleanlastdate = datetime.datetime.strptime(pet['lastcleaned'], '%m/%d/%y %H:%M:%S')
-        cleandelta = currentdate - cleanlastdate
-        cleanhourspassed = math.floor((cleandelta.days * 24) + (cleandelta.seconds / 3600))
-        if cleanhourspassed > 1:
-            pet = PetHandler.clean(pet, 20)
-        else:
-            ableto = False
-        pet = PetHandler.checkpet(pet)
-        pet = PetHandler.favorability(pet, user.id, 1)
-        PetHandler.savedata(pet)
+        async with self._store.modify() as pet:
+            currentdate = timeutils.local_now()
+            cleanlastdate = timeutils.parse_stamp(pet['lastcleaned'])
+            cleandelta = currentdate - cleanlastdate
+            cleanhourspassed = math.floor((cleandelta.days * 24) + (cleandelta.seconds / 3600))
+            if cleanhourspassed > 1:
+                pet = PetHandler.clean(pet, 20)
+            else:
+                ableto = False
+            pet = PetHandler.checkpet(pet)
+            pet = PetHandler.favorability(pet, user.id, 1)
         embed = PetCommands.buildembed(pet, ableto, 'clean')
         await ctx.send(embed=embed)
 
@@ -109,18 +148,17 @@ class PetCommands(commands.Cog):
     async def petpet(self, ctx):
         user = ctx.message.author
         ableto = True
-        pet = PetHandler.getcurrentpet()
-        currentdate = datetime.datetime.now()
-        petlastdate = datetime.datetime.strptime(pet['lastpet'], '%m/%d/%y %H:%M:%S')
-        petdelta = currentdate - petlastdate
-        pethourspassed = math.floor((petdelta.days * 24) + (petdelta.seconds / 3600))
-        if pethourspassed > 1:
-            pet = PetHandler.happy(pet, 20)
-        else:
-            ableto = False
-        pet = PetHandler.checkpet(pet)
-        pet = PetHandler.favorability(pet, user.id, 1)
-        PetHandler.savedata(pet)
+        async with self._store.modify() as pet:
+            currentdate = timeutils.local_now()
+            petlastdate = timeutils.parse_stamp(pet['lastpet'])
+            petdelta = currentdate - petlastdate
+            pethourspassed = math.floor((petdelta.days * 24) + (petdelta.seconds / 3600))
+            if pethourspassed > 1:
+                pet = PetHandler.happy(pet, 20)
+            else:
+                ableto = False
+            pet = PetHandler.checkpet(pet)
+            pet = PetHandler.favorability(pet, user.id, 1)
         embed = PetCommands.buildembed(pet, ableto, 'pet')
         await ctx.send(embed=embed)
 
@@ -130,73 +168,71 @@ class PetCommands(commands.Cog):
         ableto = True
         type = []
         typestr = ''
-        pet = PetHandler.getcurrentpet()
-        currentdate = datetime.datetime.now()
-        foodlastdate = datetime.datetime.strptime(pet['lastfeed'], '%m/%d/%y %H:%M:%S')
-        waterlastdate = datetime.datetime.strptime(pet['lastwatered'], '%m/%d/%y %H:%M:%S')
-        cleanlastdate = datetime.datetime.strptime(pet['lastcleaned'], '%m/%d/%y %H:%M:%S')
-        petlastdate = datetime.datetime.strptime(pet['lastpet'], '%m/%d/%y %H:%M:%S')
-        fooddelta = currentdate - foodlastdate
-        waterdelta = currentdate - waterlastdate
-        cleandelta = currentdate - cleanlastdate
-        petdelta = currentdate - petlastdate
-        foodhourspassed = math.floor((fooddelta.days * 24) + (fooddelta.seconds / 3600))
-        waterhourspassed = math.floor((waterdelta.days * 24) + (waterdelta.seconds / 3600))
-        cleanhourspassed = math.floor((cleandelta.days * 24) + (cleandelta.seconds / 3600))
-        pethourspassed = math.floor((petdelta.days * 24) + (petdelta.seconds / 3600))
-        if foodhourspassed > 1:
-            pet = PetHandler.feed(pet, 20)
-        else:
-            ableto = False
-            type.append('feed')
-        if waterhourspassed > 1:
-            pet = PetHandler.water(pet, 20)
-        else:
-            ableto = False
-            type.append('water')
-        if cleanhourspassed > 1:
-            pet = PetHandler.clean(pet, 20)
-        else:
-            ableto = False
-            type.append('clean')
-        if pethourspassed > 1:
-            pet = PetHandler.happy(pet, 20)
-        else:
-            ableto = False
-            type.append('pet')
-
-        for idx, val in enumerate(type):
-            if len(type) == 1:
-                typestr = type[idx]
-                break
-            if idx == (len(type) - 1) and idx != 0:
-                typestr = typestr + 'or ' + type[idx]
+        async with self._store.modify() as pet:
+            currentdate = timeutils.local_now()
+            foodlastdate = timeutils.parse_stamp(pet['lastfeed'])
+            waterlastdate = timeutils.parse_stamp(pet['lastwatered'])
+            cleanlastdate = timeutils.parse_stamp(pet['lastcleaned'])
+            petlastdate = timeutils.parse_stamp(pet['lastpet'])
+            fooddelta = currentdate - foodlastdate
+            waterdelta = currentdate - waterlastdate
+            cleandelta = currentdate - cleanlastdate
+            petdelta = currentdate - petlastdate
+            foodhourspassed = math.floor((fooddelta.days * 24) + (fooddelta.seconds / 3600))
+            waterhourspassed = math.floor((waterdelta.days * 24) + (waterdelta.seconds / 3600))
+            cleanhourspassed = math.floor((cleandelta.days * 24) + (cleandelta.seconds / 3600))
+            pethourspassed = math.floor((petdelta.days * 24) + (petdelta.seconds / 3600))
+            if foodhourspassed > 1:
+                pet = PetHandler.feed(pet, 20)
+            else:
+                ableto = False
+                type.append('feed')
+            if waterhourspassed > 1:
+                pet = PetHandler.water(pet, 20)
+            else:
+                ableto = False
+                type.append('water')
+            if cleanhourspassed > 1:
+                pet = PetHandler.clean(pet, 20)
+            else:
+                ableto = False
+                type.append('clean')
+            if pethourspassed > 1:
+                pet = PetHandler.happy(pet, 20)
             else:
-                typestr = typestr + type[idx] + ', '
-        pet = PetHandler.checkpet(pet)
-        pet = PetHandler.favorability(pet, user.id, 1)
-        PetHandler.savedata(pet)
+                ableto = False
+                type.append('pet')
+
+            for idx, val in enumerate(type):
+                if len(type) == 1:
+                    typestr = type[idx]
+                    break
+                if idx == (len(type) - 1) and idx != 0:
+                    typestr = typestr + 'or ' + type[idx]
+                else:
+                    typestr = typestr + type[idx] + ', '
+            pet = PetHandler.checkpet(pet)
+            pet = PetHandler.favorability(pet, user.id, 1)
         embed = PetCommands.buildembed(pet, ableto, typestr)
         await ctx.send(embed=embed)
 
     @commands.command()
     async def newpet(self, ctx, name: str):
         pet = PetHandler.newpet(name)
+        await self._store.replace(pet)
         embed = PetCommands.buildembed(pet, True, None)
         await ctx.send(embed=embed)
 
     @commands.command()
     async def walkpet(self, ctx):
-        pet = PetHandler.getcurrentpet()
-        evnt = PetEventHandler.walkevent(pet['name'])
-        pet = PetHandler.feed(pet, evnt.food)
-        pet = PetHandler.water(pet, evnt.water)
-        pet = PetHandler.clean(pet, evnt.cleanliness)
-        pet = PetHandler.happy(pet, evnt.happiness)
-        pet = PetHandler.checkpet(pet)
-        PetHandler.savedata(pet)
+        async with self._store.modify() as pet:
+            evnt = PetEventHandler.walkevent(pet['name'])
+            pet = PetHandler.feed(pet, evnt.food)
+            pet = PetHandler.water(pet, evnt.water)
+            pet = PetHandler.clean(pet, evnt.cleanliness)
+            pet = PetHandler.happy(pet, evnt.happiness)
+            pet = PetHandler.checkpet(pet)
         if evnt.type == 'good':
-            PetHandler.savedata(pet)
             await ctx.send('<:mushWalk:255486412403638274> ' + evnt.text)
             embed = PetCommands.buildembed(pet, True, None)
             await ctx.send(embed=embed)
@@ -211,7 +247,7 @@ class PetCommands(commands.Cog):
 
     @commands.command()
     async def checktime(self, ctx):
-        pet = PetHandler.getcurrentpet()
+        pet = await self._store.current()
         embed = Embed(title=':motorized_wheelchair: Name: ' + str(pet['name'] + ' :motorized_wheelchair:'), color=0x228B22)
         embed.add_field(name='Last Checked', value=str(pet['lastchecked']), inline=True)
         embed.add_field(name='Last Fed', value=str(pet['lastfeed']), inline=True)
@@ -223,7 +259,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def checkfav(self, ctx):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             user = ctx.message.author
             calfav = PetHandler.getfavorability(pet, user.id)
             quote = PetHandler.getfavorablilityquote(calfav)
@@ -234,7 +270,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def fav(self, ctx, user: User):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             user = user
             calfav = PetHandler.getfavorability(pet, user.id)
             quote = PetHandler.getfavorablilityquote(calfav)
@@ -245,7 +281,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def mostfav(self, ctx):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             fav = PetHandler.mostfavoriate(pet)
             user = await PetCommands.getdiscorduserinfo(ctx, fav[0])
             await ctx.send(str(user.mention) + ' is ' + str(pet['name']) + '\'s favorite person and has a favorability of ' + str(fav[1]) + '!')
@@ -255,7 +291,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def leastfav(self, ctx):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             fav = PetHandler.leastfavorite(pet)
             user = await PetCommands.getdiscorduserinfo(ctx, fav[0])
             await ctx.send(str(user.mention) + ' is ' + str(pet['name']) + '\'s least favorite person and has a favorability of ' + str(fav[1]) + '...')
@@ -265,7 +301,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def checkinteractions(self, ctx):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             user = ctx.message.author
             intercount = PetHandler.getinteractioncount(pet, user.id)
             await ctx.send(str(user.mention) + ', interacted with ' + str(pet['name']) + ' ' + str(intercount) + ' times.')
@@ -275,7 +311,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def interactions(self, ctx, user: User):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             user = user
             intercount = PetHandler.getinteractioncount(pet, user.id)
             await ctx.send(str(user.mention) + ', interacted with ' + str(pet['name']) + ' ' + str(intercount) + ' times.')
@@ -285,7 +321,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def mostinteractions(self, ctx):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             intercount = PetHandler.mostinteractions(pet)
             user = await PetCommands.getdiscorduserinfo(ctx, intercount[0])
             await ctx.send(str(user.mention) + ' has interacted with ' + str(pet['name']) + 'the most with ' + str(intercount[1]) + ' interactions!')
@@ -295,7 +331,7 @@ class PetCommands(commands.Cog):
     @commands.command()
     async def leastinteractions(self, ctx):
         try:
-            pet = PetHandler.getcurrentpet()
+            pet = await self._store.current()
             intercount = PetHandler.leastinteractions(pet)
             user = await PetCommands.getdiscorduserinfo(ctx, intercount[0])
             await ctx.send(str(user.mention) + ' has interacted with ' + str(pet['name']) + 'the least with' + str(intercount[1]) + ' interactions...')
@@ -304,7 +340,7 @@ class PetCommands(commands.Cog):
 
     @commands.command()
     async def detailedstats(self, ctx):
-        pet = PetHandler.getcurrentpet()
+        pet = await self._store.current()
         embed = Embed(title='<:clownS:819397835636080640> Name: ' + str(pet['name'] + ' <:clownS:819397835636080640>'), color=0x228B22)
         embed.add_field(name='Health', value=str(pet['currenthealth']) + '/' + str(pet['maxhealth']), inline=True)
         embed.add_field(name='Food', value=str(pet['food']) + '/100', inline=True)
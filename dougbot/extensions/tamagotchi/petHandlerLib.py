@@ -1,31 +1,12 @@
-import datetime
 import json
 import math
 import os
 import random
 
+from dougbot.common import timeutils
 
-class PetHandler:
-
-    @staticmethod
-    def savedata(json_object):
-        thefile = os.path.join(os.path.dirname(__file__), 'currentPetData.txt')
-
-        json_objects = {'tama': []}
-        json_objects['tama'].append(json_object)
-
-        with open(thefile, 'w') as outfile:
-            json.dump(json_objects, outfile, indent=2)
 
-    @staticmethod
-    def getcurrentpet():
-        package_dir = os.path.dirname(os.path.abspath(__file__))
-        thefile = os.path.join(package_dir, 'currentPetData.txt')
-        with open(thefile) as json_file:
-            json_object = json.load(json_file)
-
-        pet = json_object['tama'][0]
-        return pet
+class PetHandler:
 
     @staticmethod
     def currenthealth(json_object, amount):
@@ -52,7 +33,7 @@ class PetHandler:
                 json_object['food'] = 100
             else:
                 json_object['food'] = currentamount + amount
-            json_object['lastfeed'] = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+            json_object['lastfeed'] = timeutils.format_stamp()
         if amount < 0:
             if 0 > (currentamount + amount):
                 json_object['food'] = 0
@@ -68,7 +49,7 @@ class PetHandler:
                 json_object['water'] = 100
             else:
                 json_object['water'] = currentamount + amount
-            json_object['lastwatered'] = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+            json_object['lastwatered'] = timeutils.format_stamp()
         if amount < 0:
             if 0 > (currentamount + amount):
                 json_object['water'] = 0
@@ -85,7 +66,7 @@ class PetHandler:
                 json_object['cleanliness'] = 100
             else:
                 json_object['cleanliness'] = currentamount + amount
-            json_object['lastcleaned'] = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+            json_object['lastcleaned'] = timeutils.format_stamp()
         if amount < 0:
             if 0 > (currentamount + amount):
                 json_object['cleanliness'] = 0
@@ -102,7 +83,7 @@ class PetHandler:
                 json_object['happiness'] = 100
             else:
                 json_object['happiness'] = currentamount + amount
-            json_object['lastpet'] = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+            json_object['lastpet'] = timeutils.format_stamp()
         if amount < 0:
             if 0 > (currentamount + amount):
                 json_object['happiness'] = 0
@@ -121,17 +102,17 @@ class PetHandler:
     @staticmethod
     def death(json_object, reason):
         json_object['deathreason'] = reason
-        json_object['deathdate'] = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+        json_object['deathdate'] = timeutils.format_stamp()
 
         return json_object
 
     @staticmethod
     def checkpet(json_object):
-        currentdate = datetime.datetime.now()
-        lastdate = datetime.datetime.strptime(json_object['lastchecked'], '%m/%d/%y %H:%M:%S')
-        foodlastdate = datetime.datetime.strptime(json_object['lastfeed'], '%m/%d/%y %H:%M:%S')
-        waterlastdate = datetime.datetime.strptime(json_object['lastwatered'], '%m/%d/%y %H:%M:%S')
-        cleanlastdate = datetime.datetime.strptime(json_object['lastcleaned'], '%m/%d/%y %H:%M:%S')
+        currentdate = timeutils.local_now()
+        lastdate = timeutils.parse_stamp(json_object['lastchecked'])
+        foodlastdate = timeutils.parse_stamp(json_object['lastfeed'])
+        waterlastdate = timeutils.parse_stamp(json_object['lastwatered'])
+        cleanlastdate = timeutils.parse_stamp(json_object['lastcleaned'])
 
         delta = currentdate - lastdate
         fooddelta = currentdate - foodlastdate
@@ -165,7 +146,7 @@ class PetHandler:
             if json_object['food'] < 60 and json_object['water'] < 60 and json_object['cleanliness'] < 60:
                 json_object = PetHandler.happy(json_object, -(hourspassed * 5))
 
-        json_object['lastchecked'] = currentdate.strftime('%m/%d/%y %H:%M:%S')
+        json_object['lastchecked'] = timeutils.format_stamp(currentdate)
 
         return json_object
 
@@ -260,10 +241,10 @@ class PetHandler:
 
         json_object = {
             'name': name,
-            'lastchecked': datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S'),
+            'lastchecked': timeutils.format_stamp(),
             'type': 'bird',
             'level': 1,
-            'birthdate': datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S'),
+            'birthdate': timeutils.format_stamp(),
             'deathdate': '',
             'deathreason': '',
             'maxhealth': 100,
@@ -271,19 +252,18 @@ class PetHandler:
             'attack': 1,
             'defence': 1,
             'happiness': 50,
-            'lastpet': datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S'),
+            'lastpet': timeutils.format_stamp(),
             'food': 50,
-            'lastfeed': datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S'),
+            'lastfeed': timeutils.format_stamp(),
             'water': 50,
-            'lastwatered': datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S'),
+            'lastwatered': timeutils.format_stamp(),
             'cleanliness': 50,
-            'lastcleaned': datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S'),
+            'lastcleaned': timeutils.format_stamp(),
             'interactedlist': {},
             'totalinteractions': 0
 
         }
 
-        PetHandler.savedata(json_object)
         return json_object
 
     @staticmethod
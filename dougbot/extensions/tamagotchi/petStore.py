@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dougbot.common.fileutils import atomic_write
+
+
+class PetStore:
+    """
+    Keeps the current pet in memory; commands change it under a lock and flush() writes it to the file only when it has
+    changed since the last write
+    """
+    THREAD_POOL: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+
+    def __init__(self, path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'currentPetData.txt')):
+        self._path = path
+        self._pet = None
+        self._lock = asyncio.Lock()
+
+        # Changes count up the version; a write only replaces the file with a newer version than it holds
+        self._version = 0
+        self._written_version = 0
+        self._write_lock = threading.Lock()
+
+    async def current(self):
+        """
+        :return: The pet, only to read; change it through modify()
+        """
+        async with self._lock:
+            return await self._load()
+
+    @contextlib.asynccontextmanager
+    async def modify(self):
+        """
+        Holds the pet for one command's changes, so changes from commands at the same time are never lost:
+            async with store.modify() as pet:
+                PetHandler.feed(pet, 20)
+        """
+        async with self._lock:
+            pet = await self._load()
+            try:
+                yield pet
+            finally:
+                self._version += 1
+
+    async def replace(self, pet):
+        async with self._lock:
+            self._pet = pet
+            self._version += 1
+
+    def unsaved(self):
+        """
+        :return: The pet when it has changed since the last write, else None
+        """
+        return self._pet if self._version > self._written_version else None
+
+    async def restore(self, pet):
+        """
+        Takes back a pet saved by unsaved(), written out by the next flush
+        """
+        await self.replace(pet)
+
+    async def flush(self):
+        async with self._lock:
+            if self._version <= self._written_version:
+                return
+            version, data = self._version, self._serialize()
+
+        await asyncio.get_running_loop().run_in_executor(self.THREAD_POOL, self._write, version, data)
+
+    def flush_now(self):
+        """
+        Writes the pet before returning, for when the event loop may not run the write, like at shutdown
+        """
+        if self._version > self._written_version:
+            self._write(self._version, self._serialize())
+
+    async def _load(self):
+        if self._pet is None:
+            self._pet = await asyncio.get_running_loop().run_in_executor(self.THREAD_POOL, self._read)
+        return self._pet
+
+    def _read(self):
+        with open(self._path) as json_file:
+            return json.load(json_file)['tama'][0]
+
+    def _serialize(self):
+        return json.dumps({'tama': [self._pet]}, indent=2)
+
+    def _write(self, version, data):
+        with self._write_lock:
+            if version <= self._written_version:
+                return
+
+            with atomic_write(self._path, 'w') as outfile:
+                outfile.write(data)
+            self._written_version = version
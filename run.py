@@ -1,7 +1,5 @@
 import sys
 
-from dougbot.core.bot import DougBot
-
 try:
     assert sys.version_info >= (3, 10)
 except AssertionError:
@@ -10,6 +8,14 @@ except AssertionError:
 
 
 def main():
+    # Imported here rather than at the top, as worker processes import this module again and shouldn't load the bot
+    from dougbot.core import profiler
+
+    profiler.start()
+
+    from dougbot.core.bot import DougBot
+
+    profiler.mark('imports')
     DougBot().run()
 
 
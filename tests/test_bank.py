@@ -0,0 +1,136 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from dougbot import config
+from dougbot.common import database
+from dougbot.common.bankerrors import BankError, InsufficientFundsError
+from dougbot.common.database import Database
+from dougbot.extensions.bank import bank
+from dougbot.extensions.bank.bank import Bank
+
+
+class BankTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, 'test.db')
+        self.db = Database(database._SQLiteDriver(self._path, 2), 2, 1, 30)
+
+        configs = SimpleNamespace(bank_flush_rows=100, bank_flush_secs=60, bank_starting_balance=100)
+        patches = [mock.patch.object(config, 'get_configuration', return_value=configs),
+                   mock.patch.object(bank, 'get_database', return_value=self.db)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.bank = Bank(None)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self._dir.cleanup()
+
+    def _balances(self):
+        # Straight from the file, so only what was committed is seen
+        with sqlite3.connect(self._path) as conn:
+            return dict(conn.execute('SELECT account_id, balance FROM bank_accounts').fetchall())
+
+    def _journal(self):
+        with sqlite3.connect(self._path) as conn:
+            return conn.execute('SELECT txn_id, account_id, amount, balance FROM bank_journal '
+                                'ORDER BY rowid').fetchall()
+
+    async def _reload(self):
+        """
+        :return: The unloaded bank
+        """
+        old = self.bank
+        old.cog_unload()
+        self.bank = Bank(None)
+        return old
+
+    async def test_new_account_starts_with_starting_balance(self):
+        self.assertEqual(100, await self.bank.balance(1))
+
+    async def test_deposit_and_withdraw(self):
+        self.assertEqual(150, await self.bank.deposit(1, 50, 'test'))
+        self.assertEqual(120, await self.bank.withdraw(1, 30, 'test'))
+
+        await self.bank.flush()
+        self.assertEqual({1: 120}, self._balances())
+        self.assertEqual([(1, 50, 150), (1, -30, 120)], [row[1:] for row in self._journal()])
+
+    async def test_withdraw_more_than_balance_takes_nothing(self):
+        with self.assertRaises(InsufficientFundsError) as raised:
+            await self.bank.withdraw(1, 101, 'test')
+
+        self.assertEqual(100, raised.exception.balance)
+        self.assertEqual(100, await self.bank.balance(1))
+        await self.bank.flush()
+        self.assertEqual([], self._journal())
+
+    async def test_transfer_moves_both_balances_under_one_transaction(self):
+        self.assertEqual((70, 130), await self.bank.transfer(1, 2, 30, 'test'))
+
+        await self.bank.flush()
+        journal = self._journal()
+        self.assertEqual({1: 70, 2: 130}, self._balances())
+        self.assertEqual(1, len({txn_id for txn_id, *_ in journal}))
+
+    async def test_invalid_amounts_are_refused(self):
+        for amount in (0, -5, 1.5):
+            with self.assertRaises(BankError):
+                await self.bank.deposit(1, amount, 'test')
+        with self.assertRaises(BankError):
+            await self.bank.transfer(1, 1, 10, 'test')
+
+    async def test_concurrent_withdrawals_never_overdraw(self):
+        results = await asyncio.gather(*[self.bank.withdraw(1, 30, 'test') for _ in range(5)], return_exceptions=True)
+
+        self.assertEqual(3, sum(1 for result in results if isinstance(result, int)))
+        self.assertEqual(10, await self.bank.balance(1))
+
+    async def test_database_close_writes_buffered_changes(self):
+        await self.bank.deposit(1, 5, 'test')
+        await self.db.close()
+
+        self.assertEqual({1: 105}, self._balances())
+
+    async def test_reload_reads_balances_the_unloaded_bank_still_held(self):
+        await self.bank.deposit(1, 50, 'test')
+        await self._reload()
+
+        self.assertEqual(150, await self.bank.balance(1))
+
+    async def test_unloaded_bank_cannot_overwrite_newer_balances(self):
+        old = self.bank
+        await old.deposit(1, 50, 'test')
+        await self._reload()
+
+        with self.assertRaises(RuntimeError):
+            await old.deposit(1, 1000, 'late')
+        self.assertEqual(150, await old.balance(1))
+
+        self.assertEqual(120, await self.bank.withdraw(1, 30, 'test'))
+        await asyncio.sleep(0)  # Lets the unloaded bank's close run
+        await self.db.close()
+
+        self.assertEqual({1: 120}, self._balances())
+        self.assertEqual([50, -30], [amount for _, _, amount, _ in self._journal()])
+
+    async def test_reloads_leave_one_close_callback(self):
+        for _ in range(3):
+            await self.bank.deposit(1, 1, 'test')
+            old = await self._reload()
+            await old._writes.aclose()  # Already started by the unload; waits for it to finish
+
+        self.assertEqual(1, len(self.db._close_callbacks))
+        self.assertEqual(103, await self.bank.balance(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
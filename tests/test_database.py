@@ -0,0 +1,188 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from dougbot import config
+from dougbot.common import database
+from dougbot.common.database import Database, DatabaseError
+
+
+class _PreparingSQLiteDriver(database._SQLiteDriver):
+    """
+    SQLite with the driver-side statement cache MySQL uses, so the pool's prepared statement handling runs
+    """
+    prepares = True
+
+    @staticmethod
+    def prepared_cursor(raw):
+        return raw.cursor()
+
+
+class DatabaseTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, 'test.db')
+        self.db = Database(database._SQLiteDriver(self._path, 2), 2, 0.2, 30)
+
+        self.connects = 0
+        connect = self.db._driver.connect
+
+        def counting_connect():
+            self.connects += 1
+            return connect()
+
+        self.db._driver.connect = counting_connect
+        await self.db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self._dir.cleanup()
+
+    async def test_get_database_uses_configured_sqlite_file(self):
+        configs = SimpleNamespace(database_sqlite_path=self._path, database_statement_cache_size=2,
+                                  database_pool_size=2, database_acquire_timeout_secs=0.2,
+                                  database_health_check_secs=30)
+        with mock.patch.object(config, 'get_configuration', return_value=configs), \
+                mock.patch.object(database, '_DATABASE', None):
+            shared = database.get_database()
+            try:
+                self.assertIsInstance(shared._driver, database._SQLiteDriver)
+                self.assertIs(shared, database.get_database())
+                await shared.execute('INSERT INTO items (name) VALUES (?)', ('a',))
+            finally:
+                await database.close_database()
+
+        self.assertEqual((1,), await self.db.fetch_one('SELECT count(*) FROM items'))
+
+    async def test_sequential_queries_reuse_one_connection(self):
+        for i in range(5):
+            await self.db.execute('INSERT INTO items (name) VALUES (?)', (str(i),))
+        self.assertEqual((5,), await self.db.fetch_one('SELECT count(*) FROM items'))
+        self.assertEqual(1, self.connects)
+
+    async def test_concurrent_queries_open_at_most_pool_size_connections(self):
+        await asyncio.gather(*[self.db.execute('INSERT INTO items (name) VALUES (?)', (str(i),)) for i in range(20)])
+        self.assertEqual((20,), await self.db.fetch_one('SELECT count(*) FROM items'))
+        self.assertLessEqual(self.connects, 2)
+
+    async def test_acquire_times_out_when_pool_is_exhausted(self):
+        held = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with self.db._connection():
+                held.set()
+                await release.wait()
+
+        holders = [asyncio.ensure_future(hold()) for _ in range(2)]
+        await held.wait()
+        await asyncio.sleep(0)
+
+        start = time.monotonic()
+        with self.assertRaises(DatabaseError):
+            await self.db.fetch_all('SELECT 1')
+        self.assertLess(time.monotonic() - start, 2)
+
+        release.set()
+        await asyncio.gather(*holders)
+        self.assertEqual((1,), await self.db.fetch_one('SELECT 1'))
+
+    async def test_transaction_commits(self):
+        async with self.db.transaction() as tx:
+            await tx.execute('INSERT INTO items (name) VALUES (?)', ('a',))
+            await tx.execute('INSERT INTO items (name) VALUES (?)', ('b',))
+        self.assertEqual([('a',), ('b',)], await self.db.fetch_all('SELECT name FROM items ORDER BY id'))
+
+    async def test_transaction_rolls_back_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            async with self.db.transaction() as tx:
+                await tx.execute('INSERT INTO items (name) VALUES (?)', ('a',))
+                raise RuntimeError()
+
+        self.assertEqual((0,), await self.db.fetch_one('SELECT count(*) FROM items'))
+        self.assertEqual(1, len(self.db._idle))  # The connection is still good, so it went back in the pool
+
+    async def test_parameters_are_never_formatted_into_sql(self):
+        name = "x'); DROP TABLE items; --"
+        await self.db.execute('INSERT INTO items (name) VALUES (?)', (name,))
+        self.assertEqual((name,), await self.db.fetch_one('SELECT name FROM items'))
+
+    async def test_stale_unhealthy_connection_is_replaced(self):
+        await self.db.fetch_one('SELECT 1')
+        stale = self.db._idle[-1]
+        stale.raw.close()
+        stale.last_used -= 60  # Older than health_check_secs, so it's pinged before use
+
+        self.assertEqual((1,), await self.db.fetch_one('SELECT 1'))
+        self.assertEqual(2, self.connects)
+        self.assertNotIn(stale, self.db._idle)
+
+    async def test_connection_broken_during_query_leaves_pool(self):
+        await self.db.fetch_one('SELECT 1')
+        broken = self.db._idle[-1]
+        broken.raw.close()  # Recently used, so it's handed out without a ping and the query fails
+
+        with self.assertRaises(Exception):
+            await self.db.fetch_one('SELECT 1')
+        self.assertNotIn(broken, self.db._idle)
+
+        self.assertEqual((1,), await self.db.fetch_one('SELECT 1'))
+
+    async def test_failed_query_keeps_healthy_connection(self):
+        await self.db.fetch_one('SELECT 1')
+        conn = self.db._idle[-1]
+
+        with self.assertRaises(Exception):
+            await self.db.fetch_one('SELECT * FROM missing')
+        self.assertEqual([conn], self.db._idle)
+
+
+class PreparedStatementTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.db = Database(_PreparingSQLiteDriver(os.path.join(self._dir.name, 'test.db'), 2), 1, 1, 30)
+        await self.db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self._dir.cleanup()
+
+    def _statements(self):
+        return self.db._idle[-1]._statements
+
+    async def test_same_sql_reuses_prepared_statement(self):
+        sql = 'INSERT INTO items (name) VALUES (?)'
+        await self.db.execute(sql, ('a',))
+        cursor = self._statements()[sql]
+
+        await self.db.execute(sql, ('b',))
+        self.assertIs(cursor, self._statements()[sql])
+        self.assertEqual((2,), await self.db.fetch_one('SELECT count(*) FROM items'))
+
+    async def test_least_recently_used_statement_is_evicted(self):
+        first, second, third = 'SELECT 1', 'SELECT 2', 'SELECT 3'
+        await self.db.fetch_one(first)
+        await self.db.fetch_one(second)
+        await self.db.fetch_one(first)  # Now second is the least recently used
+        await self.db.fetch_one(third)
+
+        self.assertEqual([first, third], list(self._statements()))
+
+    async def test_close_closes_prepared_statements(self):
+        await self.db.fetch_one('SELECT 1')
+        statements = dict(self._statements())
+
+        await self.db.close()
+        for cursor in statements.values():
+            with self.assertRaises(Exception):
+                cursor.execute('SELECT 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from dougbot.common import database
+from dougbot.common.database import Database
+from dougbot.common.writebehind import WriteBehind
+
+
+class WriteBehindTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, 'test.db')
+        self.db = Database(database._SQLiteDriver(self._path, 2), 2, 1, 30)
+        await self.db.execute('CREATE TABLE events (id INTEGER, name TEXT)')
+        await self.db.execute('CREATE TABLE totals (id INTEGER PRIMARY KEY, total INTEGER)')
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self._dir.cleanup()
+
+    def _writes(self, name=None):
+        return WriteBehind(self.db, max_rows=100, flush_secs=60, name=name)
+
+    def _read(self, sql):
+        # Straight from the file, so only what was committed is seen
+        with sqlite3.connect(self._path) as conn:
+            return conn.execute(sql).fetchall()
+
+    async def test_rows_are_written_only_when_flushed(self):
+        writes = self._writes()
+        writes.append('events', ('id', 'name'), (1, 'a'))
+        writes.append('events', ('id', 'name'), (2, 'b'))
+        self.assertEqual([], self._read('SELECT * FROM events'))
+
+        await writes.flush()
+        self.assertEqual([(1, 'a'), (2, 'b')], self._read('SELECT * FROM events ORDER BY id'))
+        self.assertFalse(writes.has_pending())
+
+    async def test_upserts_keep_only_the_last_row_per_key(self):
+        writes = self._writes()
+        for total in (1, 2, 3):
+            writes.upsert('totals', ('id',), ('id', 'total'), (7, total))
+        await writes.flush()
+
+        writes.upsert('totals', ('id',), ('id', 'total'), (7, 4))
+        await writes.flush()
+        self.assertEqual([(7, 4)], self._read('SELECT * FROM totals'))
+
+    async def test_full_table_flushes_without_waiting(self):
+        writes = WriteBehind(self.db, max_rows=2, flush_secs=60)
+        writes.append('events', ('id', 'name'), (1, 'a'))
+        writes.append('events', ('id', 'name'), (2, 'b'))
+        await writes._size_flush
+
+        self.assertEqual(2, len(self._read('SELECT * FROM events')))
+
+    async def test_database_close_flushes_buffered_rows(self):
+        writes = self._writes()
+        writes.append('events', ('id', 'name'), (1, 'a'))
+        writes.upsert('totals', ('id',), ('id', 'total'), (1, 10))
+
+        await self.db.close()
+        self.assertEqual([(1, 'a')], self._read('SELECT * FROM events'))
+        self.assertEqual([(1, 10)], self._read('SELECT * FROM totals'))
+
+    async def test_failed_flush_keeps_rows_for_the_next(self):
+        writes = self._writes()
+        writes.append('missing', ('id',), (1,))
+        with self.assertRaises(Exception):
+            await writes.flush()
+        self.assertTrue(writes.has_pending())
+
+        await self.db.execute('CREATE TABLE missing (id INTEGER)')
+        await writes.flush()
+        self.assertEqual([(1,)], self._read('SELECT * FROM missing'))
+
+    async def test_closed_buffer_refuses_rows_and_leaves_database(self):
+        writes = self._writes()
+        writes.append('events', ('id', 'name'), (1, 'a'))
+        await writes.aclose()
+
+        self.assertEqual([(1, 'a')], self._read('SELECT * FROM events'))
+        self.assertEqual([], self.db._close_callbacks)
+        with self.assertRaises(RuntimeError):
+            writes.append('events', ('id', 'name'), (2, 'b'))
+
+    async def test_stopped_buffer_refuses_rows_straight_away(self):
+        writes = self._writes()
+        writes.stop()
+        with self.assertRaises(RuntimeError):
+            writes.upsert('totals', ('id',), ('id', 'total'), (1, 10))
+
+    async def test_replacement_flushes_previous_rows_first(self):
+        old = self._writes(name='totals')
+        old.upsert('totals', ('id',), ('id', 'total'), (1, 10))
+        old.stop()  # Unloaded before its rows were written
+
+        new = self._writes(name='totals')
+        new.upsert('totals', ('id',), ('id', 'total'), (1, 20))
+        await new.flush()
+        self.assertEqual([(1, 20)], self._read('SELECT * FROM totals'))
+
+        await old.aclose()  # Nothing left to write over the newer total
+        await self.db.close()
+        self.assertEqual([(1, 20)], self._read('SELECT * FROM totals'))
+
+    async def test_reloads_leave_one_close_callback(self):
+        for _ in range(3):
+            writes = self._writes(name='totals')
+            writes.append('events', ('id', 'name'), (1, 'a'))
+            writes.stop()
+            await writes.aclose()
+
+        self._writes(name='totals')
+        self.assertEqual(1, len(self.db._close_callbacks))
+        self.assertEqual(3, len(self._read('SELECT * FROM events')))
+
+
+if __name__ == '__main__':
+    unittest.main()